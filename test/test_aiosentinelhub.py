@@ -0,0 +1,153 @@
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from xcube_dcfs.aiosentinelhub import AsyncSentinelHub
+from xcube_dcfs.auth import TokenManager
+from xcube_dcfs.sentinelhub import SentinelHub, SentinelHubError
+from xcube_dcfs.standin import SentinelHubStandIn, new_tar_response
+
+
+@mock.patch.dict(os.environ, {'OAUTHLIB_INSECURE_TRANSPORT': '1'})
+class AsyncSentinelHubTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.stand_in = SentinelHubStandIn(throttle_every=5).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stand_in.stop()
+
+    def new_sentinel_hub(self, **kwargs) -> AsyncSentinelHub:
+        params = dict(token_cache_dir=None)
+        params.update(kwargs)
+        return AsyncSentinelHub('my-client', 'my-secret',
+                                api_url=self.stand_in.api_url,
+                                oauth2_url=self.stand_in.oauth2_url,
+                                **params)
+
+    @staticmethod
+    def new_token_manager(fetch_token) -> TokenManager:
+        return TokenManager('my-client', 'my-secret', 'https://auth/oauth/token', cache_dir=None,
+                            background_refresh=False, fetch_token=fetch_token)
+
+    def test_metadata(self):
+        async def main():
+            async with self.new_sentinel_hub() as sentinel_hub:
+                return (await sentinel_hub.dataset_names(),
+                        await sentinel_hub.band_names('DEM'),
+                        await sentinel_hub.token_info(),
+                        sentinel_hub.num_token_fetches)
+
+        dataset_names, band_names, token_info, num_token_fetches = asyncio.run(main())
+        self.assertIn('S2L1C', dataset_names)
+        self.assertEqual(['DEM'], band_names)
+        self.assertTrue(token_info['active'])
+        self.assertEqual(1, num_token_fetches)
+
+    def test_get_data(self):
+        request = SentinelHub.new_data_request('S2L1C', ['B02', 'B03'], (30, 20), sample_types='UINT8')
+
+        async def main():
+            async with self.new_sentinel_hub() as sentinel_hub:
+                return await sentinel_hub.get_data(request), await sentinel_hub.get_arrays(request)
+
+        (mime_type, data), arrays = asyncio.run(main())
+        self.assertEqual('application/tar', mime_type)
+        self.assertEqual(new_tar_response(30, 20, [('B02', 1, 'UINT8'), ('B03', 1, 'UINT8')]), data)
+        self.assertEqual((20, 30), arrays['B02'].shape)
+        self.assertEqual(np.uint8, arrays['B02'].dtype)
+
+    def test_get_data_concurrently(self):
+        requests = [SentinelHub.new_data_request('S2L1C', ['B02'], (10, 10 + i)) for i in range(20)]
+
+        def fetch_token():
+            time.sleep(0.01)
+            return dict(access_token='token', expires_in=3600)
+
+        async def main():
+            async with self.new_sentinel_hub(max_concurrency=4, pool_size=4,
+                                             token_manager=self.new_token_manager(fetch_token)) as sentinel_hub:
+                results = await asyncio.gather(*[sentinel_hub.get_data(request) for request in requests])
+                return results, sentinel_hub.num_token_fetches, sentinel_hub.instrumentation.snapshot()
+
+        results, num_token_fetches, snapshot = asyncio.run(main())
+        self.assertEqual(20, len(results))
+        self.assertEqual(1, num_token_fetches)
+        # Every fifth request is throttled by the stand-in and retried
+        self.assertGreater(snapshot['counters']['retries_total'], 0)
+        self.assertEqual(20, snapshot['counters']['requests_total'])
+        self.assertEqual(0, snapshot['counters']['errors_total'])
+
+    def test_iter_data(self):
+        request = SentinelHub.new_data_request('S2L1C', ['B02'], (100, 100))
+
+        async def main():
+            async with self.new_sentinel_hub() as sentinel_hub:
+                return [chunk async for chunk in sentinel_hub.iter_data(request, chunk_size=1024)]
+
+        chunks = asyncio.run(main())
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(len(chunk) <= 1024 for chunk in chunks))
+        self.assertEqual(new_tar_response(100, 100, [('B02', 1, 'FLOAT32')]), b''.join(chunks))
+
+    def test_slow_consumer_does_not_block_other_requests(self):
+        request_1 = SentinelHub.new_data_request('S2L1C', ['B02'], (100, 100))
+        request_2 = SentinelHub.new_data_request('S2L1C', ['B02'], (10, 10))
+
+        async def main():
+            async with self.new_sentinel_hub(max_concurrency=1) as sentinel_hub:
+                chunks = sentinel_hub.iter_data(request_1, chunk_size=1024)
+                first_chunk = await chunks.__anext__()
+                # The consumer of the first request has not taken the next chunk yet
+                _, data = await asyncio.wait_for(sentinel_hub.get_data(request_2), timeout=5)
+                rest = [chunk async for chunk in chunks]
+                return first_chunk + b''.join(rest), data
+
+        data_1, data_2 = asyncio.run(main())
+        self.assertEqual(new_tar_response(100, 100, [('B02', 1, 'FLOAT32')]), data_1)
+        self.assertEqual(new_tar_response(10, 10, [('B02', 1, 'FLOAT32')]), data_2)
+
+    def test_shares_token_cache(self):
+        async def main(token_cache_dir):
+            for _ in range(2):
+                async with self.new_sentinel_hub(token_cache_dir=token_cache_dir) as sentinel_hub:
+                    await sentinel_hub.dataset_names()
+
+        num_token_requests = self.stand_in.counters['token_requests']
+        with tempfile.TemporaryDirectory() as token_cache_dir:
+            asyncio.run(main(token_cache_dir))
+            self.assertEqual(1, len([f for f in os.listdir(token_cache_dir) if f.endswith('.json')]))
+        self.assertEqual(num_token_requests + 1, self.stand_in.counters['token_requests'])
+
+    def test_refreshes_expired_token(self):
+        num_fetches = [0]
+
+        def fetch_token():
+            num_fetches[0] += 1
+            return dict(access_token=f'token-{num_fetches[0]}', expires_in=3600)
+
+        async def main():
+            async with self.new_sentinel_hub(token_manager=self.new_token_manager(fetch_token)) as sentinel_hub:
+                await sentinel_hub.dataset_names()
+                # Pretend the token is about to expire
+                sentinel_hub.token['expires_at'] = 0
+                await sentinel_hub.dataset_names()
+                return sentinel_hub.token['access_token']
+
+        self.assertEqual('token-2', asyncio.run(main()))
+
+    def test_errors(self):
+        async def main():
+            async with self.new_sentinel_hub() as sentinel_hub:
+                await sentinel_hub.get_data({'output': {}})
+
+        with self.assertRaises(SentinelHubError) as cm:
+            asyncio.run(main())
+        self.assertEqual(400, cm.exception.status_code)
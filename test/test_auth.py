@@ -0,0 +1,105 @@
+import os
+import tempfile
+import time
+import unittest
+
+from xcube_dcfs.auth import TokenManager
+
+
+class TokenFetcherMock:
+    def __init__(self, expires_in=3600, fail_calls=()):
+        self.expires_in = expires_in
+        self.fail_calls = fail_calls
+        self.num_calls = 0
+
+    def __call__(self):
+        self.num_calls += 1
+        if self.num_calls in self.fail_calls:
+            raise OSError('token endpoint unavailable')
+        return dict(access_token=f'token-{self.num_calls}', token_type='Bearer', expires_in=self.expires_in)
+
+
+class TokenManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.temp_dir.name, 'tokens')
+        self.managers = []
+
+    def tearDown(self):
+        for manager in self.managers:
+            manager.close()
+        self.temp_dir.cleanup()
+
+    def new_manager(self, fetch_token, client_id='my-client', **kwargs):
+        params = dict(token_url='https://auth/oauth/token', cache_dir=self.cache_dir, background_refresh=False)
+        params.update(kwargs)
+        manager = TokenManager(client_id, 'my-secret', fetch_token=fetch_token, **params)
+        self.managers.append(manager)
+        return manager
+
+    def test_token_is_reused(self):
+        fetch_token = TokenFetcherMock()
+        manager = self.new_manager(fetch_token)
+        token = manager.get_token()
+        self.assertEqual('token-1', token['access_token'])
+        self.assertIn('expires_at', token)
+        self.assertIs(token, manager.get_token())
+        self.assertEqual(1, fetch_token.num_calls)
+
+    def test_token_is_shared_via_cache_dir(self):
+        fetch_token = TokenFetcherMock()
+        self.assertEqual('token-1', self.new_manager(fetch_token).get_token()['access_token'])
+        self.assertEqual('token-1', self.new_manager(fetch_token).get_token()['access_token'])
+        self.assertEqual(1, fetch_token.num_calls)
+        self.assertEqual('token-2', self.new_manager(fetch_token, client_id='other').get_token()['access_token'])
+        token_files = [f for f in os.listdir(self.cache_dir) if f.endswith('.json')]
+        self.assertEqual(2, len(token_files))
+        self.assertEqual(0o600, os.stat(os.path.join(self.cache_dir, token_files[0])).st_mode & 0o777)
+
+    def test_not_shared_without_cache_dir(self):
+        fetch_token = TokenFetcherMock()
+        self.new_manager(fetch_token, cache_dir=None).get_token()
+        self.new_manager(fetch_token, cache_dir=None).get_token()
+        self.assertEqual(2, fetch_token.num_calls)
+
+    def test_expired_token_is_replaced(self):
+        fetch_token = TokenFetcherMock(expires_in=0)
+        manager = self.new_manager(fetch_token)
+        self.assertEqual('token-1', manager.get_token()['access_token'])
+        self.assertEqual('token-2', manager.get_token()['access_token'])
+
+    def test_refresh_token(self):
+        fetch_token = TokenFetcherMock()
+        manager_1 = self.new_manager(fetch_token)
+        manager_2 = self.new_manager(fetch_token)
+        token_1 = manager_1.get_token()
+        self.assertEqual(token_1, manager_2.get_token())
+        # First process detects that token_1 is rejected
+        self.assertEqual('token-2', manager_1.refresh_token(token_1)['access_token'])
+        # Second process picks up the token refreshed by the first one
+        self.assertEqual('token-2', manager_2.refresh_token(token_1)['access_token'])
+        self.assertEqual(2, fetch_token.num_calls)
+
+    def test_background_refresh(self):
+        fetch_token = TokenFetcherMock(expires_in=0.2)
+        tokens = []
+        manager = self.new_manager(fetch_token, background_refresh=True)
+        manager.add_listener(tokens.append)
+        manager.get_token()
+        time.sleep(0.35)
+        manager.close()
+        self.assertGreaterEqual(fetch_token.num_calls, 2)
+        self.assertEqual(['token-1', 'token-2'], [token['access_token'] for token in tokens[:2]])
+
+    def test_failed_background_refresh_is_retried(self):
+        fetch_token = TokenFetcherMock(expires_in=0.4, fail_calls=(2,))
+        tokens = []
+        manager = self.new_manager(fetch_token, background_refresh=True, refresh_retry_delay=0.05)
+        manager.add_listener(tokens.append)
+        manager.get_token()
+        # Refreshed after 0.2 s, which fails, and retried 0.05 s later
+        time.sleep(0.35)
+        manager.close()
+        self.assertEqual(3, fetch_token.num_calls)
+        self.assertEqual(['token-1', 'token-3'], [token['access_token'] for token in tokens])
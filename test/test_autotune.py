@@ -0,0 +1,147 @@
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+
+from test.test_decoder import new_tar_content
+from test.test_sentinelhub import SessionMock, SessionResponseMock
+from xcube_dcfs.autotune import Autotuner, TuningSettings, fetch_tiles, load_settings, save_settings
+from xcube_dcfs.sentinelhub import SentinelHub, SentinelHubError
+from xcube_dcfs.template import RequestTemplate
+
+PROCESS_URL = 'https://services.sentinel-hub.com/api/v1/process'
+
+
+def simulate(autotuner: Autotuner, max_rounds: int = 50, overhead: float = 0.1, bandwidth: float = 8.0,
+             max_streams: int = 4):
+    """
+    Feed *autotuner* with requests that take *overhead* seconds plus the transfer time
+    at *bandwidth* MB/s, and take proportionally longer once there are more than *max_streams*.
+    """
+    t = 0.0
+    for _ in range(max_rounds):
+        if autotuner.converged:
+            break
+        settings = autotuner.settings
+        width, height = settings.tile_size
+        num_bytes = width * height * 4
+        latency = (overhead + num_bytes / 2 ** 20 / bandwidth) * max(1.0, settings.num_workers / max_streams)
+        while autotuner.settings == settings and not autotuner.converged:
+            for _ in range(settings.num_workers):
+                autotuner.observe(settings, t, t + latency, num_bytes)
+            t += latency
+
+
+class AutotunerTest(unittest.TestCase):
+
+    def test_bounds(self):
+        autotuner = Autotuner((256, 128), tile_size=(1000, 1000), num_workers=64, max_workers=8)
+        self.assertEqual(TuningSettings((512, 256), 8), autotuner.settings)
+        self.assertIsNone(autotuner.best)
+        self.assertEqual(TuningSettings((256, 128), 4), Autotuner((256, 128)).settings)
+        with self.assertRaises(ValueError):
+            Autotuner((512, 512), max_tile_size=(500, 500))
+        with self.assertRaises(ValueError):
+            Autotuner((512, 512), min_workers=4, max_workers=2)
+
+    def test_converges_to_large_tiles_and_saturating_workers(self):
+        autotuner = Autotuner((128, 128), num_workers=1, max_tile_size=(1024, 1024))
+        simulate(autotuner)
+        self.assertTrue(autotuner.converged)
+        # Larger tiles amortize the overhead, more than 4 workers only queue
+        self.assertEqual(TuningSettings((1024, 1024), 4), autotuner.best)
+        self.assertEqual(autotuner.best, autotuner.settings)
+        history = autotuner.history
+        self.assertEqual('start', history[0]['decision'])
+        self.assertEqual(((128, 128), 1), (history[0]['tile_size'], history[0]['num_workers']))
+        self.assertAlmostEqual(4 * 4 / 0.6, max(record['mb_per_sec'] for record in history))
+
+    def test_target_latency(self):
+        autotuner = Autotuner((128, 128), tile_size=(1024, 1024), num_workers=1, max_tile_size=(1024, 1024),
+                              target_latency=0.3)
+        simulate(autotuner)
+        self.assertTrue(autotuner.converged)
+        self.assertEqual('latency', autotuner.history[0]['decision'])
+        self.assertLessEqual(max(record['p95_latency'] for record in autotuner.history
+                                 if record['decision'] in ('start', 'kept')), 0.3)
+        self.assertEqual(TuningSettings((512, 512), 4), autotuner.best)
+
+    def test_stale_observations_are_ignored(self):
+        autotuner = Autotuner((128, 128), num_workers=1, min_round_size=2)
+        autotuner.observe(TuningSettings((256, 256), 1), 0.0, 1.0, 1000)
+        autotuner.observe(TuningSettings((256, 256), 1), 0.0, 1.0, 1000)
+        self.assertEqual([], autotuner.history)
+        self.assertEqual(TuningSettings((128, 128), 1), autotuner.settings)
+
+    def test_settings_are_recorded_per_dataset(self):
+        with tempfile.TemporaryDirectory() as settings_dir:
+            self.assertIsNone(load_settings('S2L2A', settings_dir=settings_dir))
+            autotuner = Autotuner.for_dataset('S2L2A', (128, 128), settings_dir=settings_dir, num_workers=1,
+                                              max_tile_size=(1024, 1024))
+            self.assertEqual(TuningSettings((128, 128), 1), autotuner.settings)
+            simulate(autotuner)
+            autotuner.save()
+            self.assertEqual(TuningSettings((1024, 1024), 4), load_settings('S2L2A', settings_dir=settings_dir))
+            self.assertIsNone(load_settings('S1GRD', settings_dir=settings_dir))
+
+            # Later runs start from the recorded settings, fitted to their chunk size
+            autotuner = Autotuner.for_dataset('S2L2A', (300, 300), settings_dir=settings_dir)
+            self.assertEqual(TuningSettings((600, 600), 4), autotuner.settings)
+            save_settings('S1GRD', TuningSettings((512, 512), 2), settings_dir=settings_dir)
+            self.assertEqual(TuningSettings((1024, 1024), 4), load_settings('S2L2A', settings_dir=settings_dir))
+
+
+class FetchTilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.sizes = []
+        self.sentinel_hub = SentinelHub(session=SessionMock({'post': {PROCESS_URL: self._process}}))
+
+    def tearDown(self):
+        self.sentinel_hub.close()
+
+    def _process(self, request):
+        x1, _, _, y2 = request['input']['bounds']['bbox']
+        width = request['output']['width']
+        height = request['output']['height']
+        with self.lock:
+            self.sizes.append((width, height))
+        # Encode the global pixel position into the values
+        x = np.round((x1 + (np.arange(width) + 0.5) * 0.1) * 10 - 0.5)
+        y = np.round((5.0 - y2 + (np.arange(height) + 0.5) * 0.1) * 10 - 0.5)
+        return new_tar_content(dict(B04=(1000 * y[:, np.newaxis] + x[np.newaxis, :]).astype(np.float32)))
+
+    def test_fetch_tiles(self):
+        autotuner = Autotuner((4, 4), num_workers=2, max_tile_size=(16, 16), min_round_size=2)
+        template = RequestTemplate('S2L2A', ['B04'])
+        output = np.full((50, 100), np.nan, dtype=np.float32)
+        covered = np.zeros((50, 100), dtype=np.int64)
+        for tile, arrays in fetch_tiles(self.sentinel_hub, template, (0.0, 0.0, 10.0, 5.0), 0.1,
+                                        autotuner=autotuner):
+            # Tiles are aligned to the chunk grid
+            self.assertEqual((tile.x // 4, tile.y // 4), (tile.tile_x, tile.tile_y))
+            self.assertTrue(tile.width % 4 == 0 or tile.x + tile.width == 100)
+            self.assertTrue(tile.height % 4 == 0 or tile.y + tile.height == 50)
+            output[tile.y: tile.y + tile.height, tile.x: tile.x + tile.width] = arrays['B04']
+            covered[tile.y: tile.y + tile.height, tile.x: tile.x + tile.width] += 1
+        np.testing.assert_equal(1, covered)
+        np.testing.assert_equal(1000 * np.arange(50)[:, np.newaxis] + np.arange(100)[np.newaxis, :], output)
+        # The tiles have grown
+        self.assertEqual((4, 4), self.sizes[0])
+        self.assertGreater(max(self.sizes), (4, 4))
+        self.assertIsNotNone(autotuner.best)
+
+    def test_fetch_tiles_fails(self):
+        def process(_):
+            return SessionResponseMock(content=b'', status_code=500, reason='Internal Server Error')
+
+        sentinel_hub = SentinelHub(session=SessionMock({'post': {PROCESS_URL: process}}), max_retries=0)
+        with tempfile.TemporaryDirectory() as settings_dir:
+            autotuner = Autotuner((4, 4), dataset_name='S2L2A', settings_dir=settings_dir)
+            with self.assertRaises(SentinelHubError):
+                list(fetch_tiles(sentinel_hub, RequestTemplate('S2L2A', ['B04']), (0.0, 0.0, 10.0, 5.0), 0.1,
+                                 autotuner=autotuner))
+            self.assertIsNone(load_settings('S2L2A', settings_dir=settings_dir))
+        sentinel_hub.close()
@@ -0,0 +1,99 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from xcube_dcfs.cache import ResponseCache, canonicalize_request, request_hash
+from xcube_dcfs.sentinelhub import SentinelHub
+
+
+class CanonicalizeRequestTest(unittest.TestCase):
+
+    def test_key_order_and_containers(self):
+        self.assertEqual(canonicalize_request({'b': [1, 2], 'a': (0.5, 'x')}),
+                         canonicalize_request({'a': [0.5, 'x'], 'b': (1, 2)}))
+        self.assertEqual(b'{"a":[0.5,"x"],"b":[1,2]}', canonicalize_request({'b': [1, 2], 'a': (0.5, 'x')}))
+
+    def test_floats_are_normalized(self):
+        self.assertEqual(canonicalize_request({'bbox': [0.1 + 0.2, 10.0, np.float64(45.85)]}),
+                         canonicalize_request({'bbox': [0.3, 10, 45.85]}))
+
+    def test_request_hash(self):
+        request = SentinelHub.new_data_request('S2L1C', ['B02'], (512, 512), bbox=(13.822, 45.85, 14.559, 46.291))
+        same_request = SentinelHub.new_data_request('S2L1C', ['B02'], (512, 512),
+                                                    bbox=[13.822, 45.85, 14.559, 46.291])
+        other_request = SentinelHub.new_data_request('S2L1C', ['B03'], (512, 512),
+                                                     bbox=(13.822, 45.85, 14.559, 46.291))
+        self.assertEqual(64, len(request_hash(request)))
+        self.assertEqual(request_hash(request), request_hash(same_request))
+        self.assertNotEqual(request_hash(request), request_hash(other_request))
+        self.assertEqual(request_hash(request, api_url='https://services.sentinel-hub.com/api/v1/'),
+                         request_hash(request, api_url='https://services.sentinel-hub.com/api/v1'))
+        self.assertNotEqual(request_hash(request, api_url='https://services.sentinel-hub.com/api/v1'),
+                            request_hash(request, api_url='https://creodias.sentinel-hub.com/api/v1'))
+
+
+class ResponseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.temp_dir.name, 'cache')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_get_put(self):
+        cache = ResponseCache(self.directory)
+        self.assertIsNone(cache.get('abcdef'))
+        cache.put('abcdef', b'123')
+        self.assertEqual(b'123', cache.get('abcdef'))
+        self.assertEqual(dict(hits=1, misses=1, puts=1, evictions=0, size=3), cache.stats)
+        self.assertEqual([], [f for f in os.listdir(os.path.join(self.directory, 'ab')) if f.startswith('.tmp-')])
+
+    def test_put_replaces(self):
+        cache = ResponseCache(self.directory, max_size=25)
+        cache.put('k1', 10 * b'x')
+        cache.put('k2', 10 * b'y')
+        for _ in range(3):
+            cache.put('k1', 5 * b'z')
+        self.assertEqual(dict(hits=0, misses=0, puts=5, evictions=0, size=15), cache.stats)
+        self.assertEqual(10 * b'y', cache.get('k2'))
+        self.assertEqual(5 * b'z', cache.get('k1'))
+
+    def test_get_without_utime(self):
+        cache = ResponseCache(self.directory)
+        cache.put('abcdef', b'123')
+        with mock.patch('os.utime', side_effect=PermissionError('read-only')):
+            self.assertEqual(b'123', cache.get('abcdef'))
+        self.assertEqual(1, cache.stats['hits'])
+        self.assertEqual(0, cache.stats['misses'])
+
+    def test_persistent(self):
+        ResponseCache(self.directory).put('abcdef', b'123')
+        cache = ResponseCache(self.directory)
+        self.assertEqual(3, cache.stats['size'])
+        self.assertEqual(b'123', cache.get('abcdef'))
+
+    def test_lru_eviction(self):
+        cache = ResponseCache(self.directory, max_size=25)
+        for i, key in enumerate(['k1', 'k2', 'k3']):
+            cache.put(key, 10 * b'x')
+            os.utime(cache._entry_path(key), (1000 + i, 1000 + i))
+            if key == 'k2':
+                # Access k1 so that k2 becomes the least recently used entry
+                self.assertIsNotNone(cache.get('k1'))
+                os.utime(cache._entry_path('k1'), (1002, 1002))
+        self.assertIsNone(cache.get('k2'))
+        self.assertIsNotNone(cache.get('k1'))
+        self.assertIsNotNone(cache.get('k3'))
+        self.assertEqual(1, cache.stats['evictions'])
+        self.assertEqual(20, cache.stats['size'])
+
+    def test_clear(self):
+        cache = ResponseCache(self.directory)
+        cache.put('abcdef', b'123')
+        cache.clear()
+        self.assertIsNone(cache.get('abcdef'))
+        self.assertEqual(0, cache.stats['size'])
@@ -0,0 +1,99 @@
+import math
+import tempfile
+import threading
+import time
+import unittest
+
+import numpy as np
+
+from test.test_sentinelhub import SessionMock
+from xcube_dcfs.catalog import BandDescriptor, MetadataCatalog
+from xcube_dcfs.encoding import ANGLE_BANDS, MASK_BANDS, plan_encoding
+from xcube_dcfs.sentinelhub import SentinelHub
+
+API_URL = 'https://services.sentinel-hub.com/api/v1'
+
+DATASETS = {
+    'S2L1C': ['B01', 'B02', 'B04', 'CLM', 'dataMask'],
+    'DEM': ['DEM'],
+}
+
+
+class MetadataCatalogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.urls = []
+        mapping = {API_URL + '/process/dataset': self._get(dict(data=list(DATASETS.keys())))}
+        for dataset_name, band_names in DATASETS.items():
+            mapping[API_URL + f'/process/dataset/{dataset_name}/bands'] = self._get(dict(data=band_names))
+        self.sentinel_hub = SentinelHub(session=SessionMock({'get': mapping}))
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+        self.sentinel_hub.close()
+
+    def _get(self, obj):
+        def get(_):
+            with self.lock:
+                self.urls.append(obj)
+            return obj
+
+        return get
+
+    def test_served_from_memory(self):
+        catalog = MetadataCatalog(self.sentinel_hub, cache_dir=None)
+        self.assertEqual(['S2L1C', 'DEM'], catalog.dataset_names)
+        self.assertEqual(3, len(self.urls))
+        for _ in range(3):
+            self.assertEqual(DATASETS['S2L1C'], catalog.band_names('S2L1C'))
+            self.assertEqual(['DEM'], catalog.band_names('DEM'))
+        self.assertEqual(3, len(self.urls))
+        self.assertEqual(1, catalog.num_fetches)
+        with self.assertRaises(ValueError):
+            catalog.band_names('S2L2A')
+
+    def test_ttl(self):
+        catalog = MetadataCatalog(self.sentinel_hub, ttl=0.05, cache_dir=None)
+        catalog.prefetch()
+        time.sleep(0.1)
+        catalog.prefetch()
+        self.assertEqual(2, catalog.num_fetches)
+        catalog.refresh()
+        self.assertEqual(3, catalog.num_fetches)
+
+    def test_persisted(self):
+        catalog = MetadataCatalog(self.sentinel_hub, cache_dir=self.temp_dir.name)
+        catalog.prefetch()
+        self.assertEqual(3, len(self.urls))
+
+        # A new process starts without requests
+        catalog = MetadataCatalog(self.sentinel_hub, cache_dir=self.temp_dir.name)
+        self.assertEqual(DATASETS['S2L1C'], catalog.band_names('S2L1C'))
+        self.assertEqual(0, catalog.num_fetches)
+        self.assertEqual(3, len(self.urls))
+
+        # Unless the file has expired
+        catalog = MetadataCatalog(self.sentinel_hub, cache_dir=self.temp_dir.name, ttl=0.0)
+        catalog.prefetch()
+        self.assertEqual(1, catalog.num_fetches)
+
+    def test_band_descriptors(self):
+        catalog = MetadataCatalog(self.sentinel_hub, cache_dir=None)
+        descriptors = catalog.band_descriptors('S2L1C', ['B02', 'CLM'])
+        self.assertEqual(['B02', 'CLM'], list(descriptors.keys()))
+        self.assertEqual(('B02', 'FLOAT32', 'reflectance'), descriptors['B02'][:3])
+        self.assertTrue(math.isnan(descriptors['B02'].fill_value))
+        self.assertEqual(BandDescriptor('CLM', 'UINT8', 'DN', 0), descriptors['CLM'])
+        self.assertEqual(np.uint8, descriptors['CLM'].dtype)
+        self.assertEqual('meters', catalog.band_descriptors('DEM')['DEM'].units)
+        with self.assertRaises(ValueError):
+            catalog.band_descriptors('S2L1C', ['B03'])
+
+    def test_band_descriptors_agree_with_encodings(self):
+        for band_name in MASK_BANDS:
+            descriptor = BandDescriptor.from_band_name(band_name)
+            self.assertEqual(plan_encoding(band_name, descriptor.units).sample_type, descriptor.sample_type)
+        for band_name in ANGLE_BANDS:
+            self.assertEqual('degrees', BandDescriptor.from_band_name(band_name).units)
@@ -0,0 +1,149 @@
+import gc
+import os
+import pickle
+import unittest
+import weakref
+from unittest import mock
+
+import dask
+import numpy as np
+
+from test.test_sentinelhub import SessionMock
+from xcube_dcfs.catalog import MetadataCatalog
+from xcube_dcfs.cube import open_cube
+from xcube_dcfs.decoder import decode_tar
+from xcube_dcfs.encoding import plan_encodings
+from xcube_dcfs.sentinelhub import SentinelHub
+from xcube_dcfs.standin import SentinelHubStandIn, new_tar_response
+
+
+@mock.patch.dict(os.environ, {'OAUTHLIB_INSECURE_TRANSPORT': '1'})
+class OpenCubeTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.stand_in = SentinelHubStandIn().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stand_in.stop()
+
+    def new_sentinel_hub(self) -> SentinelHub:
+        return SentinelHub('my-client', 'my-secret',
+                           api_url=self.stand_in.api_url,
+                           oauth2_url=self.stand_in.oauth2_url,
+                           token_cache_dir=None)
+
+    def open_cube(self, sentinel_hub: SentinelHub):
+        return open_cube('S2L1C', ['B02', 'B03'],
+                         bbox=(10.0, 50.0, 10.25, 50.15),
+                         resolution=0.01,
+                         time_range=('2019-01-01', '2019-01-03'),
+                         chunks=(10, 10),
+                         sample_types=['UINT8', 'FLOAT32'],
+                         sentinel_hub=sentinel_hub)
+
+    def test_open_cube(self):
+        sentinel_hub = self.new_sentinel_hub()
+        num_requests = self.stand_in.counters['process_requests']
+        cube = self.open_cube(sentinel_hub)
+        self.assertEqual(num_requests, self.stand_in.counters['process_requests'])
+        self.assertEqual(dict(time=2, lat=15, lon=25, bnds=2), dict(cube.sizes))
+        self.assertEqual(((1, 1), (10, 5), (10, 10, 5)), cube.B02.chunks)
+        self.assertEqual(np.uint8, cube.B02.dtype)
+        self.assertEqual(np.float32, cube.B03.dtype)
+        self.assertEqual('2019-01-01T00:00:00Z', cube.attrs['time_coverage_start'])
+        self.assertEqual(np.datetime64('2019-01-01T12:00'), cube.time.values[0])
+
+        values = cube.compute()
+        # One request per tile and time step for all bands
+        self.assertEqual(num_requests + 2 * 2 * 3, self.stand_in.counters['process_requests'])
+        expected = decode_tar(new_tar_response(10, 5, [('B02', 1, 'UINT8'), ('B03', 1, 'FLOAT32')]))
+        np.testing.assert_equal(expected['B02'], values.B02.values[1, 10:15, 0:10])
+        np.testing.assert_equal(expected['B03'], values.B03.values[0, 10:15, 10:20])
+        sentinel_hub.close()
+
+    def test_open_cube_with_catalog(self):
+        sentinel_hub = self.new_sentinel_hub()
+        catalog = MetadataCatalog(sentinel_hub, cache_dir=None)
+        cube = open_cube('S2L2A', ['B04', 'SCL'], bbox=(10.0, 50.0, 10.25, 50.15), resolution=0.01,
+                         time_range=('2019-01-01', '2019-01-03'), sentinel_hub=sentinel_hub, catalog=catalog)
+        self.assertEqual(np.float32, cube.B04.dtype)
+        self.assertEqual('reflectance', cube.B04.attrs['units'])
+        self.assertEqual(np.uint8, cube.SCL.dtype)
+        self.assertEqual('DN', cube.SCL.attrs['units'])
+        with self.assertRaises(ValueError):
+            open_cube('S2L1C', ['SCL'], bbox=(10.0, 50.0, 10.25, 50.15), resolution=0.01,
+                      time_range=('2019-01-01', '2019-01-03'), sentinel_hub=sentinel_hub, catalog=catalog)
+        self.assertEqual(1, catalog.num_fetches)
+        sentinel_hub.close()
+
+    def test_open_cube_with_encodings(self):
+        sentinel_hub = self.new_sentinel_hub()
+        cube = open_cube('S2L2A', ['B04', 'SCL'], bbox=(10.0, 50.0, 10.25, 50.15), resolution=0.01,
+                         time_range=('2019-01-01', '2019-01-03'), chunks=(10, 10), band_units=['reflectance', 'DN'],
+                         sentinel_hub=sentinel_hub, encodings=plan_encodings(['B04', 'SCL'], ['reflectance', 'DN']))
+        self.assertEqual(np.float32, cube.B04.dtype)
+        self.assertEqual(np.uint16, cube.B04.encoding['dtype'])
+        self.assertEqual(dict(scale_factor=np.float32(1e-4), _FillValue=65535, dtype=np.uint16),
+                         {k: cube.B04.encoding[k] for k in ('scale_factor', '_FillValue', 'dtype')})
+        self.assertEqual(np.uint8, cube.SCL.dtype)
+        values = cube.B04.isel(time=0, lat=slice(10, 15), lon=slice(0, 10)).values
+        expected = decode_tar(new_tar_response(10, 5, [('B04', 1, 'UINT16'), ('SCL', 1, 'UINT8')]))['B04']
+        np.testing.assert_almost_equal(np.where(expected == 65535, np.nan, expected * 1e-4), values)
+        sentinel_hub.close()
+
+    def test_open_cube_with_processes(self):
+        cube = self.open_cube(self.new_sentinel_hub())
+        with dask.config.set(scheduler='processes', num_workers=2):
+            values = cube.B02.isel(time=0).compute()
+        self.assertEqual((15, 25), values.shape)
+        self.assertEqual(np.uint8, values.dtype)
+
+
+@mock.patch.dict(os.environ, {'OAUTHLIB_INSECURE_TRANSPORT': '1'})
+class PickleSentinelHubTest(unittest.TestCase):
+
+    def test_pickle(self):
+        with SentinelHubStandIn() as stand_in:
+            sentinel_hub = SentinelHub('my-client', 'my-secret',
+                                       api_url=stand_in.api_url,
+                                       oauth2_url=stand_in.oauth2_url,
+                                       token_cache_dir=None)
+            self.assertEqual(['DEM'], sentinel_hub.band_names('DEM'))
+            self.assertEqual(1, stand_in.counters['token_requests'])
+
+            restored = pickle.loads(pickle.dumps(sentinel_hub))
+            self.assertIsNot(sentinel_hub, restored)
+            self.assertEqual(stand_in.api_url, restored.api_url)
+            # One client per process and configuration
+            self.assertIs(restored, pickle.loads(pickle.dumps(sentinel_hub)))
+            # Session and token are created on first use
+            self.assertIsNone(restored.token)
+            self.assertEqual(['DEM'], restored.band_names('DEM'))
+            self.assertEqual(2, stand_in.counters['token_requests'])
+            sentinel_hub.close()
+            restored.close()
+
+            # Unused clients and their credentials are not kept
+            restored_ref = weakref.ref(restored)
+            del restored
+            gc.collect()
+            self.assertIsNone(restored_ref())
+
+            # Not even if their token is refreshed in the background
+            restored = pickle.loads(pickle.dumps(sentinel_hub))
+            self.assertEqual(['DEM'], restored.band_names('DEM'))
+            token_manager = restored.token_manager
+            self.assertIsNotNone(token_manager._timer)
+            restored_ref = weakref.ref(restored)
+            del restored
+            gc.collect()
+            self.assertIsNone(restored_ref())
+            # The refresh timer has been cancelled
+            self.assertIsNone(token_manager._timer)
+
+    def test_pickle_with_custom_session(self):
+        sentinel_hub = SentinelHub(session=SessionMock({}))
+        with self.assertRaises(TypeError):
+            pickle.dumps(sentinel_hub)
@@ -0,0 +1,99 @@
+import io
+import tarfile
+import unittest
+from typing import Dict
+
+import numpy as np
+import tifffile
+
+from xcube_dcfs.decoder import decode_tar, decode_tar_memmap, decode_tar_stream, decode_tiff
+
+
+class DecoderTest(unittest.TestCase):
+
+    def test_decode_tar(self):
+        b02 = np.arange(12, dtype=np.float32).reshape((3, 4))
+        b03 = np.ones((3, 4), dtype=np.uint8)
+        arrays = decode_tar(new_tar_content(dict(B02=b02, B03=b03)))
+        self.assertEqual({'B02', 'B03'}, set(arrays.keys()))
+        np.testing.assert_equal(b02, arrays['B02'])
+        np.testing.assert_equal(b03, arrays['B03'])
+        self.assertEqual(np.uint8, arrays['B03'].dtype)
+
+    def test_decode_tar_ignores_other_members(self):
+        content = new_tar_content(dict(B02=np.zeros((2, 2), dtype=np.float32)),
+                                  extra_members={'userdata.json': b'{}'})
+        self.assertEqual(['B02'], list(decode_tar(content).keys()))
+
+    def test_decode_tar_stream_unseekable(self):
+        b04 = np.arange(6, dtype=np.int16).reshape((2, 3))
+        fileobj = UnseekableReader(new_tar_content(dict(B04=b04)))
+        np.testing.assert_equal(b04, decode_tar_stream(fileobj)['B04'])
+
+    def test_decode_tar_memmap(self):
+        b02 = np.arange(12, dtype=np.float32).reshape((3, 4))
+        bands = np.arange(24, dtype=np.int16).reshape((2, 3, 4))
+        fp = io.BytesIO()
+        tifffile.imwrite(fp, b02, compression='zlib')
+        content = new_tar_content(dict(B02=b02, bands=bands), extra_members={'B03.tif': fp.getvalue()})
+        arrays = decode_tar_memmap(UnseekableReader(content))
+        self.assertEqual({'B02', 'B03', 'bands'}, set(arrays.keys()))
+        for identifier, expected in [('B02', b02), ('B03', b02), ('bands', bands)]:
+            self.assertIsInstance(arrays[identifier], np.memmap)
+            np.testing.assert_equal(expected, arrays[identifier])
+        # Arrays are writable
+        arrays['B02'][0, 0] = 42
+        self.assertEqual(42, arrays['B02'][0, 0])
+
+    def test_decode_tiff(self):
+        fp = io.BytesIO()
+        tifffile.imwrite(fp, np.eye(3, dtype=np.float32))
+        np.testing.assert_equal(np.eye(3, dtype=np.float32), decode_tiff(fp.getvalue()))
+
+    def test_decode_multi_band_tiff(self):
+        data = np.arange(24, dtype=np.float32).reshape((3, 2, 4))
+        for planarconfig, image in [('separate', data), ('contig', np.moveaxis(data, 0, -1))]:
+            fp = io.BytesIO()
+            tifffile.imwrite(fp, image, photometric='minisblack', planarconfig=planarconfig)
+            decoded = decode_tiff(fp.getvalue())
+            np.testing.assert_equal(data, decoded)
+            self.assertTrue(decoded.flags.c_contiguous)
+
+
+class UnseekableReader(io.RawIOBase):
+    def __init__(self, data: bytes):
+        self._fp = io.BytesIO(data)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        return self._fp.readinto(buffer)
+
+
+def new_tar_content(arrays: Dict[str, np.ndarray], extra_members: Dict[str, bytes] = None) -> bytes:
+    """
+    Create the content of a SentinelHub "application/tar" response.
+
+    :param arrays: Mapping from output identifiers to 2D arrays or 3D arrays of shape (band, y, x).
+    :param extra_members: Optional mapping from other member names to their contents.
+    :return: The TAR archive as bytes.
+    """
+    members = {}
+    for identifier, array in arrays.items():
+        fp = io.BytesIO()
+        if array.ndim == 3:
+            # Multi-band images are given as (band, y, x)
+            tifffile.imwrite(fp, array, photometric='minisblack', planarconfig='separate')
+        else:
+            tifffile.imwrite(fp, array)
+        members[identifier + '.tif'] = fp.getvalue()
+    if extra_members:
+        members.update(extra_members)
+    fp = io.BytesIO()
+    with tarfile.open(fileobj=fp, mode='w') as tar:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return fp.getvalue()
@@ -0,0 +1,52 @@
+import math
+import unittest
+
+import numpy as np
+
+from xcube_dcfs.encoding import BandEncoding, plan_encoding, plan_encodings
+
+
+class PlanEncodingTest(unittest.TestCase):
+
+    def test_plan_encoding(self):
+        self.assertEqual(BandEncoding('UINT16', 1e-4, 0.0, 65535), plan_encoding('B04'))
+        self.assertEqual(BandEncoding('UINT16', fill_value=65535), plan_encoding('B04', 'DN'))
+        self.assertEqual(BandEncoding('UINT8'), plan_encoding('CLM', 'DN'))
+        self.assertEqual(BandEncoding('UINT16', 0.01, 0.0, 65535), plan_encoding('sunZenithAngles', 'degrees'))
+        self.assertEqual(BandEncoding('FLOAT32'), plan_encoding('DEM', 'meters'))
+        self.assertEqual(BandEncoding('FLOAT32'), plan_encoding('B04', 'radiance'))
+
+    def test_plan_encodings(self):
+        encodings = plan_encodings(['B04', 'CLM'], ['reflectance', 'DN'])
+        self.assertEqual(['B04', 'CLM'], list(encodings.keys()))
+        self.assertEqual('UINT8', encodings['CLM'].sample_type)
+        self.assertEqual(['UINT16', 'UINT16'], [e.sample_type for e in plan_encodings(['B02', 'B03']).values()])
+
+
+class BandEncodingTest(unittest.TestCase):
+
+    def test_properties(self):
+        encoding = plan_encoding('B04')
+        self.assertEqual(np.uint16, encoding.dtype)
+        self.assertFalse(encoding.is_identity)
+        self.assertEqual((0, 65534), encoding.valid_range)
+        self.assertEqual(dict(scale_factor=1e-4, _FillValue=65535), encoding.attrs)
+        self.assertTrue(BandEncoding('UINT8').is_identity)
+        self.assertEqual({}, BandEncoding('UINT8').attrs)
+        self.assertIsNone(BandEncoding('FLOAT32').valid_range)
+
+    def test_round_trip(self):
+        encoding = plan_encoding('B04')
+        values = np.array([0.0, 0.1234, 1.5, math.nan, -0.1, 7.0], dtype=np.float32)
+        samples = encoding.encode(values)
+        self.assertEqual(np.uint16, samples.dtype)
+        np.testing.assert_equal([0, 1234, 15000, 65535, 0, 65534], samples)
+        decoded = encoding.decode(samples)
+        self.assertEqual(np.float32, decoded.dtype)
+        np.testing.assert_almost_equal([0.0, 0.1234, 1.5, math.nan, 0.0, 6.5534], decoded, decimal=6)
+
+    def test_float_encoding(self):
+        encoding = BandEncoding('FLOAT32')
+        values = np.array([0.5, math.nan])
+        np.testing.assert_equal(values, encoding.encode(values))
+        np.testing.assert_equal(values, encoding.decode(encoding.encode(values)))
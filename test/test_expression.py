@@ -0,0 +1,32 @@
+import types
+import unittest
+
+from xcube_dcfs.expression import _Compiler, compile_expression
+
+NAMES = dict(B04='sample.B04', B08='sample.B08', ndvi='ndvi')
+
+
+class CompileExpressionTest(unittest.TestCase):
+
+    def test_compile(self):
+        self.assertEqual('((sample.B08 - sample.B04) / (sample.B08 + sample.B04))',
+                         compile_expression('(B08 - B04) / (B08 + B04)', NAMES))
+        self.assertEqual('Math.pow(Math.sqrt(Math.abs(ndvi)), 2)', compile_expression('sqrt(abs(ndvi)) ** 2', NAMES))
+        self.assertEqual('((0 < ndvi) && (ndvi <= 1))', compile_expression('0 < ndvi <= 1', NAMES))
+        self.assertEqual('(((!(ndvi > 0.5)) || (sample.B04 === 0)) ? 1 : (-1))',
+                         compile_expression('1 if not ndvi > 0.5 or B04 == 0 else -1', NAMES))
+
+    def test_compile_literals(self):
+        self.assertEqual('(2 * sample.B04)', compile_expression('2 * B04', NAMES))
+        self.assertEqual('((sample.B08 - sample.B04) / ((sample.B08 + sample.B04) + 0.0001))',
+                         compile_expression('(B08 - B04) / (B08 + B04 + 0.0001)', NAMES))
+        # Python < 3.8 parses numeric literals as ast.Num nodes
+        compiler = _Compiler('2.5', NAMES)
+        self.assertEqual('2.5', compiler.visit_Num(types.SimpleNamespace(n=2.5)))
+        with self.assertRaises(ValueError):
+            compiler.visit_Num(types.SimpleNamespace(n=1j))
+
+    def test_invalid(self):
+        for expression in ['B02', 'B04 // 2', '"B04"', 'B04[0]', 'lambda: 0', 'True', 'max(B04, key=1)', 'B04 +']:
+            with self.assertRaises(ValueError, msg=expression):
+                compile_expression(expression, NAMES)
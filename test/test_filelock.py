@@ -0,0 +1,38 @@
+import os
+import tempfile
+import unittest
+
+from xcube_dcfs.filelock import FileLock, read_json, write_atomic, write_json_atomic
+
+
+class FileLockTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'settings.json')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_read_write_json(self):
+        self.assertIsNone(read_json(self.path))
+        with FileLock(self.path + '.lock'):
+            write_json_atomic(self.path, dict(a=[1, 2.5], b=None))
+            write_json_atomic(self.path, dict(a=[1, 2.5], b='x'), mode=0o600)
+        self.assertEqual(dict(a=[1, 2.5], b='x'), read_json(self.path))
+        self.assertEqual(0o600, os.stat(self.path).st_mode & 0o777)
+        self.assertEqual(['settings.json', 'settings.json.lock'], sorted(os.listdir(self.temp_dir.name)))
+
+    def test_read_invalid_json(self):
+        write_atomic(self.path, b'{"a": ')
+        self.assertIsNone(read_json(self.path))
+
+    def test_write_fails(self):
+        write_atomic(self.path, b'123')
+        with self.assertRaises(TypeError):
+            write_json_atomic(self.path, dict(a=object()))
+        with self.assertRaises(TypeError):
+            write_atomic(self.path, 'not bytes')
+        # The file is unchanged and no temporary files are left
+        self.assertEqual(123, read_json(self.path))
+        self.assertEqual(['settings.json'], os.listdir(self.temp_dir.name))
@@ -0,0 +1,78 @@
+import io
+import json
+import logging
+import unittest
+
+from xcube_dcfs.instrument import Histogram, Instrumentation, TimedReader, new_json_logger
+
+
+class HistogramTest(unittest.TestCase):
+    def test_observe(self):
+        histogram = Histogram(buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value)
+        self.assertEqual(dict(buckets={'0.1': 2, '1.0': 3, '+Inf': 4}, sum=2.65, count=4),
+                         histogram.to_dict())
+
+
+class InstrumentationTest(unittest.TestCase):
+    def test_recording(self):
+        instrumentation = Instrumentation(buckets=(1.0,))
+        records = []
+        instrumentation.add_callback(records.append)
+        with instrumentation.recording('process') as record:
+            record.status_code = 200
+            record.response_bytes = 100
+            record.retries = 2
+            record.processing_units = 1.5
+        with self.assertRaises(ValueError):
+            with instrumentation.recording('process'):
+                raise ValueError('invalid')
+        self.assertEqual(2, len(records))
+        self.assertIsNone(records[0].error)
+        self.assertEqual('invalid', records[1].error)
+        snapshot = instrumentation.snapshot()
+        self.assertEqual(dict(requests_total=2,
+                              errors_total=1,
+                              request_bytes_total=0,
+                              response_bytes_total=100,
+                              retries_total=2,
+                              processing_units_total=1.5),
+                         snapshot['counters'])
+        self.assertEqual(2, snapshot['histograms']['total_time']['count'])
+        self.assertEqual(snapshot, json.loads(instrumentation.to_json()))
+        instrumentation.reset()
+        self.assertEqual(0, instrumentation.snapshot()['counters']['requests_total'])
+
+    def test_to_prometheus(self):
+        instrumentation = Instrumentation(buckets=(1.0,))
+        with instrumentation.recording('process') as record:
+            record.ttfb = 0.5
+        text = instrumentation.to_prometheus()
+        self.assertIn('# TYPE xcube_dcfs_requests_total counter\nxcube_dcfs_requests_total 1\n', text)
+        self.assertIn('# TYPE xcube_dcfs_ttfb_seconds histogram\n'
+                      'xcube_dcfs_ttfb_seconds_bucket{le="1.0"} 1\n'
+                      'xcube_dcfs_ttfb_seconds_bucket{le="+Inf"} 1\n'
+                      'xcube_dcfs_ttfb_seconds_sum 0.5\n'
+                      'xcube_dcfs_ttfb_seconds_count 1\n', text)
+        self.assertIn('xcube_dcfs_transfer_seconds_count 1\n', text)
+
+    def test_json_logger(self):
+        instrumentation = Instrumentation()
+        instrumentation.add_callback(new_json_logger(logging.getLogger('test_instrument')))
+        with self.assertLogs('test_instrument', level='INFO') as cm:
+            with instrumentation.recording('process') as record:
+                record.status_code = 200
+        self.assertEqual(1, len(cm.records))
+        obj = json.loads(cm.records[0].getMessage())
+        self.assertEqual('process', obj['name'])
+        self.assertEqual(200, obj['status_code'])
+
+
+class TimedReaderTest(unittest.TestCase):
+    def test_read(self):
+        reader = TimedReader(io.BytesIO(b'0123456789'))
+        self.assertEqual(b'0123', reader.read(4))
+        self.assertEqual(b'456789', reader.read())
+        self.assertEqual(10, reader.num_bytes)
+        self.assertGreaterEqual(reader.read_time, 0.0)
@@ -0,0 +1,244 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import xarray as xr
+import zarr
+
+from test.test_decoder import new_tar_content
+from test.test_sentinelhub import SessionMock, SessionResponseMock
+from test.test_store import PROCESS_URL, new_process_response_arrays
+from test.test_template import evaluate_pixel
+from xcube_dcfs.materialize import MANIFEST_NAME, PENDING_UPDATE_ATTR, materialize, update_cube
+from xcube_dcfs.sentinelhub import SentinelHub, SentinelHubError
+from xcube_dcfs.store import SentinelHubStore, new_acquisition_coverage
+
+
+class MaterializeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.requests = []
+        self.fail_after = None
+        self.sentinel_hub = SentinelHub(session=SessionMock({'post': {PROCESS_URL: self._process}}))
+        self.store = SentinelHubStore(self.sentinel_hub, 'S2L1C', ['B02', 'B04'],
+                                      bbox=(10.0, 50.0, 11.0, 50.5),
+                                      spatial_res=0.01,
+                                      time_range=('2018-10-01', '2018-10-03'),
+                                      tile_size=(40, 20))
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'cube.zarr')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+        self.sentinel_hub.close()
+
+    def _process(self, request):
+        self.requests.append(request)
+        if self.fail_after is not None and len(self.requests) > self.fail_after:
+            return SessionResponseMock(content=b'', status_code=500, reason='Internal Server Error')
+        return new_tar_content(new_process_response_arrays(request))
+
+    def test_materialize(self):
+        progress = []
+        stats = materialize(self.store, self.path, max_workers=2, progress=lambda *args: progress.append(args))
+        # 2 bands x 2 time steps x 3 x 3 tiles
+        self.assertEqual(dict(total=36, skipped=0, written=36, empty=0), stats)
+        self.assertEqual(36, len(self.requests))
+        self.assertEqual((36, 36), progress[-1])
+
+        expected = xr.open_zarr(self.store, consolidated=False).compute()
+        actual = xr.open_zarr(self.path, consolidated=True)
+        self.assertEqual('blosc', actual.B04.encoding['compressor'].codec_id)
+        xr.testing.assert_identical(expected, actual.compute())
+
+        # Nothing left to do
+        self.requests.clear()
+        self.assertEqual(dict(total=36, skipped=36, written=0, empty=0), materialize(self.store, self.path))
+        self.assertEqual([], self.requests)
+
+    def test_materialize_empty_chunks(self):
+        store = SentinelHubStore(self.sentinel_hub, 'S2L1C', ['B02', 'B04'],
+                                 bbox=(10.0, 50.0, 11.0, 50.5),
+                                 spatial_res=0.01,
+                                 time_range=('2018-10-01', '2018-10-03'),
+                                 tile_size=(40, 20),
+                                 coverage=new_acquisition_coverage([((10.0, 50.0, 10.3, 50.5), '2018-10-02')]))
+        stats = materialize(store, self.path)
+        self.assertEqual(dict(total=36, skipped=0, written=36, empty=30), stats)
+        self.assertEqual(6, len(self.requests))
+        self.assertEqual(30, store.stats['avoided_requests'])
+        self.assertTrue(os.path.exists(os.path.join(self.path, 'B04', '1.2.0')))
+        self.assertFalse(os.path.exists(os.path.join(self.path, 'B04', '1.2.1')))
+
+        # Empty chunks are done as well
+        self.assertEqual(dict(total=36, skipped=36, written=0, empty=0), materialize(store, self.path))
+        self.assertEqual(6, len(self.requests))
+        expected = xr.open_zarr(store, consolidated=False).compute()
+        xr.testing.assert_identical(expected, xr.open_zarr(self.path, consolidated=False).compute())
+
+    @unittest.skipUnless(shutil.which('node'), 'node.js is not available')
+    def test_materialize_empty_float_chunks(self):
+        def process_empty_area(request):
+            # SentinelHub evaluates the evalscript for pixels without data
+            self.requests.append(request)
+            value = evaluate_pixel(request['evalscript'], dict(B04=0.0, dataMask=0))['B04'][0]
+            arrays = new_process_response_arrays(request)
+            return new_tar_content({name: np.full_like(array, np.nan if value is None else value)
+                                    for name, array in arrays.items()})
+
+        sentinel_hub = SentinelHub(session=SessionMock({'post': {PROCESS_URL: process_empty_area}}))
+        store = SentinelHubStore(sentinel_hub, 'S2L1C', ['B04'],
+                                 bbox=(10.0, 50.0, 11.0, 50.5),
+                                 spatial_res=0.01,
+                                 time_range=('2018-10-01', '2018-10-02'),
+                                 tile_size=(40, 20),
+                                 sample_types='FLOAT32')
+        stats = materialize(store, self.path)
+        sentinel_hub.close()
+        self.assertEqual(dict(total=9, skipped=0, written=9, empty=9), stats)
+        self.assertEqual([], [name for name in os.listdir(os.path.join(self.path, 'B04')) if not name.startswith('.')])
+        self.assertTrue(np.isnan(xr.open_zarr(self.path, consolidated=False).B04.values).all())
+
+    def test_materialize_resumes(self):
+        self.fail_after = 10
+        with self.assertRaises(SentinelHubError):
+            materialize(self.store, self.path, max_workers=1)
+        with open(os.path.join(self.path, MANIFEST_NAME)) as fp:
+            self.assertEqual(10, len(fp.readlines()))
+
+        self.fail_after = None
+        self.requests.clear()
+        stats = materialize(self.store, self.path)
+        self.assertEqual(dict(total=36, skipped=10, written=26, empty=0), stats)
+        self.assertEqual(26, len(self.requests))
+        np.testing.assert_equal(xr.open_zarr(self.store, consolidated=False).B02.values,
+                                xr.open_zarr(self.path, consolidated=False).B02.values)
+
+    def test_materialize_other_cube(self):
+        materialize(self.store, self.path)
+        other_store = SentinelHubStore(self.sentinel_hub, 'S2L1C', ['B02', 'B04'],
+                                       bbox=(10.0, 50.0, 11.0, 50.5),
+                                       spatial_res=0.02,
+                                       time_range=('2018-10-01', '2018-10-03'),
+                                       tile_size=(40, 20))
+        with self.assertRaises(ValueError):
+            materialize(other_store, self.path)
+
+    def test_materialize_to_mapping(self):
+        target = {}
+        with self.assertRaises(ValueError):
+            materialize(self.store, target)
+        manifest_path = os.path.join(self.temp_dir.name, 'manifest')
+        materialize(self.store, target, manifest_path=manifest_path, compressor=None)
+        self.assertIn('B02/1.2.2', target)
+        self.assertEqual(40 * 20 * 4, len(target['B02/1.2.2']))
+
+
+class UpdateCubeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.requests = []
+        self.fail_after = None
+        self.sentinel_hub = SentinelHub(session=SessionMock({'post': {PROCESS_URL: self._process}}))
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'cube.zarr')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+        self.sentinel_hub.close()
+
+    def _process(self, request):
+        self.requests.append(request)
+        if self.fail_after is not None and len(self.requests) > self.fail_after:
+            return SessionResponseMock(content=b'', status_code=500, reason='Internal Server Error')
+        return new_tar_content(new_process_response_arrays(request))
+
+    def new_store(self, time_range):
+        return SentinelHubStore(self.sentinel_hub, 'S2L1C', ['B02', 'B04'],
+                                bbox=(10.0, 50.0, 11.0, 50.5),
+                                spatial_res=0.01,
+                                time_range=time_range,
+                                tile_size=(40, 20),
+                                sample_types=['UINT16', 'FLOAT32'])
+
+    def test_update_cube(self):
+        materialize(self.new_store(('2018-10-01', '2018-10-03')), self.path)
+        chunk_path = os.path.join(self.path, 'B02', '1.2.2')
+        chunk_mtime = os.stat(chunk_path).st_mtime_ns
+        self.requests.clear()
+
+        result = update_cube(self.sentinel_hub, self.path, 'S2L1C', time_end='2018-10-05T12:00:00')
+        self.assertEqual(dict(time_steps=2, chunks=36, empty_chunks=0, time_coverage_end='2018-10-05T00:00:00Z'),
+                         result)
+        # Only the new time steps have been requested
+        self.assertEqual(36, len(self.requests))
+        self.assertEqual({'2018-10-03T00:00:00Z'},
+                         {request['input']['data'][0]['dataFilter']['timeRange']['from'] for request in self.requests
+                          if request['input']['bounds']['bbox'][0] == 10.0
+                          and request['input']['data'][0]['dataFilter']['timeRange']['to'] == '2018-10-04T00:00:00Z'})
+        self.assertEqual(chunk_mtime, os.stat(chunk_path).st_mtime_ns)
+
+        expected = xr.open_zarr(self.new_store(('2018-10-01', '2018-10-05')), consolidated=False).compute()
+        actual = xr.open_zarr(self.path, consolidated=False).compute()
+        xr.testing.assert_identical(expected, actual)
+
+        # Up to date, as the next day is not complete
+        self.requests.clear()
+        result = update_cube(self.sentinel_hub, self.path, 'S2L1C', time_end='2018-10-05T23:00:00')
+        self.assertEqual(dict(time_steps=0, chunks=0, empty_chunks=0, time_coverage_end='2018-10-05T00:00:00Z'), result)
+        self.assertEqual([], self.requests)
+
+    def test_update_cube_interrupted_while_writing_chunks(self):
+        materialize(self.new_store(('2018-10-01', '2018-10-03')), self.path)
+        original = xr.open_zarr(self.path, consolidated=False).compute()
+        self.fail_after = len(self.requests) + 10
+        with self.assertRaises(SentinelHubError):
+            update_cube(self.sentinel_hub, self.path, 'S2L1C', time_end='2018-10-05')
+        # The chunks written so far are not part of the cube
+        xr.testing.assert_identical(original, xr.open_zarr(self.path, consolidated=False).compute())
+
+        self.fail_after = None
+        result = update_cube(self.sentinel_hub, self.path, 'S2L1C', time_end='2018-10-05')
+        self.assertEqual(2, result['time_steps'])
+        expected = xr.open_zarr(self.new_store(('2018-10-01', '2018-10-05')), consolidated=False).compute()
+        xr.testing.assert_identical(expected, xr.open_zarr(self.path, consolidated=False).compute())
+
+    def test_update_cube_interrupted_while_resizing(self):
+        materialize(self.new_store(('2018-10-01', '2018-10-03')), self.path)
+        resize = zarr.Array.resize
+
+        def resize_bands_fails(array, *shape):
+            if array.path == 'B04':
+                raise KeyboardInterrupt()
+            resize(array, *shape)
+
+        with mock.patch.object(zarr.Array, 'resize', resize_bands_fails):
+            with self.assertRaises(KeyboardInterrupt):
+                update_cube(self.sentinel_hub, self.path, 'S2L1C', time_end='2018-10-05')
+        group = zarr.open_group(self.path, mode='r')
+        self.assertEqual((4,), group['time'].shape)
+        self.assertEqual((4, 50, 100), group['B02'].shape)
+        self.assertEqual((2, 50, 100), group['B04'].shape)
+        self.assertEqual('2018-10-03T00:00:00Z', group.attrs['time_coverage_end'])
+        self.assertIn(PENDING_UPDATE_ATTR, group.attrs)
+
+        # The next update completes the pending one without requesting its chunks again
+        self.requests.clear()
+        result = update_cube(self.sentinel_hub, self.path, 'S2L1C', time_end='2018-10-05')
+        self.assertEqual(dict(time_steps=2, chunks=0, empty_chunks=0, time_coverage_end='2018-10-05T00:00:00Z'),
+                         result)
+        self.assertEqual([], self.requests)
+        self.assertNotIn(PENDING_UPDATE_ATTR, zarr.open_group(self.path, mode='r').attrs)
+        expected = xr.open_zarr(self.new_store(('2018-10-01', '2018-10-05')), consolidated=False).compute()
+        xr.testing.assert_identical(expected, xr.open_zarr(self.path, consolidated=False).compute())
+
+    def test_update_cube_with_time_period(self):
+        materialize(self.new_store(('2018-10-01', '2018-10-02')), self.path)
+        result = update_cube(self.sentinel_hub, self.path, 'S2L1C', time_end='2018-10-03', time_period='6h')
+        self.assertEqual(4, result['time_steps'])
+        cube = xr.open_zarr(self.path, consolidated=False)
+        self.assertEqual(5, cube.time.size)
+        self.assertEqual(np.datetime64('2018-10-02T21:00'), cube.time.values[-1])
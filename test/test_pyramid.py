@@ -0,0 +1,171 @@
+import json
+import os
+import tempfile
+import unittest
+import warnings
+from unittest import mock
+
+import numpy as np
+import xarray as xr
+import zarr
+
+from test.test_decoder import new_tar_content
+from test.test_sentinelhub import SessionMock
+from test.test_store import PROCESS_URL, new_process_response_arrays
+from xcube_dcfs.pyramid import DownsampledStore, Pyramid, downsample, get_num_levels
+from xcube_dcfs.sentinelhub import SentinelHub
+from xcube_dcfs.store import SentinelHubStore
+
+
+def new_base_store(width=10, height=7, chunks=(1, 4, 4)):
+    int_values = np.arange(2 * height * width, dtype=np.uint16).reshape((2, height, width))
+    values = int_values.astype(np.float32)
+    values[0, 0, 0] = np.nan
+    cube = xr.Dataset(dict(B02=(('time', 'lat', 'lon'), values),
+                           B03=(('time', 'lat', 'lon'), int_values)),
+                      coords=dict(time=np.array(['2018-10-01', '2018-10-02'], dtype='datetime64[ns]'),
+                                  lat=50.0 - 0.01 * (np.arange(height) + 0.5),
+                                  lon=10.0 + 0.01 * (np.arange(width) + 0.5)),
+                      attrs=dict(title='test'))
+    store = {}
+    cube.to_zarr(store, encoding=dict(B02=dict(chunks=chunks), B03=dict(chunks=chunks)), consolidated=False)
+    return store
+
+
+class DownsampleTest(unittest.TestCase):
+
+    def test_mean(self):
+        data = np.array([[1, 3, 5], [3, np.nan, 7]], dtype=np.float32)
+        np.testing.assert_equal(np.array([[7 / 3, 6]], dtype=np.float32), downsample(data))
+        np.testing.assert_equal(np.array([[np.nan]]), downsample(np.full((2, 2), np.nan)))
+        data = np.array([[[1, 2], [2, 2]]], dtype=np.uint16)
+        np.testing.assert_equal(np.array([[[2]]], dtype=np.uint16), downsample(data))
+
+    def test_mean_with_fill_value(self):
+        data = np.array([[1000, 65535, 65535, 65535], [2001, 65535, 65535, 65535]], dtype=np.uint16)
+        np.testing.assert_equal(np.array([[1500, 65535]], dtype=np.uint16), downsample(data, fill_value=65535))
+
+    def test_nearest(self):
+        data = np.arange(15).reshape((3, 5))
+        np.testing.assert_equal([[0, 2, 4], [10, 12, 14]], downsample(data, 'nearest'))
+        with self.assertRaises(ValueError):
+            downsample(data, 'cubic')
+
+    def test_get_num_levels(self):
+        self.assertEqual(1, get_num_levels((512, 300), (512, 512)))
+        self.assertEqual(2, get_num_levels((1024, 300), (512, 512)))
+        self.assertEqual(4, get_num_levels((2500, 1000), (512, 512)))
+
+
+class DownsampledStoreTest(unittest.TestCase):
+
+    def test_mean(self):
+        base = new_base_store()
+        with warnings.catch_warnings():
+            # Plain dicts have no listdir(), which zarr warns about
+            warnings.simplefilter('error')
+            store = DownsampledStore(base)
+        cube = xr.open_zarr(store, consolidated=False)
+        self.assertEqual(dict(time=2, lat=4, lon=5), dict(cube.sizes))
+        self.assertEqual('test', cube.attrs['title'])
+        self.assertEqual(((1, 1), (4,), (4, 1)), cube.B02.chunks)
+        np.testing.assert_almost_equal(50.0 - 0.02 * (np.arange(4) + 0.5), cube.lat.values)
+        np.testing.assert_almost_equal(10.0 + 0.02 * (np.arange(5) + 0.5), cube.lon.values)
+
+        base_cube = xr.open_zarr(base, consolidated=False)
+        expected = base_cube.B02.pad(lat=(0, 1), mode='edge').coarsen(lat=2, lon=2).mean().values
+        np.testing.assert_almost_equal(expected, cube.B02.values, decimal=4)
+        self.assertEqual(np.uint16, cube.B03.dtype)
+        self.assertEqual((2, 4, 5), cube.B03.values.shape)
+
+    def test_consolidated_metadata(self):
+        store = DownsampledStore(new_base_store())
+        cube = xr.open_zarr(store, consolidated=True)
+        self.assertEqual(dict(time=2, lat=4, lon=5), dict(cube.sizes))
+        self.assertEqual(store['B02/.zarray'], json.dumps(json.loads(store['.zmetadata'])['metadata']['B02/.zarray'],
+                                                          indent=2).encode('utf-8'))
+
+    def test_nearest_and_cache(self):
+        base = new_base_store()
+        cache = {}
+        store = DownsampledStore(base, resampling=dict(B02='nearest'), cache=cache)
+        cube = xr.open_zarr(store, consolidated=False)
+        base_cube = xr.open_zarr(base, consolidated=False)
+        np.testing.assert_equal(base_cube.B02.values[:, ::2, ::2], cube.B02.values)
+        self.assertIn('B02/1.0.1', cache)
+        self.assertIn('B03/1.0.1', store)
+        self.assertNotIn('B03/2.0.0', store)
+        with self.assertRaises(TypeError):
+            store['B02/0.0.0'] = b''
+
+
+class PyramidTest(unittest.TestCase):
+
+    def setUp(self):
+        self.requests = []
+        self.sentinel_hub = SentinelHub(session=SessionMock({'post': {PROCESS_URL: self._process}}))
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+        self.sentinel_hub.close()
+
+    def _process(self, request):
+        self.requests.append(request)
+        return new_tar_content(new_process_response_arrays(request))
+
+    def open_pyramid(self, path=None):
+        return Pyramid.open(self.sentinel_hub, 'S2L1C', ['B02'],
+                            bbox=(10.0, 50.0, 11.0, 50.5),
+                            spatial_res=0.01,
+                            time_range=('2018-10-01', '2018-10-02'),
+                            path=path,
+                            tile_size=(40, 20))
+
+    def test_from_base(self):
+        pyramid = Pyramid.from_base(new_base_store(width=20, height=9))
+        self.assertEqual(4, pyramid.num_levels)
+        self.assertEqual(dict(time=2, lat=2, lon=3), dict(pyramid.open_level(3).sizes))
+
+    def test_remote_levels(self):
+        pyramid = self.open_pyramid()
+        # 100 x 50 pixels in tiles of 40 x 20
+        self.assertEqual(3, pyramid.num_levels)
+        level = pyramid.open_level(2)
+        self.assertEqual(dict(time=1, lat=12, lon=25), dict(level.sizes))
+        np.testing.assert_equal(2, level.B02.values)
+        self.assertEqual(1, len(self.requests))
+        self.assertEqual('BILINEAR', self.requests[0]['input']['data'][0]['processing']['downsampling'])
+        self.assertEqual((25, 12), (self.requests[0]['output']['width'], self.requests[0]['output']['height']))
+
+    def test_remote_parent_keys_are_not_listed(self):
+        store = SentinelHubStore(self.sentinel_hub, 'S2L1C', ['B02'],
+                                 bbox=(10.0, 50.0, 11.0, 50.5),
+                                 spatial_res=0.01,
+                                 time_range=('2018-10-01', '2018-10-03'),
+                                 tile_size=(40, 20))
+        # Listing all keys of remote stores would enumerate all of their chunks
+        with mock.patch.object(SentinelHubStore, '__iter__', side_effect=AssertionError('all keys listed')):
+            downsampled = DownsampledStore(store)
+            self.assertEqual(len(list(downsampled)), len(downsampled))
+            self.assertEqual(['.zarray', '.zattrs', '0.0.0', '0.0.1', '0.1.0', '0.1.1'], downsampled.listdir('B02')[:6])
+            level = xr.open_zarr(downsampled, consolidated=False)
+            base = xr.open_zarr(store, consolidated=True)
+            xr.testing.assert_equal(base.time, level.time)
+            self.assertEqual(dict(time=2, lat=25, lon=50), dict(level.sizes))
+        self.assertEqual([], self.requests)
+
+    def test_local_levels(self):
+        path = os.path.join(self.temp_dir.name, 'cube.zarr')
+        Pyramid.from_base(new_base_store(width=100, height=50, chunks=(1, 20, 40)), num_levels=1).write(path)
+        pyramid = self.open_pyramid(path=os.path.join(path, '0.zarr'))
+        self.assertEqual(3, pyramid.num_levels)
+        level = pyramid.open_level(2)
+        self.assertEqual(dict(time=2, lat=13, lon=25), dict(level.sizes))
+        level.compute()
+        self.assertEqual([], self.requests)
+
+        pyramid.write(os.path.join(self.temp_dir.name, 'pyramid'))
+        level = xr.open_zarr(os.path.join(self.temp_dir.name, 'pyramid', '2.zarr'), consolidated=False)
+        xr.testing.assert_identical(pyramid.open_level(2).compute(), level.compute())
+        self.assertIsInstance(zarr.open_group(os.path.join(self.temp_dir.name, 'pyramid', '1.zarr')), zarr.Group)
@@ -0,0 +1,99 @@
+import json
+import threading
+import time
+import unittest
+
+from test.test_sentinelhub import SessionMock, SessionResponseMock
+from xcube_dcfs.scheduler import RequestScheduler, TokenBucket, estimate_processing_units
+from xcube_dcfs.sentinelhub import SentinelHub, SentinelHubError
+
+PROCESS_URL = 'https://services.sentinel-hub.com/api/v1/process'
+
+
+def new_request(width=512, height=512, band_names=('B02', 'B03', 'B04'), sample_types='UINT16', index=0):
+    request = SentinelHub.new_data_request('S2L1C', band_names, (width, height), sample_types=sample_types)
+    request['index'] = index
+    return request
+
+
+class EstimateProcessingUnitsTest(unittest.TestCase):
+
+    def test_estimate(self):
+        self.assertAlmostEqual(1.0, estimate_processing_units(new_request()))
+        self.assertAlmostEqual(2.0, estimate_processing_units(new_request(sample_types='FLOAT32')))
+        self.assertAlmostEqual(4.0, estimate_processing_units(new_request(1024, 1024)))
+        self.assertAlmostEqual(1 / 3, estimate_processing_units(new_request(band_names=['B02'])))
+        self.assertAlmostEqual(1.0, estimate_processing_units(json.dumps(new_request()).encode()))
+
+    def test_minimum(self):
+        self.assertAlmostEqual(0.01, estimate_processing_units(new_request(8, 8)))
+        self.assertAlmostEqual(0.005, estimate_processing_units(new_request(8, 8, band_names=['B02'])))
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_bucket(self):
+        bucket = TokenBucket(60.0, capacity=2.0)
+        now = time.monotonic()
+        self.assertEqual(0.0, bucket.delay(2.0, now))
+        bucket.consume(2.0, now)
+        self.assertAlmostEqual(1.0, bucket.delay(1.0, now))
+        self.assertAlmostEqual(0.5, bucket.delay(1.0, now + 0.5))
+        # Larger amounts than the capacity wait for a full bucket
+        self.assertAlmostEqual(2.0, bucket.delay(5.0, now))
+        self.assertAlmostEqual(2.0, bucket.tokens(now + 10.0))
+
+
+class RequestSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.sent = []
+        self.sentinel_hub = SentinelHub(session=SessionMock({'post': {PROCESS_URL: self._process}}))
+
+    def tearDown(self):
+        self.sentinel_hub.close()
+
+    def _process(self, request):
+        with self.lock:
+            self.sent.append((time.monotonic(), request['index']))
+        if request['index'] == 2:
+            return SessionResponseMock(content=b'Invalid', status_code=400, reason='Bad Request')
+        return b'data'
+
+    def test_paced_by_requests(self):
+        scheduler = RequestScheduler(self.sentinel_hub, requests_per_minute=1200, request_burst=1)
+        data_requests = [new_request(index=i) for i in range(5)]
+        estimate = scheduler.estimate(data_requests)
+        self.assertEqual(5, estimate['num_requests'])
+        self.assertAlmostEqual(5.0, estimate['processing_units'])
+        self.assertAlmostEqual(0.2, estimate['duration'], places=2)
+
+        t0 = time.monotonic()
+        results = dict(scheduler.get_data_many(data_requests))
+        self.assertGreaterEqual(time.monotonic() - t0, 0.19)
+        self.assertEqual(set(range(5)), set(results.keys()))
+        self.assertEqual(('application/tar', b'data'), results[0])
+        self.assertIsInstance(results[2], SentinelHubError)
+        self.assertAlmostEqual(5.0, scheduler.processing_units)
+        self.assertEqual(0, scheduler.remaining['num_requests'])
+
+    def test_cheap_requests_fill_gaps(self):
+        scheduler = RequestScheduler(self.sentinel_hub, processing_units_per_minute=60, max_workers=1,
+                                     processing_unit_burst=1.5)
+        data_requests = [new_request(index=0, band_names=['B02']),
+                         new_request(index=1),
+                         new_request(index=3, band_names=['B02']),
+                         new_request(index=4)]
+        self.assertAlmostEqual(7 / 6, scheduler.estimate(data_requests)['duration'])
+        list(scheduler.get_data_many(data_requests))
+        # The most expensive first, then the cheap ones while waiting for the next expensive one
+        self.assertEqual([1, 0, 3, 4], [index for _, index in self.sent])
+        self.assertGreaterEqual(self.sent[-1][0] - self.sent[0][0], 0.9)
+
+    def test_unlimited(self):
+        scheduler = RequestScheduler(self.sentinel_hub)
+        data_requests = [new_request(index=i) for i in range(10)]
+        self.assertEqual(0.0, scheduler.estimate(data_requests)['duration'])
+        self.assertEqual(1.25, scheduler.estimate(data_requests, request_time=1.0)['duration'])
+        self.assertEqual(10, len(list(scheduler.get_data_many(data_requests))))
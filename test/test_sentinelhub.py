@@ -1,10 +1,21 @@
+import io
 import json
 import os
+import tempfile
+import threading
 import time
 import unittest
 from typing import Dict
 
-from xcube_dcfs.sentinelhub import SentinelHub
+import numpy as np
+import oauthlib.oauth2
+
+from test.test_decoder import new_tar_content
+from xcube_dcfs.auth import TokenManager
+from xcube_dcfs.cache import ResponseCache
+from xcube_dcfs.sentinelhub import SentinelHub, SentinelHubError
+from xcube_dcfs.template import RequestTemplate
+from xcube_dcfs.throttle import Throttle
 
 HAS_SH_CREDENTIALS = 'SH_CLIENT_ID' in os.environ and 'SH_CLIENT_SECRET' in os.environ
 REQUIRE_SH_CREDENTIALS = 'requires SH credentials'
@@ -19,10 +30,8 @@ class SentinelHubTest(unittest.TestCase):
 
         sentinel_hub = SentinelHub()
 
-        t1 = time.perf_counter()
+        sentinel_hub.instrumentation.add_callback(lambda record: print(f"test_get_data_single: {record.to_dict()}"))
         mime_type, data = sentinel_hub.get_data(request)
-        t2 = time.perf_counter()
-        print(f"test_get_data_single: took {t2 - t1} secs")
 
         self.assertEqual('application/tar', mime_type)
         # self.assertEqual('image/tif', mime_type)
@@ -39,10 +48,8 @@ class SentinelHubTest(unittest.TestCase):
 
         sentinel_hub = SentinelHub()
 
-        t1 = time.perf_counter()
+        sentinel_hub.instrumentation.add_callback(lambda record: print(f"test_get_data_multi: {record.to_dict()}"))
         mime_type, data = sentinel_hub.get_data(request)
-        t2 = time.perf_counter()
-        print(f"test_get_data_multi: took {t2 - t1} secs")
 
         self.assertEqual('application/tar', mime_type)
 
@@ -51,6 +58,322 @@ class SentinelHubTest(unittest.TestCase):
 
         sentinel_hub.close()
 
+    def test_get_data(self):
+        content = new_tar_content(dict(B02=np.zeros((4, 4), dtype=np.float32)))
+        sentinel_hub = SentinelHub(session=SessionMock({
+            'post': {
+                'https://services.sentinel-hub.com/api/v1/process': content
+            }}))
+        mime_type, data = sentinel_hub.get_data(dict(output=dict(responses=[])))
+        self.assertEqual('application/tar', mime_type)
+        self.assertEqual(content, data)
+
+    def test_get_data_pre_serialized(self):
+        posted = []
+
+        class PostSessionMock(SessionMock):
+            def post(self, url, **kwargs):
+                posted.append(kwargs)
+                return SessionResponseMock(content=b'data')
+
+        sentinel_hub = SentinelHub(session=PostSessionMock({}))
+        request_json = RequestTemplate('S2L1C', ['B02']).new_request_json((8, 8))
+        self.assertEqual(('application/tar', b'data'), sentinel_hub.get_data(request_json))
+        self.assertEqual(request_json, posted[0]['data'])
+        self.assertEqual('application/json', posted[0]['headers']['Content-Type'])
+
+    def test_get_data_error(self):
+        sentinel_hub = SentinelHub(session=SessionMock({
+            'post': {
+                'https://services.sentinel-hub.com/api/v1/process':
+                    SessionResponseMock(content=b'Bad request', status_code=400, reason='Bad Request')
+            }}))
+        with self.assertRaises(SentinelHubError) as cm:
+            sentinel_hub.get_data(dict(output=dict(responses=[])))
+        self.assertEqual(400, cm.exception.status_code)
+
+    def test_get_arrays(self):
+        b02 = np.arange(16, dtype=np.float32).reshape((4, 4))
+        b03 = np.ones((4, 4), dtype=np.uint16)
+        sentinel_hub = SentinelHub(session=SessionMock({
+            'post': {
+                'https://services.sentinel-hub.com/api/v1/process': new_tar_content(dict(B02=b02, B03=b03))
+            }}))
+        arrays = sentinel_hub.get_arrays(dict(output=dict(responses=[])))
+        self.assertEqual({'B02', 'B03'}, set(arrays.keys()))
+        np.testing.assert_equal(b02, arrays['B02'])
+        np.testing.assert_equal(b03, arrays['B03'])
+
+    def test_get_arrays_memmap(self):
+        b02 = np.arange(16, dtype=np.float32).reshape((4, 4))
+        with tempfile.TemporaryDirectory() as spool_dir:
+            sentinel_hub = SentinelHub(session=SessionMock({
+                'post': {
+                    'https://services.sentinel-hub.com/api/v1/process': new_tar_content(dict(B02=b02))
+                }}), memmap=True, spool_dir=spool_dir)
+            arrays = sentinel_hub.get_arrays(dict(output=dict(responses=[])))
+            self.assertIsInstance(arrays['B02'], np.memmap)
+            np.testing.assert_equal(b02, arrays['B02'])
+            # Temporary files are anonymous
+            self.assertEqual([], os.listdir(spool_dir))
+
+    def test_get_data_many(self):
+        def process(request):
+            index = request['index']
+            if index == 3:
+                return SessionResponseMock(content=b'Invalid', status_code=400, reason='Bad Request')
+            return f'data-{index}'.encode()
+
+        sentinel_hub = SentinelHub(session=SessionMock({
+            'post': {
+                'https://services.sentinel-hub.com/api/v1/process': process
+            }}))
+        results = dict(sentinel_hub.get_data_many([dict(index=i) for i in range(10)], max_workers=3))
+        self.assertEqual(set(range(10)), set(results.keys()))
+        self.assertEqual(('application/tar', b'data-7'), results[7])
+        self.assertIsInstance(results[3], SentinelHubError)
+        self.assertEqual(400, results[3].status_code)
+
+    def test_get_arrays_many_returns_decode_errors(self):
+        content = new_tar_content(dict(B02=np.zeros((2, 2), dtype=np.float32)))
+
+        def process(request):
+            return content[:100] if request['index'] == 2 else content
+
+        sentinel_hub = SentinelHub(session=SessionMock({
+            'post': {
+                'https://services.sentinel-hub.com/api/v1/process': process
+            }}))
+        results = dict(sentinel_hub.get_arrays_many([dict(index=i) for i in range(5)], max_workers=2))
+        self.assertEqual(set(range(5)), set(results.keys()))
+        self.assertIsInstance(results[2], SentinelHubError)
+        self.assertIsNone(results[2].status_code)
+        np.testing.assert_equal(np.zeros((2, 2)), results[4]['B02'])
+
+    def test_get_data_many_queues_bounded_number_of_requests(self):
+        release = threading.Event()
+        num_taken = [0]
+
+        def process(request):
+            release.wait(5)
+            return b'data'
+
+        def new_requests():
+            for i in range(1000):
+                num_taken[0] += 1
+                yield dict(index=i)
+
+        sentinel_hub = SentinelHub(session=SessionMock({
+            'post': {
+                'https://services.sentinel-hub.com/api/v1/process': process
+            }}))
+        results = sentinel_hub.get_data_many(new_requests(), max_workers=2)
+        thread = threading.Thread(target=lambda: next(results))
+        thread.start()
+        time.sleep(0.1)
+        self.assertEqual(4, num_taken[0])
+        release.set()
+        thread.join()
+        self.assertEqual(999, sum(1 for _ in results))
+        self.assertEqual(1000, num_taken[0])
+
+    def test_get_data_many_coalesces_identical_requests(self):
+        release = threading.Event()
+        num_calls = [0]
+
+        def process(request):
+            num_calls[0] += 1
+            release.wait(5)
+            return new_tar_content(dict(B02=np.zeros((2, 2), dtype=np.float32)))
+
+        sentinel_hub = SentinelHub(session=SessionMock({
+            'post': {
+                'https://services.sentinel-hub.com/api/v1/process': process
+            }}))
+        request = SentinelHub.new_data_request('S2L1C', ['B02'], (2, 2))
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(sentinel_hub.get_data(request)))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        deadline = time.monotonic() + 5
+        while sentinel_hub.singleflight.stats['coalesced'] < 3:
+            if time.monotonic() > deadline:
+                release.set()
+                self.fail('identical requests have not been coalesced')
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(1, num_calls[0])
+        self.assertTrue(all(data is results[0][1] for _, data in results))
+        self.assertEqual(dict(calls=1, coalesced=3, in_flight=0), sentinel_hub.singleflight.stats)
+
+    def test_get_data_retries_throttled(self):
+        num_calls = [0]
+
+        def process(request):
+            num_calls[0] += 1
+            if num_calls[0] <= 2:
+                return SessionResponseMock(content=b'', status_code=429, reason='Too Many Requests',
+                                           headers={'Retry-After': '0'})
+            return b'data'
+
+        sentinel_hub = SentinelHub(session=SessionMock({
+            'post': {
+                'https://services.sentinel-hub.com/api/v1/process': process
+            }}), throttle=Throttle(backoff_interval=0.01))
+        self.assertEqual(('application/tar', b'data'), sentinel_hub.get_data({}))
+        self.assertEqual(3, num_calls[0])
+        self.assertEqual(2, sentinel_hub.throttle.num_throttled)
+
+    def test_get_data_gives_up_when_throttled(self):
+        sentinel_hub = SentinelHub(session=SessionMock({
+            'post': {
+                'https://services.sentinel-hub.com/api/v1/process':
+                    SessionResponseMock(content=b'', status_code=429, reason='Too Many Requests',
+                                        headers={'Retry-After': '0'})
+            }}), max_retries=2, throttle=Throttle(backoff_interval=0.001))
+        with self.assertRaises(SentinelHubError) as cm:
+            sentinel_hub.get_data({})
+        self.assertEqual(429, cm.exception.status_code)
+        self.assertEqual(2, sentinel_hub.throttle.num_throttled)
+
+    def test_get_data_instrumented(self):
+        num_calls = [0]
+
+        def process(request):
+            num_calls[0] += 1
+            if num_calls[0] == 1:
+                return SessionResponseMock(content=b'', status_code=429, reason='Too Many Requests',
+                                           headers={'Retry-After': '0'})
+            return SessionResponseMock(content=b'data', headers={'x-processingunits-spent': '0.5'})
+
+        records = []
+        sentinel_hub = SentinelHub(session=SessionMock({
+            'post': {
+                'https://services.sentinel-hub.com/api/v1/process': process
+            }}), throttle=Throttle(backoff_interval=0.001))
+        sentinel_hub.instrumentation.add_callback(records.append)
+        sentinel_hub.get_data(b'{}')
+        self.assertEqual(1, len(records))
+        record = records[0]
+        self.assertEqual('process', record.name)
+        self.assertEqual(200, record.status_code)
+        self.assertEqual(1, record.retries)
+        self.assertEqual(2, record.request_bytes)
+        self.assertEqual(4, record.response_bytes)
+        self.assertEqual(0.5, record.processing_units)
+        self.assertIsNone(record.error)
+        self.assertGreaterEqual(record.total_time, record.ttfb + record.transfer_time)
+        counters = sentinel_hub.instrumentation.snapshot()['counters']
+        self.assertEqual(1, counters['requests_total'])
+        self.assertEqual(1, counters['retries_total'])
+        self.assertEqual(0.5, counters['processing_units_total'])
+
+    def test_get_arrays_instrumented(self):
+        content = new_tar_content(dict(B02=np.zeros((4, 4), dtype=np.float32)))
+        sentinel_hub = SentinelHub(session=SessionMock({
+            'post': {
+                'https://services.sentinel-hub.com/api/v1/process': content
+            }}))
+        records = []
+        sentinel_hub.instrumentation.add_callback(records.append)
+        sentinel_hub.get_arrays({})
+        self.assertEqual(1, len(records))
+        self.assertEqual(len(content), records[0].response_bytes)
+        self.assertGreater(records[0].decode_time, 0.0)
+
+    def test_get_data_error_instrumented(self):
+        sentinel_hub = SentinelHub(session=SessionMock({
+            'post': {
+                'https://services.sentinel-hub.com/api/v1/process':
+                    SessionResponseMock(content=b'', status_code=400, reason='Bad Request')
+            }}))
+        records = []
+        sentinel_hub.instrumentation.add_callback(records.append)
+        with self.assertRaises(SentinelHubError):
+            sentinel_hub.get_data({})
+        self.assertEqual(400, records[0].status_code)
+        self.assertEqual('Bad Request, status code 400', records[0].error)
+        self.assertEqual(1, sentinel_hub.instrumentation.snapshot()['counters']['errors_total'])
+
+    def test_get_data_cached(self):
+        num_calls = [0]
+
+        def process(request):
+            num_calls[0] += 1
+            return new_tar_content(dict(B02=np.full((2, 2), 2, dtype=np.uint8)))
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = ResponseCache(cache_dir)
+            sentinel_hub = SentinelHub(session=SessionMock({
+                'post': {
+                    'https://services.sentinel-hub.com/api/v1/process': process
+                }}), cache=cache)
+            request = SentinelHub.new_data_request('S2L1C', ['B02'], (2, 2), sample_types='UINT8')
+            _, data_1 = sentinel_hub.get_data(request)
+            _, data_2 = sentinel_hub.get_data(json.loads(json.dumps(request)))
+            arrays = sentinel_hub.get_arrays(request)
+            self.assertEqual(data_1, data_2)
+            np.testing.assert_equal(np.full((2, 2), 2, dtype=np.uint8), arrays['B02'])
+            self.assertEqual(1, num_calls[0])
+            self.assertEqual(2, cache.stats['hits'])
+            self.assertEqual(1, cache.stats['misses'])
+
+            # Another service sharing the cache directory does not get these responses
+            other_sentinel_hub = SentinelHub(session=SessionMock({
+                'post': {
+                    'https://creodias.sentinel-hub.com/api/v1/process': process
+                }}), api_url='https://creodias.sentinel-hub.com/api/v1', cache=ResponseCache(cache_dir))
+            other_sentinel_hub.get_data(request)
+            self.assertEqual(2, num_calls[0])
+
+    def test_get_data_refreshes_rejected_token(self):
+        def process(request):
+            if sentinel_hub.token['access_token'] == 'token-1':
+                return SessionResponseMock(content=b'', status_code=401, reason='Unauthorized')
+            return b'data'
+
+        num_fetches = [0]
+
+        def fetch_token():
+            num_fetches[0] += 1
+            return dict(access_token=f'token-{num_fetches[0]}', expires_in=3600)
+
+        token_manager = TokenManager('my-client', 'my-secret', 'https://auth/oauth/token',
+                                     cache_dir=None, background_refresh=False, fetch_token=fetch_token)
+        session = SessionMock({'post': {'https://services.sentinel-hub.com/api/v1/process': process}})
+        sentinel_hub = SentinelHub(session=session, token_manager=token_manager)
+        self.assertEqual(('application/tar', b'data'), sentinel_hub.get_data({}))
+        self.assertEqual('token-2', session.token['access_token'])
+        self.assertEqual(2, num_fetches[0])
+        sentinel_hub.close()
+
+    def test_get_data_refreshes_expired_token(self):
+        def process(request):
+            if sentinel_hub.token['access_token'] == 'token-1':
+                # OAuth2Session rejects expired tokens before sending a request
+                raise oauthlib.oauth2.TokenExpiredError()
+            return b'data'
+
+        num_fetches = [0]
+
+        def fetch_token():
+            num_fetches[0] += 1
+            return dict(access_token=f'token-{num_fetches[0]}', expires_in=3600)
+
+        token_manager = TokenManager('my-client', 'my-secret', 'https://auth/oauth/token',
+                                     cache_dir=None, background_refresh=False, fetch_token=fetch_token)
+        session = SessionMock({'post': {'https://services.sentinel-hub.com/api/v1/process': process}})
+        sentinel_hub = SentinelHub(session=session, token_manager=token_manager)
+        records = []
+        sentinel_hub.instrumentation.add_callback(records.append)
+        self.assertEqual(('application/tar', b'data'), sentinel_hub.get_data({}))
+        self.assertEqual('token-2', session.token['access_token'])
+        self.assertEqual(1, records[0].retries)
+        sentinel_hub.close()
+
     def test_dataset_names(self):
         expected_dataset_names = ["DEM", "S2L1C", "S2L2A", "CUSTOM", "S1GRD"]
         sentinel_hub = SentinelHub(session=SessionMock({
@@ -166,21 +489,40 @@ class SessionMock:
     def get(self, url, **kwargs):
         return self._response(self.mapping['get'][url])
 
-    # noinspection PyUnusedLocal
     def post(self, url, **kwargs):
-        return self._response(self.mapping['post'][url])
+        return self._response(self.mapping['post'][url], request=kwargs.get('json'))
 
     def close(self):
         pass
 
     @classmethod
-    def _response(cls, obj):
+    def _response(cls, obj, request=None):
+        if callable(obj):
+            obj = obj(request)
+        if isinstance(obj, SessionResponseMock):
+            return obj
+        if isinstance(obj, bytes):
+            return SessionResponseMock(content=obj)
         return SessionResponseMock(content=json.dumps(obj))
 
 
 class SessionResponseMock:
-    def __init__(self, content=None):
+    def __init__(self, content=None, status_code=200, reason='OK', headers=None):
         self.content = content
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers or {}
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+    @property
+    def raw(self):
+        return io.BytesIO(self.content)
+
+    def close(self):
+        pass
 
 
 def open_res(file_path: str):
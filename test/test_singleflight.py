@@ -0,0 +1,75 @@
+import threading
+import unittest
+
+from xcube_dcfs.singleflight import SingleFlight
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def test_sequential_calls_are_not_coalesced(self):
+        singleflight = SingleFlight()
+        self.assertEqual(1, singleflight.do('a', lambda: 1))
+        self.assertEqual(2, singleflight.do('a', lambda: 2))
+        self.assertEqual(dict(calls=2, coalesced=0, in_flight=0), singleflight.stats)
+
+    def test_concurrent_calls_are_coalesced(self):
+        singleflight = SingleFlight()
+        release = threading.Event()
+        num_calls = [0]
+        shared = []
+        results = []
+
+        def func():
+            num_calls[0] += 1
+            release.wait(5)
+            return bytearray(b'result')
+
+        def call():
+            results.append(singleflight.do('a', func, on_shared=shared.append))
+
+        threads = [threading.Thread(target=call) for _ in range(5)]
+        threads[0].start()
+        while singleflight.stats['in_flight'] == 0:
+            pass
+        for thread in threads[1:]:
+            thread.start()
+        while singleflight.stats['coalesced'] < 4:
+            pass
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(1, num_calls[0])
+        self.assertEqual(5, len(results))
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual([results[0]], shared)
+        self.assertEqual(dict(calls=1, coalesced=4, in_flight=0), singleflight.stats)
+
+    def test_errors_are_shared(self):
+        singleflight = SingleFlight()
+        release = threading.Event()
+        errors = []
+
+        def func():
+            release.wait(5)
+            raise ValueError('failed')
+
+        def call():
+            try:
+                singleflight.do('a', func)
+            except ValueError as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=call) for _ in range(3)]
+        threads[0].start()
+        while singleflight.stats['in_flight'] == 0:
+            pass
+        for thread in threads[1:]:
+            thread.start()
+        while singleflight.stats['coalesced'] < 2:
+            pass
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(3, len(errors))
+        self.assertEqual(0, singleflight.stats['in_flight'])
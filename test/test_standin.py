@@ -0,0 +1,101 @@
+import os
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from xcube_dcfs.auth import TokenManager
+from xcube_dcfs.benchmark import run_benchmarks, format_results
+from xcube_dcfs.sentinelhub import SentinelHub, SentinelHubError
+from xcube_dcfs.standin import SentinelHubStandIn
+from xcube_dcfs.throttle import Throttle
+
+
+@mock.patch.dict(os.environ, {'OAUTHLIB_INSECURE_TRANSPORT': '1'})
+class SentinelHubStandInTest(unittest.TestCase):
+
+    def new_sentinel_hub(self, stand_in: SentinelHubStandIn, **kwargs) -> SentinelHub:
+        return SentinelHub('my-client', 'my-secret',
+                           api_url=stand_in.api_url,
+                           oauth2_url=stand_in.oauth2_url,
+                           token_cache_dir=None,
+                           **kwargs)
+
+    def test_metadata(self):
+        with SentinelHubStandIn(datasets={'DEM': ['DEM']}) as stand_in:
+            sentinel_hub = self.new_sentinel_hub(stand_in)
+            self.assertEqual(['DEM'], sentinel_hub.dataset_names)
+            self.assertEqual(['DEM'], sentinel_hub.band_names('DEM'))
+            self.assertTrue(sentinel_hub.token_info['active'])
+            self.assertEqual(1, stand_in.counters['token_requests'])
+            sentinel_hub.close()
+
+    def test_get_arrays(self):
+        with SentinelHubStandIn() as stand_in:
+            sentinel_hub = self.new_sentinel_hub(stand_in)
+            request = SentinelHub.new_data_request('S2L1C', ['B02', 'B03'], (30, 20), sample_types=['UINT8', 'FLOAT32'])
+            arrays = sentinel_hub.get_arrays(request)
+            self.assertEqual((20, 30), arrays['B02'].shape)
+            self.assertEqual(np.uint8, arrays['B02'].dtype)
+            self.assertEqual(np.float32, arrays['B03'].dtype)
+
+            request = SentinelHub.new_data_request('S2L1C', ['B02', 'B03'], (30, 20), multi_band=True)
+            self.assertEqual((2, 20, 30), sentinel_hub.get_arrays(request)['bands'].shape)
+            sentinel_hub.close()
+
+    def test_throttling(self):
+        with SentinelHubStandIn(throttle_every=2) as stand_in:
+            sentinel_hub = self.new_sentinel_hub(stand_in, throttle=Throttle(backoff_interval=0.001))
+            requests = [SentinelHub.new_data_request('S2L1C', ['B02'], (10, 10 + i)) for i in range(4)]
+            results = dict(sentinel_hub.get_data_many(requests, max_workers=2))
+            self.assertFalse(any(isinstance(result, SentinelHubError) for result in results.values()))
+            self.assertGreater(stand_in.counters['throttled_requests'], 0)
+            self.assertEqual(stand_in.counters['throttled_requests'], sentinel_hub.throttle.num_throttled)
+            sentinel_hub.close()
+
+    def test_errors(self):
+        with SentinelHubStandIn() as stand_in:
+            sentinel_hub = self.new_sentinel_hub(stand_in)
+            with self.assertRaises(SentinelHubError) as cm:
+                sentinel_hub.get_data({'output': {}})
+            self.assertEqual(400, cm.exception.status_code)
+            sentinel_hub.close()
+
+    def test_failed_background_refresh(self):
+        num_fetches = [0]
+
+        def fetch_token():
+            num_fetches[0] += 1
+            if num_fetches[0] == 2:
+                raise OSError('token endpoint unavailable')
+            return dict(access_token=f'token-{num_fetches[0]}', token_type='Bearer', expires_in=0.4)
+
+        with SentinelHubStandIn(datasets={'DEM': ['DEM']}) as stand_in:
+            token_manager = TokenManager('my-client', 'my-secret', stand_in.oauth2_url + '/token',
+                                         cache_dir=None, refresh_retry_delay=60.0, fetch_token=fetch_token)
+            sentinel_hub = SentinelHub(api_url=stand_in.api_url, oauth2_url=stand_in.oauth2_url,
+                                       token_manager=token_manager)
+            self.assertEqual(['DEM'], sentinel_hub.band_names('DEM'))
+            # The background refresh fails, and the token expires before it is retried
+            time.sleep(0.5)
+            self.assertEqual(2, num_fetches[0])
+            self.assertEqual(['DEM'], sentinel_hub.band_names('DEM'))
+            self.assertEqual('token-3', sentinel_hub.token['access_token'])
+            request = SentinelHub.new_data_request('S2L1C', ['B02'], (10, 10))
+            self.assertEqual((10, 10), sentinel_hub.get_arrays(request)['B02'].shape)
+            sentinel_hub.close()
+
+
+class BenchmarkTest(unittest.TestCase):
+
+    @mock.patch.dict(os.environ, {'OAUTHLIB_INSECURE_TRANSPORT': '1'})
+    def test_run_benchmarks(self):
+        results = run_benchmarks(size=32, num_bands=2, num_requests=2, max_workers=2)
+        names = [result.name for result in results]
+        self.assertIn('get_data', names)
+        self.assertIn('xr.open_zarr.compute', names)
+        get_data_result = results[names.index('get_data')]
+        self.assertEqual(2, len(get_data_result.latencies))
+        self.assertGreater(get_data_result.num_bytes, 2 * 2 * 32 * 32 * 4)
+        self.assertIn('get_arrays', format_results(results))
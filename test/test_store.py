@@ -0,0 +1,156 @@
+import json
+import unittest
+
+import numpy as np
+import xarray as xr
+
+from test.test_decoder import new_tar_content
+from test.test_sentinelhub import SessionMock
+from xcube_dcfs.encoding import plan_encodings
+from xcube_dcfs.sentinelhub import SentinelHub, SAMPLE_TYPE_TO_DTYPE
+from xcube_dcfs.store import SentinelHubStore, new_acquisition_coverage
+from xcube_dcfs.tracing import TracingStore
+
+PROCESS_URL = 'https://services.sentinel-hub.com/api/v1/process'
+
+
+class SentinelHubStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.requests = []
+        self.sentinel_hub = SentinelHub(session=SessionMock({'post': {PROCESS_URL: self._process}}))
+
+    def tearDown(self):
+        self.sentinel_hub.close()
+
+    def _process(self, request):
+        self.requests.append(request)
+        return new_tar_content(new_process_response_arrays(request))
+
+    def new_store(self, **kwargs):
+        params = dict(dataset_name='S2L1C',
+                      band_names=['B02', 'B04'],
+                      bbox=(10.0, 50.0, 11.0, 50.5),
+                      spatial_res=0.01,
+                      time_range=('2018-10-01T00:00:00.000Z', '2018-10-04T00:00:00.000Z'),
+                      tile_size=(40, 20))
+        params.update(kwargs)
+        return SentinelHubStore(self.sentinel_hub, **params)
+
+    def test_metadata(self):
+        store = self.new_store()
+        self.assertIn('.zgroup', store)
+        self.assertIn('.zattrs', store)
+        zarray = json.loads(store['B04/.zarray'])
+        self.assertEqual([3, 50, 100], zarray['shape'])
+        self.assertEqual([1, 20, 40], zarray['chunks'])
+        self.assertEqual('<f4', zarray['dtype'])
+        self.assertEqual(['time', 'lat', 'lon'], json.loads(store['B04/.zattrs'])['_ARRAY_DIMENSIONS'])
+        self.assertEqual(['.zattrs', '.zgroup', '.zmetadata', 'B02', 'B04', 'lat', 'lon', 'time'], store.listdir())
+        self.assertEqual(['.zarray', '.zattrs', '0'], store.listdir('lon'))
+        self.assertEqual(3 + 3 * 3 + 2 * 2 + 2 * 3 * 3 * 3, len(store))
+        self.assertEqual([], self.requests)
+
+    def test_consolidated_metadata(self):
+        store = self.new_store()
+        zmetadata = json.loads(store['.zmetadata'])
+        self.assertEqual(1, zmetadata['zarr_consolidated_format'])
+        self.assertEqual(json.loads(store['B04/.zarray']), zmetadata['metadata']['B04/.zarray'])
+        self.assertEqual(2 + 3 * 2 + 2 * 2, len(zmetadata['metadata']))
+        tracing_store = TracingStore(store)
+        ds = xr.open_zarr(tracing_store, consolidated=True)
+        self.assertEqual({'B02', 'B04'}, set(ds.data_vars))
+        self.assertEqual(dict(getitem=1), tracing_store.stats['metadata']['operations'])
+        self.assertEqual(0, tracing_store.stats['listing']['accesses'])
+
+    def test_chunk_keys(self):
+        store = self.new_store()
+        self.assertIn('B04/2.2.2', store)
+        self.assertNotIn('B04/3.0.0', store)
+        self.assertNotIn('B04/0.3.0', store)
+        self.assertNotIn('B08/0.0.0', store)
+        self.assertNotIn('B04/0.0', store)
+        with self.assertRaises(KeyError):
+            store['B04/0.0.3']
+
+    def test_tile_request(self):
+        store = self.new_store()
+        request = store.new_tile_request('B04', 1, 2, 2)
+        self.assertEqual(20, request['output']['width'])
+        self.assertEqual(10, request['output']['height'])
+        np.testing.assert_almost_equal([10.8, 50.0, 11.0, 50.1], request['input']['bounds']['bbox'])
+        self.assertEqual({'from': '2018-10-02T00:00:00Z', 'to': '2018-10-03T00:00:00Z'},
+                         request['input']['data'][0]['dataFilter']['timeRange'])
+
+    def test_open_zarr_is_lazy(self):
+        ds = xr.open_zarr(self.new_store())
+        self.assertEqual({'B02', 'B04'}, set(ds.data_vars))
+        self.assertEqual({'time': 3, 'lat': 50, 'lon': 100}, dict(ds.sizes))
+        self.assertAlmostEqual(10.005, float(ds.lon[0]))
+        self.assertAlmostEqual(50.495, float(ds.lat[0]))
+        self.assertEqual(np.datetime64('2018-10-01T12:00:00'), ds.time.values[0])
+        self.assertEqual([], self.requests)
+
+    def test_read_region(self):
+        ds = xr.open_zarr(self.new_store())
+        values = ds.B04.isel(time=1, lat=slice(0, 10), lon=slice(0, 10)).values
+        self.assertEqual(1, len(self.requests))
+        self.assertEqual(['B04'], [r['identifier'] for r in self.requests[0]['output']['responses']])
+        np.testing.assert_equal(np.full((10, 10), 4.0, dtype=np.float32), values)
+
+    def test_read_edge_chunk(self):
+        ds = xr.open_zarr(self.new_store(sample_types='UINT16'))
+        self.assertEqual(np.uint16, ds.B02.dtype)
+        values = ds.B02.isel(time=0, lat=slice(40, 50), lon=slice(80, 100)).values
+        self.assertEqual(1, len(self.requests))
+        np.testing.assert_equal(np.full((10, 20), 2, dtype=np.uint16), values)
+
+    def test_encodings(self):
+        store = self.new_store(encodings=plan_encodings(['B02', 'B04']))
+        zarray = json.loads(store['B04/.zarray'])
+        self.assertEqual('<u2', zarray['dtype'])
+        self.assertEqual(65535, zarray['fill_value'])
+        self.assertEqual(dict(units='reflectance', scale_factor=1e-4, _ARRAY_DIMENSIONS=['time', 'lat', 'lon']),
+                         json.loads(store['B04/.zattrs']))
+        ds = xr.open_zarr(store)
+        self.assertEqual(np.uint16, ds.B04.encoding['dtype'])
+        values = ds.B04.isel(time=0, lat=slice(40, 50), lon=slice(80, 100)).values
+        self.assertEqual(1, len(self.requests))
+        self.assertIn("sampleType: 'UINT16'", self.requests[0]['evalscript'])
+        np.testing.assert_almost_equal(np.full((10, 20), 4e-4), values)
+
+    def test_coverage(self):
+        coverage = new_acquisition_coverage([((10.0, 50.0, 10.3, 50.5), '2018-10-02T10:00:00Z')])
+        store = self.new_store(coverage=coverage)
+        self.assertTrue(store.is_covered(1, 2, 0))
+        self.assertFalse(store.is_covered(1, 2, 1))
+        self.assertFalse(store.is_covered(0, 2, 0))
+        values = xr.open_zarr(store).B04.values
+        # Only the western column of tiles at the second time step has acquisitions
+        self.assertEqual(3, len(self.requests))
+        self.assertEqual(dict(requests=3, avoided_requests=24, avoided_bytes=(3 * 50 * 100 - 40 * 50) * 4),
+                         store.stats)
+        np.testing.assert_equal(4.0, values[1, :, 0:40])
+        self.assertTrue(np.isnan(values[1, :, 40:]).all())
+        self.assertTrue(np.isnan(values[0]).all())
+
+    def test_read_only(self):
+        store = self.new_store()
+        with self.assertRaises(TypeError):
+            store['B02/0.0.0'] = b''
+        with self.assertRaises(TypeError):
+            del store['.zgroup']
+
+
+def new_process_response_arrays(request):
+    """Create arrays for each response of a "/process" request, filled with the band's number."""
+    width = request['output']['width']
+    height = request['output']['height']
+    evalscript = request['evalscript']
+    arrays = {}
+    for response in request['output']['responses']:
+        identifier = response['identifier']
+        sample_type = evalscript.split(f"{{id: {identifier!r}")[1].split("sampleType: '")[1].split("'")[0]
+        dtype = SAMPLE_TYPE_TO_DTYPE[sample_type]
+        arrays[identifier] = np.full((height, width), int(identifier[1:]), dtype=dtype)
+    return arrays
@@ -0,0 +1,182 @@
+import json
+import os
+import shutil
+import subprocess
+import unittest
+
+import numpy as np
+
+from xcube_dcfs.encoding import plan_encodings
+from xcube_dcfs.sentinelhub import SentinelHub
+from xcube_dcfs.template import RequestTemplate, TEMPORAL_REDUCERS
+
+TIME_RANGE = ("2018-10-01T00:00:00.000Z", "2018-10-10T00:00:00.000Z")
+BBOX = (13.822, 45.850, 14.559, 46.291)
+
+
+class RequestTemplateTest(unittest.TestCase):
+
+    def test_new_request_equals_new_data_request(self):
+        template = RequestTemplate('S2L1C', ['B02', 'B03', 'B04', 'B08'], sample_types='INT8')
+        with open(os.path.join(os.path.dirname(__file__), 'request-multi.json')) as fp:
+            expected_request = json.load(fp)
+        self.assertEqual(expected_request, template.new_request((512, 512), time_range=TIME_RANGE, bbox=BBOX))
+
+    def test_new_requests_are_independent(self):
+        template = RequestTemplate('S2L1C', ['B02'])
+        request_1 = template.new_request((512, 512), bbox=BBOX)
+        request_1['output']['responses'][0]['identifier'] = 'B03'
+        request_1['input']['data'][0]['processing']['upsampling'] = 'NEAREST'
+        request_2 = template.new_request((512, 512), bbox=BBOX)
+        self.assertEqual('B02', request_2['output']['responses'][0]['identifier'])
+        self.assertEqual('BILINEAR', request_2['input']['data'][0]['processing']['upsampling'])
+
+    def test_new_request_json(self):
+        template = RequestTemplate('S2L2A', ['B04', 'B08'], band_units='DN', sample_types=['UINT16', 'FLOAT32'])
+        for size, time_range, bbox in [((512, 256), TIME_RANGE, BBOX),
+                                       ((10, 20), ('2018-10-01', None), BBOX),
+                                       ((10, 20), None, None)]:
+            request = template.new_request(size, time_range=time_range, bbox=bbox)
+            self.assertEqual(json.dumps(request).encode('utf-8'),
+                             template.new_request_json(size, time_range=time_range, bbox=bbox))
+            self.assertEqual(SentinelHub.new_data_request('S2L2A', ['B04', 'B08'], size,
+                                                          time_range=time_range, bbox=bbox, band_units='DN',
+                                                          sample_types=['UINT16', 'FLOAT32']),
+                             request)
+
+    def test_multi_band(self):
+        template = RequestTemplate('S2L1C', ['B02', 'B03', 'B04'], sample_types='UINT16', multi_band=True)
+        request = template.new_request((8, 4), bbox=BBOX)
+        self.assertEqual([{'identifier': 'bands', 'format': {'type': 'image/tiff'}}],
+                         request['output']['responses'])
+        self.assertIn("{id: 'bands', bands: 3, sampleType: 'UINT16'}", request['evalscript'])
+        self.assertIn("bands: [sample.B02, sample.B03, sample.B04]", request['evalscript'])
+        self.assertEqual(json.dumps(request).encode('utf-8'), template.new_request_json((8, 4), bbox=BBOX))
+
+    def test_multi_band_requires_common_sample_type(self):
+        with self.assertRaises(ValueError):
+            RequestTemplate('S2L1C', ['B02', 'B03'], sample_types=['UINT16', 'FLOAT32'], multi_band=True)
+
+    def test_split_bands(self):
+        data = np.arange(24, dtype=np.float32).reshape((3, 2, 4))
+        template = RequestTemplate('S2L1C', ['B02', 'B03', 'B04'], multi_band=True)
+        arrays = template.split_bands({'bands': data})
+        self.assertEqual(['B02', 'B03', 'B04'], list(arrays.keys()))
+        np.testing.assert_equal(data[1], arrays['B03'])
+        self.assertTrue(np.shares_memory(data, arrays['B03']))
+        single_band_arrays = {'B02': data[0]}
+        self.assertIs(single_band_arrays, RequestTemplate('S2L1C', ['B02']).split_bands(single_band_arrays))
+
+
+def evaluate_pixel(evalscript: str, samples):
+    """Run the evaluatePixel() function of *evalscript* with node.js."""
+    script = evalscript + '\nconsole.log(JSON.stringify(evaluatePixel(' + json.dumps(samples) + ')));'
+    output = subprocess.run(['node'], input=script.encode('utf-8'), stdout=subprocess.PIPE, check=True).stdout
+    return json.loads(output)
+
+
+class ExpressionTemplateTest(unittest.TestCase):
+
+    def test_expressions(self):
+        template = RequestTemplate('S2L2A', ['B04', 'B08'],
+                                   expressions=dict(ndvi='(B08 - B04) / (B08 + B04)', vegetated='ndvi > 0.5'),
+                                   sample_types=['FLOAT32', 'UINT8'])
+        self.assertEqual(['ndvi', 'vegetated'], template.output_names)
+        request = template.new_request((8, 4), bbox=BBOX)
+        self.assertEqual(['ndvi', 'vegetated'], [response['identifier'] for response in request['output']['responses']])
+        self.assertIn("{id: 'ndvi', bands: 1, sampleType: 'FLOAT32'}", request['evalscript'])
+        self.assertIn("bands: ['B04', 'B08'],", request['evalscript'])
+        self.assertNotIn("mosaicking", request['evalscript'])
+        self.assertEqual(json.dumps(request).encode('utf-8'), template.new_request_json((8, 4), bbox=BBOX))
+        if shutil.which('node'):
+            result = evaluate_pixel(template.evalscript, dict(B04=0.1, B08=0.3))
+            np.testing.assert_almost_equal([0.5], result['ndvi'])
+            self.assertEqual([False], result['vegetated'])
+
+    @unittest.skipUnless(shutil.which('node'), 'node.js is not available')
+    def test_expressions_with_literals(self):
+        template = RequestTemplate('S2L2A', ['B04', 'B08'],
+                                   expressions=dict(ndvi='(B08 - B04) / (B08 + B04 + 0.0001)', double='2 * B04'))
+        result = evaluate_pixel(template.evalscript, dict(B04=0.0, B08=0.0))
+        self.assertEqual(dict(ndvi=[0.0], double=[0.0]), result)
+        result = evaluate_pixel(template.evalscript, dict(B04=0.1, B08=0.3))
+        np.testing.assert_almost_equal([0.2 / 0.4001], result['ndvi'])
+        np.testing.assert_almost_equal([0.2], result['double'])
+
+    def test_invalid_expressions(self):
+        for expressions in [dict(ndvi='B08 - B05'), dict(ndvi='B08.real'), dict(ndvi='open(B08)'),
+                            dict(ndvi='(B08'), {'nd-vi': 'B08'}]:
+            with self.assertRaises(ValueError, msg=str(expressions)):
+                RequestTemplate('S2L2A', ['B04', 'B08'], expressions=expressions)
+        with self.assertRaises(ValueError):
+            RequestTemplate('S2L2A', ['B04'], temporal_reducer='mode')
+
+    def test_multi_band_expressions(self):
+        template = RequestTemplate('S2L2A', ['B04', 'B08'], multi_band=True, temporal_reducer='max',
+                                   expressions=dict(ndvi='(B08 - B04) / (B08 + B04)', diff='B08 - B04'))
+        self.assertIn("{id: 'bands', bands: 2, sampleType: 'FLOAT32'}", template.evalscript)
+        data = np.zeros((2, 3, 4))
+        self.assertEqual(['ndvi', 'diff'], list(template.split_bands({'bands': data}).keys()))
+        if shutil.which('node'):
+            samples = [dict(B04=0.1, B08=0.3, dataMask=1), dict(B04=0.1, B08=0.4, dataMask=1)]
+            np.testing.assert_almost_equal([0.6, 0.3], evaluate_pixel(template.evalscript, samples)['bands'])
+
+    @unittest.skipUnless(shutil.which('node'), 'node.js is not available')
+    def test_temporal_reducers(self):
+        samples = [dict(B04=4, dataMask=1, CLM=1),
+                   dict(B04=1, dataMask=0, CLM=0),
+                   dict(B04=2, dataMask=1, CLM=0),
+                   dict(B04=9, dataMask=1, CLM=0),
+                   dict(B04=3, dataMask=1, CLM=0)]
+        expected = dict(mean=4.5, min=2, max=9, median=3.5, latest=4, latest_cloud_free=2)
+        for temporal_reducer in TEMPORAL_REDUCERS:
+            template = RequestTemplate('S2L2A', ['B04'], temporal_reducer=temporal_reducer)
+            self.assertIn("mosaicking: 'ORBIT'", template.evalscript)
+            self.assertEqual(dict(B04=[expected[temporal_reducer]]), evaluate_pixel(template.evalscript, samples),
+                             msg=temporal_reducer)
+            # No valid samples
+            self.assertEqual(dict(B04=[None]), evaluate_pixel(template.evalscript, samples[1:2]))
+
+
+class EncodingTemplateTest(unittest.TestCase):
+
+    def test_encodings(self):
+        template = RequestTemplate('S2L2A', ['B04', 'CLM'], band_units=['reflectance', 'DN'],
+                                   encodings=plan_encodings(['B04', 'CLM'], ['reflectance', 'DN']))
+        self.assertEqual(['UINT16', 'UINT8'], template.sample_types)
+        self.assertIn("{id: 'B04', bands: 1, sampleType: 'UINT16'}", template.evalscript)
+        self.assertIn("{id: 'CLM', bands: 1, sampleType: 'UINT8'}", template.evalscript)
+        self.assertIn("'dataMask'", template.evalscript)
+        if shutil.which('node'):
+            result = evaluate_pixel(template.evalscript, dict(B04=0.1234, CLM=1, dataMask=1))
+            self.assertEqual(dict(B04=[1234], CLM=[1]), result)
+            result = evaluate_pixel(template.evalscript, dict(B04=0.0, CLM=0, dataMask=0))
+            self.assertEqual(dict(B04=[65535], CLM=[0]), result)
+
+    def test_identity_encodings(self):
+        template = RequestTemplate('S2L2A', ['CLM'], band_units='DN', encodings=plan_encodings(['CLM'], 'DN'))
+        self.assertEqual(['UINT8'], template.sample_types)
+        self.assertEqual(RequestTemplate('S2L2A', ['CLM'], band_units='DN', sample_types='UINT8').evalscript,
+                         template.evalscript)
+
+    def test_fill_no_data(self):
+        template = RequestTemplate('S2L2A', ['B04', 'CLM'], band_units=['reflectance', 'DN'],
+                                   sample_types=['FLOAT32', 'UINT8'], fill_no_data=True)
+        self.assertIn("'dataMask'", template.evalscript)
+        if shutil.which('node'):
+            result = evaluate_pixel(template.evalscript, dict(B04=0.1234, CLM=1, dataMask=1))
+            self.assertEqual(dict(B04=[0.1234], CLM=[1]), result)
+            # NaN becomes null in JSON
+            result = evaluate_pixel(template.evalscript, dict(B04=0.0, CLM=0, dataMask=0))
+            self.assertEqual(dict(B04=[None], CLM=[0]), result)
+        # Integer bands without encodings have no fill value
+        self.assertEqual(RequestTemplate('S2L2A', ['CLM'], band_units='DN', sample_types='UINT8').evalscript,
+                         RequestTemplate('S2L2A', ['CLM'], band_units='DN', sample_types='UINT8',
+                                         fill_no_data=True).evalscript)
+
+    @unittest.skipUnless(shutil.which('node'), 'node.js is not available')
+    def test_encoded_temporal_reducer(self):
+        template = RequestTemplate('S2L2A', ['B04'], temporal_reducer='max', encodings=plan_encodings(['B04']))
+        samples = [dict(B04=0.2, dataMask=1), dict(B04=0.3, dataMask=1)]
+        self.assertEqual(dict(B04=[3000]), evaluate_pixel(template.evalscript, samples))
+        self.assertEqual(dict(B04=[65535]), evaluate_pixel(template.evalscript, [dict(B04=0.0, dataMask=0)]))
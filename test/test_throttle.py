@@ -0,0 +1,36 @@
+import time
+import unittest
+
+from xcube_dcfs.throttle import Throttle
+
+
+class ThrottleTest(unittest.TestCase):
+
+    def test_unthrottled_does_not_wait(self):
+        throttle = Throttle()
+        t1 = time.perf_counter()
+        for _ in range(100):
+            throttle.wait()
+        self.assertLess(time.perf_counter() - t1, 0.1)
+        self.assertEqual(0.0, throttle.interval)
+
+    def test_interval_adapts(self):
+        throttle = Throttle(backoff_interval=0.01, max_interval=0.05)
+        throttle.on_throttled(0.0)
+        self.assertAlmostEqual(0.01, throttle.interval)
+        throttle.on_throttled(0.0)
+        self.assertAlmostEqual(0.02, throttle.interval)
+        for _ in range(3):
+            throttle.on_throttled(0.0)
+        self.assertAlmostEqual(0.05, throttle.interval)
+        self.assertEqual(5, throttle.num_throttled)
+        for _ in range(10):
+            throttle.on_success()
+        self.assertEqual(0.0, throttle.interval)
+
+    def test_retry_after_blocks(self):
+        throttle = Throttle()
+        throttle.on_throttled(0.05)
+        t1 = time.perf_counter()
+        throttle.wait()
+        self.assertGreaterEqual(time.perf_counter() - t1, 0.04)
@@ -0,0 +1,105 @@
+import unittest
+
+import numpy as np
+
+from test.test_decoder import new_tar_content
+from test.test_sentinelhub import SessionMock
+from xcube_dcfs.sentinelhub import SentinelHub
+from xcube_dcfs.template import RequestTemplate
+from xcube_dcfs.tileindex import TileIndex
+
+PROCESS_URL = 'https://services.sentinel-hub.com/api/v1/process'
+RES = 0.01
+
+
+def new_pixel_arrays(request):
+    """Create arrays whose values identify the global pixel position, so that crops of tiles can be compared."""
+    x1, _, _, y2 = request['input']['bounds']['bbox']
+    width = request['output']['width']
+    height = request['output']['height']
+    col = int(round(x1 / RES))
+    row = int(round(-y2 / RES))
+    rows, cols = np.mgrid[row: row + height, col: col + width]
+    values = (1000 * (rows % 1000) + cols % 1000).astype(np.float32)
+    return {response['identifier']: values + i for i, response in enumerate(request['output']['responses'])}
+
+
+class TileIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.requests = []
+        self.tile_index = TileIndex(cell_size=16)
+        self.sentinel_hub = SentinelHub(session=SessionMock({'post': {PROCESS_URL: self._process}}),
+                                        tile_index=self.tile_index)
+        self.template = RequestTemplate('S2L1C', ['B02', 'B04'])
+
+    def tearDown(self):
+        self.sentinel_hub.close()
+
+    def _process(self, request):
+        self.requests.append(request)
+        return new_tar_content(new_pixel_arrays(request))
+
+    def new_request(self, x1, y1, x2, y2, time_range=('2019-01-01', '2019-01-02')):
+        size = int(round((x2 - x1) / RES)), int(round((y2 - y1) / RES))
+        return self.template.new_request(size, time_range=time_range, bbox=(x1, y1, x2, y2))
+
+    def assert_arrays(self, request, arrays):
+        expected = new_pixel_arrays(request)
+        self.assertEqual(set(expected.keys()), set(arrays.keys()))
+        for identifier, array in arrays.items():
+            np.testing.assert_equal(expected[identifier], array)
+
+    def test_covered_request_is_answered_locally(self):
+        self.sentinel_hub.get_arrays(self.new_request(10.0, 50.0, 10.5, 50.5))
+        self.assertEqual(1, len(self.requests))
+
+        request = self.new_request(10.13, 50.2, 10.37, 50.41)
+        arrays = self.sentinel_hub.get_arrays(request)
+        self.assertEqual(1, len(self.requests))
+        self.assert_arrays(request, arrays)
+        # Returned arrays are copies
+        arrays['B02'][:] = 0
+        self.assert_arrays(request, self.sentinel_hub.get_arrays(request))
+        self.assertEqual(2, self.tile_index.stats['hits'])
+
+    def test_mosaic_of_tiles(self):
+        self.sentinel_hub.get_arrays(self.new_request(10.0, 50.0, 10.5, 50.5))
+        self.sentinel_hub.get_arrays(self.new_request(10.5, 50.0, 11.0, 50.5))
+        request = self.new_request(10.3, 50.1, 10.8, 50.3)
+        self.assert_arrays(request, self.sentinel_hub.get_arrays(request))
+        self.assertEqual(2, len(self.requests))
+
+    def test_only_uncovered_part_is_fetched(self):
+        self.sentinel_hub.get_arrays(self.new_request(10.0, 50.0, 10.5, 50.5))
+        request = self.new_request(10.25, 50.0, 10.75, 50.5)
+        self.assert_arrays(request, self.sentinel_hub.get_arrays(request))
+        self.assertEqual(2, len(self.requests))
+        np.testing.assert_almost_equal([10.5, 50.0, 10.75, 50.5], self.requests[1]['input']['bounds']['bbox'])
+        self.assertEqual((25, 50), (self.requests[1]['output']['width'], self.requests[1]['output']['height']))
+        self.assertEqual(1, self.tile_index.stats['partial_hits'])
+
+    def test_other_layers_are_not_used(self):
+        self.sentinel_hub.get_arrays(self.new_request(10.0, 50.0, 10.5, 50.5))
+        # Other time range
+        self.sentinel_hub.get_arrays(self.new_request(10.1, 50.1, 10.2, 50.2, time_range=('2019-01-02', '2019-01-03')))
+        # Other resolution
+        self.sentinel_hub.get_arrays(self.template.new_request((20, 20), bbox=(10.1, 50.1, 10.2, 50.2)))
+        # Misaligned pixel grid
+        self.sentinel_hub.get_arrays(self.new_request(10.105, 50.1, 10.205, 50.2))
+        self.assertEqual(4, len(self.requests))
+        self.assertEqual(dict(hits=0, partial_hits=0, misses=4), {k: v for k, v in self.tile_index.stats.items()
+                                                                   if k in ('hits', 'partial_hits', 'misses')})
+
+    def test_eviction(self):
+        tile_index = TileIndex(max_size=2 * 50 * 50 * 4 * 2)
+        sentinel_hub = SentinelHub(session=SessionMock({'post': {PROCESS_URL: self._process}}),
+                                   tile_index=tile_index)
+        for i in range(3):
+            sentinel_hub.get_arrays(self.new_request(10.0 + i, 50.0, 10.5 + i, 50.5))
+        self.assertEqual(2, tile_index.stats['tiles'])
+        self.assertEqual(2 * 50 * 50 * 4 * 2, tile_index.stats['size'])
+        sentinel_hub.get_arrays(self.new_request(10.0, 50.0, 10.1, 50.1))
+        self.assertEqual(4, len(self.requests))
+        tile_index.clear()
+        self.assertEqual(0, tile_index.stats['tiles'])
@@ -0,0 +1,94 @@
+import unittest
+
+import numpy as np
+
+from test.test_decoder import new_tar_content
+from test.test_sentinelhub import SessionMock, SessionResponseMock
+from xcube_dcfs.sentinelhub import SentinelHub, SentinelHubError
+from xcube_dcfs.tiling import TileGrid, fetch_mosaic
+
+PROCESS_URL = 'https://services.sentinel-hub.com/api/v1/process'
+
+
+class TileGridTest(unittest.TestCase):
+
+    def test_tiles(self):
+        grid = TileGrid((0.0, 0.0, 10.0, 5.0), 0.5, (8, 4))
+        self.assertEqual((20, 10), grid.size)
+        self.assertEqual((3, 3), grid.num_tiles)
+        self.assertEqual(9, len(grid))
+        tiles = list(grid)
+        self.assertEqual((0, 0, 0, 0, 8, 4), tiles[0][:6])
+        np.testing.assert_almost_equal((0.0, 3.0, 4.0, 5.0), tiles[0].bbox)
+        self.assertEqual((2, 2, 16, 8, 4, 2), tiles[-1][:6])
+        np.testing.assert_almost_equal((8.0, 0.0, 10.0, 1.0), tiles[-1].bbox)
+        with self.assertRaises(IndexError):
+            grid.tile(3, 0)
+
+    def test_coords(self):
+        grid = TileGrid((0.0, 0.0, 2.0, 1.0), 0.5, (2, 2))
+        np.testing.assert_almost_equal([0.25, 0.75, 1.25, 1.75], grid.lon_values())
+        np.testing.assert_almost_equal([0.75, 0.25], grid.lat_values())
+
+    def test_plan(self):
+        grid = TileGrid.plan((0.0, 0.0, 60.0, 10.0), 0.01, chunk_size=(512, 256))
+        self.assertEqual((6000, 1000), grid.size)
+        self.assertEqual((2048, 1000), grid.tile_size)
+        self.assertEqual((3, 1), grid.num_tiles)
+
+        grid = TileGrid.plan((0.0, 0.0, 60.0, 30.0), 0.01, chunk_size=(500, 1000), max_tile_size=(2500, 2500))
+        self.assertEqual((2500, 2000), grid.tile_size)
+
+        with self.assertRaises(ValueError):
+            TileGrid.plan((0.0, 0.0, 60.0, 10.0), 0.01, chunk_size=(4096, 256))
+
+
+class FetchMosaicTest(unittest.TestCase):
+
+    def test_fetch_mosaic(self):
+        requests = []
+
+        def process(request):
+            requests.append(request)
+            x1, _, _, y2 = request['input']['bounds']['bbox']
+            width = request['output']['width']
+            height = request['output']['height']
+            # Encode the global pixel position into the values
+            x = np.round((x1 + (np.arange(width) + 0.5) * 0.1) * 10 - 0.5)
+            y = np.round((5.0 - y2 + (np.arange(height) + 0.5) * 0.1) * 10 - 0.5)
+            values = (100 * y[:, np.newaxis] + x[np.newaxis, :]).astype(np.float32)
+            return new_tar_content(dict(B04=values, B08=-values))
+
+        sentinel_hub = SentinelHub(session=SessionMock({'post': {PROCESS_URL: process}}))
+        ds = fetch_mosaic(sentinel_hub, 'S2L2A', ['B04', 'B08'], (0.0, 0.0, 10.0, 5.0), 0.1,
+                          chunk_size=(20, 20), max_tile_size=(40, 30), max_workers=3)
+        self.assertEqual(3 * 3, len(requests))
+        self.assertTrue(all(r['output']['width'] <= 40 and r['output']['height'] <= 30 for r in requests))
+        self.assertEqual({'lat': 50, 'lon': 100}, dict(ds.sizes))
+        self.assertAlmostEqual(0.05, float(ds.lon[0]))
+        self.assertAlmostEqual(4.95, float(ds.lat[0]))
+        expected = (100 * np.arange(50)[:, np.newaxis] + np.arange(100)[np.newaxis, :]).astype(np.float32)
+        np.testing.assert_equal(expected, ds.B04.values)
+        np.testing.assert_equal(-expected, ds.B08.values)
+
+    def test_fetch_mosaic_multi_band(self):
+        def process(request):
+            self.assertEqual(['bands'], [r['identifier'] for r in request['output']['responses']])
+            width = request['output']['width']
+            height = request['output']['height']
+            data = np.stack([np.full((height, width), 4, dtype=np.uint16),
+                             np.full((height, width), 8, dtype=np.uint16)])
+            return new_tar_content(dict(bands=data))
+
+        sentinel_hub = SentinelHub(session=SessionMock({'post': {PROCESS_URL: process}}))
+        ds = fetch_mosaic(sentinel_hub, 'S2L2A', ['B04', 'B08'], (0.0, 0.0, 10.0, 5.0), 0.1,
+                          chunk_size=(20, 20), max_tile_size=(40, 30), sample_types='UINT16', multi_band=True)
+        np.testing.assert_equal(np.full((50, 100), 4, dtype=np.uint16), ds.B04.values)
+        np.testing.assert_equal(np.full((50, 100), 8, dtype=np.uint16), ds.B08.values)
+
+    def test_fetch_mosaic_fails(self):
+        sentinel_hub = SentinelHub(session=SessionMock({
+            'post': {PROCESS_URL: SessionResponseMock(content=b'', status_code=500, reason='Internal Error')}
+        }))
+        with self.assertRaises(SentinelHubError):
+            fetch_mosaic(sentinel_hub, 'S2L2A', ['B04'], (0.0, 0.0, 10.0, 5.0), 0.1)
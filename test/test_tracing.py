@@ -0,0 +1,68 @@
+import unittest
+
+import numpy as np
+import xarray as xr
+import zarr
+
+from xcube_dcfs.tracing import TracingStore, get_key_class
+
+
+def new_store():
+    store = {}
+    cube = xr.Dataset(dict(B02=(('time', 'lat', 'lon'), np.ones((2, 4, 6), dtype=np.float32))),
+                      coords=dict(lat=np.arange(4.0), lon=np.arange(6.0), time=np.arange(2.0)))
+    cube.to_zarr(store, encoding=dict(B02=dict(chunks=(1, 2, 3), compressor=None)), consolidated=False)
+    return store
+
+
+class TracingStoreTest(unittest.TestCase):
+
+    def test_get_key_class(self):
+        self.assertEqual('metadata', get_key_class('.zgroup'))
+        self.assertEqual('metadata', get_key_class('B02/.zarray'))
+        self.assertEqual('chunk', get_key_class('B02/0.1.1'))
+        self.assertEqual('chunk', get_key_class('lat/0'))
+
+    def test_open_zarr(self):
+        store = TracingStore(new_store())
+        cube = xr.open_zarr(store, consolidated=False)
+        stats = store.stats
+        # Coordinates are read eagerly
+        self.assertEqual(3, stats['chunk']['operations']['getitem'])
+        self.assertGreater(stats['metadata']['accesses'], 1)
+        self.assertEqual(['metadata'] * 3, [event.key_class for event in store.events[:3]])
+
+        store.reset()
+        cube.B02.isel(time=1, lat=slice(0, 2)).values
+        stats = store.stats
+        self.assertEqual(dict(contains=2, getitem=2), stats['chunk']['operations'])
+        self.assertEqual(2 * 2 * 3 * 4, stats['chunk']['bytes'])
+        self.assertEqual(2, stats['chunk']['keys'])
+        self.assertEqual(0, stats['metadata']['accesses'])
+        self.assertEqual(4, stats['chunk']['latencies']['count'])
+        self.assertIn('chunk      getitem           2        0', store.report())
+
+    def test_misses_and_writes(self):
+        store = TracingStore({})
+        self.assertNotIn('B02/0.0.0', store)
+        with self.assertRaises(KeyError):
+            store['.zgroup']
+        store['.zgroup'] = b'{}'
+        self.assertEqual(b'{}', store['.zgroup'])
+        self.assertEqual(['.zgroup'], [key for key in store])
+        self.assertEqual(1, len(store))
+        del store['.zgroup']
+        stats = store.stats
+        self.assertEqual(dict(getitem=2, setitem=1, delitem=1), stats['metadata']['operations'])
+        self.assertEqual(1, stats['metadata']['misses'])
+        self.assertEqual(3, stats['metadata']['repeated'])
+        self.assertEqual(4, stats['metadata']['bytes'])
+        self.assertEqual(dict(contains=1), stats['chunk']['operations'])
+        self.assertEqual(dict(iter=1, len=1), stats['listing']['operations'])
+        self.assertEqual(['contains', 'getitem', 'setitem', 'getitem', 'iter', 'len', 'delitem'],
+                         [event.operation for event in store.events])
+
+    def test_max_events(self):
+        store = TracingStore({}, max_events=2)
+        zarr.open_group(store=store, mode='w')
+        self.assertEqual(2, len(store.events))
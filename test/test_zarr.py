@@ -2,7 +2,7 @@ import os.path
 import shutil
 import unittest
 import warnings
-from collections import MutableMapping
+from collections.abc import MutableMapping
 from typing import TypeVar, Iterator, List
 
 import numpy as np
@@ -0,0 +1,276 @@
+import asyncio
+import json
+import os
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple, Union
+
+import aiohttp
+import numpy as np
+
+from xcube_dcfs.auth import DEFAULT_REFRESH_MARGIN, DEFAULT_TOKEN_CACHE_DIR, Token, TokenManager
+from xcube_dcfs.decoder import decode_tar
+from xcube_dcfs.instrument import Instrumentation, RequestRecord
+from xcube_dcfs.sentinelhub import DEFAULT_API_URL, DEFAULT_MAX_RETRIES, DEFAULT_OAUTH2_URL, SentinelHubError, \
+    get_processing_units, get_retry_after
+
+DEFAULT_MAX_CONCURRENCY = 64
+DEFAULT_POOL_SIZE = 100
+DEFAULT_KEEPALIVE_TIMEOUT = 30.0
+DEFAULT_BACKOFF_INTERVAL = 0.1
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+_TAR_MIME_TYPE = 'application/tar'
+
+
+class AsyncSentinelHub:
+    """
+    An asyncio client for the SentinelHub API.
+
+    It offers the methods of :class:`SentinelHub` as coroutines, so that a single
+    event loop can keep hundreds of requests in flight without a thread per request.
+    All requests share a pool of keep-alive connections, and the number of process
+    requests that are sent or received concurrently is bounded by a semaphore.
+
+    OAuth2 tokens are provided by a :class:`TokenManager`, so they are shared with
+    other clients and processes through its token cache. The token manager is
+    called in the event loop's default executor when a token is needed, i.e. when
+    there is no valid one, or when a request has been rejected with HTTP 401.
+    Concurrent callers wait for a single token request.
+
+    Use as async context manager, or call :meth:`close` when done::
+
+        async with AsyncSentinelHub() as sentinel_hub:
+            mime_type, data = await sentinel_hub.get_data(request)
+
+    :param client_id: The OAuth2 client ID, defaults to environment variable "SH_CLIENT_ID".
+    :param client_secret: The OAuth2 client secret, defaults to environment variable "SH_CLIENT_SECRET".
+    :param session: Optional ``aiohttp.ClientSession``; if given, it is not closed by :meth:`close`.
+    :param api_url: Base URL of the SentinelHub API.
+    :param oauth2_url: Base URL of the OAuth2 endpoints.
+    :param max_retries: Maximum number of retries of requests rejected with HTTP 429.
+    :param max_concurrency: Maximum number of concurrent process requests.
+    :param pool_size: Maximum number of pooled connections.
+    :param keepalive_timeout: Seconds an idle pooled connection is kept open.
+    :param refresh_margin: Tokens are refreshed this number of seconds before their actual expiry.
+    :param token_manager: Optional token manager; if given, it is not closed by :meth:`close`.
+    :param token_cache_dir: Directory of the token manager's token files, see :class:`TokenManager`.
+    :param instrumentation: Records timings, sizes, and retries of all API calls.
+    """
+
+    def __init__(self,
+                 client_id: str = None,
+                 client_secret: str = None,
+                 session: aiohttp.ClientSession = None,
+                 api_url: str = DEFAULT_API_URL,
+                 oauth2_url: str = DEFAULT_OAUTH2_URL,
+                 max_retries: int = DEFAULT_MAX_RETRIES,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 pool_size: int = DEFAULT_POOL_SIZE,
+                 keepalive_timeout: float = DEFAULT_KEEPALIVE_TIMEOUT,
+                 refresh_margin: float = DEFAULT_REFRESH_MARGIN,
+                 token_manager: TokenManager = None,
+                 token_cache_dir: Optional[str] = DEFAULT_TOKEN_CACHE_DIR,
+                 instrumentation: Instrumentation = None):
+        self.api_url = api_url
+        self.oauth2_url = oauth2_url
+        self.max_retries = max_retries
+        self.max_concurrency = max_concurrency
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self.instrumentation = instrumentation or Instrumentation()
+        self._owns_token_manager = token_manager is None
+        if token_manager is None:
+            token_manager = TokenManager(client_id or os.environ.get('SH_CLIENT_ID'),
+                                         client_secret or os.environ.get('SH_CLIENT_SECRET'),
+                                         token_url=oauth2_url + '/token',
+                                         cache_dir=token_cache_dir,
+                                         refresh_margin=refresh_margin)
+        self.token_manager = token_manager
+        self._session = session
+        self._owns_session = session is None
+        self._token: Optional[Token] = None
+        # Created lazily, so that they are bound to the running event loop
+        self._token_lock: Optional[asyncio.Lock] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def __aenter__(self) -> 'AsyncSentinelHub':
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        if self._owns_token_manager:
+            self.token_manager.close()
+        if self._session is not None and self._owns_session:
+            await self._session.close()
+            self._session = None
+
+    @property
+    def token(self) -> Optional[Token]:
+        return self._token
+
+    @property
+    def num_token_fetches(self) -> int:
+        """The number of tokens this client's token manager has fetched from the token endpoint."""
+        return self.token_manager.num_fetches
+
+    async def token_info(self) -> Dict[str, Any]:
+        return await self._get_json(self.oauth2_url + '/tokeninfo')
+
+    async def dataset_names(self) -> List[str]:
+        obj = await self._get_json(self.api_url + '/process/dataset')
+        return obj.get('data')
+
+    async def band_names(self, dataset_name: str) -> List[str]:
+        obj = await self._get_json(self.api_url + f'/process/dataset/{dataset_name}/bands')
+        return obj.get('data')
+
+    async def get_data(self, request: Union[Dict, bytes]) -> Tuple[str, bytes]:
+        """
+        Get the data for the given *request* as a TAR archive.
+
+        :param request: A request as returned by :meth:`SentinelHub.new_data_request`,
+            or its JSON encoding as returned by :meth:`RequestTemplate.new_request_json`.
+        :return: A pair (mime_type, content).
+        """
+        chunks = []
+        async for chunk in self.iter_data(request):
+            chunks.append(chunk)
+        return _TAR_MIME_TYPE, b''.join(chunks)
+
+    async def get_arrays(self, request: Union[Dict, bytes]) -> Dict[str, np.ndarray]:
+        """
+        Get the data for the given *request* as arrays.
+
+        The response is decoded in the event loop's default executor, so that
+        decoding does not block other requests.
+        """
+        _, data = await self.get_data(request)
+        return await asyncio.get_running_loop().run_in_executor(None, decode_tar, data)
+
+    async def iter_data(self,
+                        request: Union[Dict, bytes],
+                        chunk_size: int = DEFAULT_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        """
+        Get the data for the given *request* as a TAR archive that is streamed in chunks.
+
+        The response body is never held in memory as a whole, so it can be
+        forwarded, e.g. by a tile server, while it is being received.
+
+        :param request: A request as returned by :meth:`SentinelHub.new_data_request`,
+            or its JSON encoding as returned by :meth:`RequestTemplate.new_request_json`.
+        :param chunk_size: Maximum size of the chunks in bytes.
+        :return: An async iterator of chunks of the TAR archive.
+        """
+        self._init()
+        with self.instrumentation.recording('process') as record:
+            async with self._semaphore:
+                resp = await self._post_data(request, record)
+            try:
+                while True:
+                    # Measure receiving only, not the time the consumer spends on a chunk.
+                    # Slow consumers must not hold up other requests, so release the semaphore before yielding.
+                    async with self._semaphore:
+                        t0 = time.perf_counter()
+                        chunk = await resp.content.read(chunk_size)
+                        record.transfer_time += time.perf_counter() - t0
+                    if not chunk:
+                        break
+                    record.response_bytes += len(chunk)
+                    yield chunk
+            finally:
+                resp.release()
+
+    async def _post_data(self, request: Union[Dict, bytes], record: RequestRecord) -> aiohttp.ClientResponse:
+        headers = {
+            'Accept': _TAR_MIME_TYPE,
+            'cache-control': 'no-cache',
+            'Content-Type': 'application/json'
+        }
+        body = request if isinstance(request, bytes) else json.dumps(request).encode('utf-8')
+        record.request_bytes = len(body)
+        num_retries = 0
+        token_refreshed = False
+        while True:
+            token = await self._get_token(record)
+            headers['Authorization'] = f'Bearer {token["access_token"]}'
+            t0 = time.perf_counter()
+            resp = await self._session.post(self.api_url + '/process', data=body, headers=headers)
+            t1 = time.perf_counter()
+            record.ttfb = t1 - t0
+            if resp.status == 401 and not token_refreshed:
+                # The token has expired, retry once with a new one
+                resp.release()
+                await self._refresh_token(token, record)
+                token_refreshed = True
+                record.retries += 1
+                continue
+            if resp.status != 429 or num_retries >= self.max_retries:
+                break
+            resp.release()
+            retry_after = get_retry_after(resp)
+            await asyncio.sleep(retry_after if retry_after is not None
+                                else DEFAULT_BACKOFF_INTERVAL * 2 ** num_retries)
+            record.throttle_time += time.perf_counter() - t1
+            num_retries += 1
+            record.retries += 1
+
+        record.status_code = resp.status
+        record.processing_units = get_processing_units(resp)
+        if resp.status >= 400:
+            content = await resp.read()
+            resp.release()
+            raise SentinelHubError(resp.reason, status_code=resp.status, content=content)
+        return resp
+
+    async def _get_json(self, url: str) -> Any:
+        self._init()
+        with self.instrumentation.recording('get') as record:
+            token = await self._get_token(record)
+            t0 = time.perf_counter()
+            content, status, reason = await self._get(url, token)
+            if status == 401:
+                token = await self._refresh_token(token, record)
+                record.retries += 1
+                t0 = time.perf_counter()
+                content, status, reason = await self._get(url, token)
+            record.ttfb = time.perf_counter() - t0
+            record.status_code = status
+            record.response_bytes = len(content)
+            if status >= 400:
+                raise SentinelHubError(reason, status_code=status, content=content)
+        return json.loads(content)
+
+    async def _get(self, url: str, token: Token) -> Tuple[bytes, int, str]:
+        async with self._session.get(url, headers={'Authorization': f'Bearer {token["access_token"]}'}) as resp:
+            return await resp.read(), resp.status, resp.reason
+
+    def _init(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=self.keepalive_timeout)
+            self._session = aiohttp.ClientSession(connector=connector)
+            self._owns_session = True
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._token_lock = asyncio.Lock()
+
+    async def _get_token(self, record: RequestRecord) -> Token:
+        token = self.token_manager.valid_token
+        if token is None:
+            token = await self._call_token_manager(self.token_manager.get_token, record)
+        self._token = token
+        return token
+
+    async def _refresh_token(self, expired_token: Optional[Token], record: RequestRecord) -> Token:
+        # The token manager returns a token that has already replaced the expired one
+        return await self._call_token_manager(self.token_manager.refresh_token, record, expired_token)
+
+    async def _call_token_manager(self, func: Callable[..., Token], record: RequestRecord, *args) -> Token:
+        t0 = time.perf_counter()
+        async with self._token_lock:
+            # Token requests and token files must not block the event loop
+            token = await asyncio.get_running_loop().run_in_executor(None, func, *args)
+        record.token_time += time.perf_counter() - t0
+        self._token = token
+        return token
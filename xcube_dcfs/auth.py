@@ -0,0 +1,201 @@
+import hashlib
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import oauthlib.oauth2
+import requests_oauthlib
+
+from xcube_dcfs.filelock import FileLock, read_json, write_json_atomic
+
+DEFAULT_TOKEN_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'xcube-dcfs', 'tokens')
+DEFAULT_REFRESH_MARGIN = 120.0
+DEFAULT_REFRESH_RETRY_DELAY = 5.0
+DEFAULT_MAX_REFRESH_RETRY_DELAY = 300.0
+
+Token = Dict[str, Any]
+
+
+class TokenManager:
+    """
+    Provides OAuth2 client-credentials tokens that are shared between processes.
+
+    Tokens are stored in a file per client ID within *cache_dir*. Access to a
+    token file is serialized using a file lock, so that processes started at the
+    same time fetch only a single token and later processes reuse it until it is
+    about to expire. If *background_refresh* is set, a new token is obtained
+    *refresh_margin* seconds before the current one expires, so that requests
+    never have to wait for the token endpoint. A failed background refresh is
+    retried after *refresh_retry_delay* seconds, doubling the delay after every
+    further failure. Until then, :meth:`get_token` fetches a new token itself
+    once the current one is about to expire.
+
+    :param client_id: The OAuth2 client ID.
+    :param client_secret: The OAuth2 client secret.
+    :param token_url: URL of the OAuth2 token endpoint.
+    :param cache_dir: Directory for token files. If ``None``, tokens are not shared.
+    :param refresh_margin: Tokens are considered expired this number of seconds before their actual expiry.
+    :param background_refresh: Whether to refresh tokens in a background thread before they expire.
+    :param refresh_retry_delay: Seconds to wait before retrying a failed background refresh.
+    :param fetch_token: Optional function used to fetch a new token,
+        defaults to a client-credentials request to *token_url*.
+    """
+
+    def __init__(self,
+                 client_id: str,
+                 client_secret: str,
+                 token_url: str,
+                 cache_dir: Optional[str] = DEFAULT_TOKEN_CACHE_DIR,
+                 refresh_margin: float = DEFAULT_REFRESH_MARGIN,
+                 background_refresh: bool = True,
+                 refresh_retry_delay: float = DEFAULT_REFRESH_RETRY_DELAY,
+                 fetch_token: Callable[[], Token] = None):
+        self._client_id = client_id
+        self._client_secret = client_secret
+        self._token_url = token_url
+        self._cache_dir = cache_dir
+        self._refresh_margin = refresh_margin
+        self._background_refresh = background_refresh
+        self._refresh_retry_delay = refresh_retry_delay
+        self._fetch_token = fetch_token or self._fetch_token_from_server
+        self._token = None
+        self._listeners: List[Callable[[Token], None]] = []
+        self._timer = None
+        self._closed = False
+        self._lock = threading.RLock()
+        self._num_fetches = 0
+
+    @property
+    def client_id(self) -> str:
+        return self._client_id
+
+    @property
+    def num_fetches(self) -> int:
+        """The number of tokens this manager has fetched from the token endpoint."""
+        return self._num_fetches
+
+    @property
+    def valid_token(self) -> Optional[Token]:
+        """
+        The current token if it is still valid, else ``None``. Never fetches a token and
+        never waits for a refresh in progress, so it may be used in event loops.
+        """
+        token = self._token
+        return token if token is not None and self._is_valid(token) else None
+
+    def add_listener(self, listener: Callable[[Token], None]):
+        """Add a *listener* that is called with every new token."""
+        self._listeners.append(listener)
+
+    def get_token(self) -> Token:
+        """Get a valid token, fetching a new one only if no shared token is valid."""
+        with self._lock:
+            if self._token is not None and self._is_valid(self._token):
+                return self._token
+            return self._update_token(None)
+
+    def refresh_token(self, expired_token: Token = None) -> Token:
+        """
+        Get a new token, e.g. after a request has been rejected with HTTP 401.
+
+        :param expired_token: The rejected token. If given and another thread or
+            process has already replaced it with a valid token, that token is returned
+            instead of fetching another one.
+        :return: The new token.
+        """
+        with self._lock:
+            if expired_token is None and self._token is not None:
+                expired_token = self._token
+            if (expired_token is not None and self._token is not None
+                    and _access_token(self._token) != _access_token(expired_token)
+                    and self._is_valid(self._token)):
+                return self._token
+            return self._update_token(expired_token)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def _update_token(self, expired_token: Optional[Token]) -> Token:
+        if self._cache_dir is None:
+            token = self._fetch()
+        else:
+            os.makedirs(self._cache_dir, exist_ok=True)
+            path = self._cache_path()
+            with FileLock(path + '.lock'):
+                token = read_json(path)
+                if (token is None
+                        or not self._is_valid(token)
+                        or (expired_token is not None and _access_token(token) == _access_token(expired_token))):
+                    token = self._fetch()
+                    # Tokens are credentials, so restrict access to the current user
+                    write_json_atomic(path, token, mode=0o600)
+        self._token = token
+        self._schedule_refresh(token)
+        for listener in self._listeners:
+            listener(token)
+        return token
+
+    def _fetch(self) -> Token:
+        token = dict(self._fetch_token())
+        if 'expires_at' not in token and 'expires_in' in token:
+            token['expires_at'] = time.time() + float(token['expires_in'])
+        self._num_fetches += 1
+        return token
+
+    def _fetch_token_from_server(self) -> Token:
+        client = oauthlib.oauth2.BackendApplicationClient(client_id=self._client_id)
+        with requests_oauthlib.OAuth2Session(client=client) as session:
+            return session.fetch_token(token_url=self._token_url,
+                                       client_id=self._client_id,
+                                       client_secret=self._client_secret)
+
+    def _is_valid(self, token: Token) -> bool:
+        expires_at = token.get('expires_at')
+        return expires_at is None or float(expires_at) - self._get_refresh_margin(token) > time.time()
+
+    def _get_refresh_margin(self, token: Token) -> float:
+        # Never refresh short-lived tokens before half of their lifetime has passed
+        expires_in = token.get('expires_in')
+        if expires_in is None:
+            return self._refresh_margin
+        return min(self._refresh_margin, float(expires_in) / 2)
+
+    def _schedule_refresh(self, token: Token):
+        expires_at = token.get('expires_at')
+        delay = None
+        if expires_at is not None:
+            delay = max(0.0, float(expires_at) - self._get_refresh_margin(token) - time.time())
+        self._start_timer(delay, token, self._refresh_retry_delay)
+
+    def _start_timer(self, delay: Optional[float], token: Token, retry_delay: float):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._background_refresh or self._closed or delay is None:
+            return
+        self._timer = threading.Timer(delay, self._refresh_in_background, args=(token, retry_delay))
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _refresh_in_background(self, token: Token, retry_delay: float):
+        try:
+            self.refresh_token(token)
+        except Exception:
+            # Retry with backoff. Meanwhile, get_token() fetches a token itself once this one is about to expire.
+            with self._lock:
+                if self._token is token:
+                    self._start_timer(retry_delay, token, min(2 * retry_delay, DEFAULT_MAX_REFRESH_RETRY_DELAY))
+
+    def _cache_path(self) -> str:
+        key = hashlib.sha256(f'{self._token_url}|{self._client_id}'.encode('utf-8')).hexdigest()[:32]
+        return os.path.join(self._cache_dir, key + '.json')
+
+
+def _access_token(token: Token) -> Optional[str]:
+    return token.get('access_token')
+
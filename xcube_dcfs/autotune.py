@@ -0,0 +1,344 @@
+import concurrent.futures
+import os
+import time
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from xcube_dcfs.filelock import FileLock, read_json, write_json_atomic
+from xcube_dcfs.sentinelhub import SentinelHub
+from xcube_dcfs.template import RequestTemplate
+from xcube_dcfs.tiling import DEFAULT_CHUNK_SIZE, DEFAULT_MAX_TILE_SIZE, Tile, TileGrid
+
+DEFAULT_AUTOTUNE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'xcube-dcfs', 'autotune')
+DEFAULT_MIN_WORKERS = 1
+DEFAULT_MAX_WORKERS = 16
+DEFAULT_NUM_WORKERS = 4
+DEFAULT_MIN_ROUND_SIZE = 4
+# Minimum relative gain of throughput for a trial to be accepted
+DEFAULT_TOLERANCE = 0.05
+
+_SETTINGS_FILE_NAME = 'settings.json'
+
+# Trial moves from the best settings: the factor applied to the tile size or to the number of workers
+_MOVES = (('tile_size', 2.0), ('num_workers', 2.0), ('tile_size', 0.5), ('num_workers', 0.5))
+
+
+class TuningSettings(NamedTuple):
+    """The settings of a tiled fetch job: tile size (width, height) in pixels and number of concurrent requests."""
+    tile_size: Tuple[int, int]
+    num_workers: int
+
+
+class Autotuner:
+    """
+    Tunes the tile size and the number of concurrent requests of tiled fetch jobs, see :func:`fetch_tiles`.
+
+    Tiles consist of whole chunks of *chunk_size*, their widths and heights are
+    the chunk width and height times a power of two, so tiles of all sizes are
+    aligned to the chunk grid. Starting from the candidate *tile_size* and
+    *num_workers*, the effective throughput in MB/s and the 95th percentile of
+    the request latencies are measured in rounds of completed requests. After
+    each round, the tuner tries to double or halve either the tile size or the
+    number of workers, keeps the change if the throughput has improved by more
+    than *tolerance*, and otherwise returns to the best settings and tries the
+    next change. Settings whose latency exceeds *target_latency* are never kept.
+    Once no change improves the throughput, the tuner has converged.
+
+    Use :meth:`for_dataset` to start from the best settings of earlier runs,
+    which are recorded by :meth:`save`.
+
+    :param chunk_size: The chunk size (width, height) of the output in pixels.
+    :param tile_size: The candidate tile size, rounded down to a valid tile size. Defaults to *chunk_size*.
+    :param num_workers: The candidate number of concurrent requests.
+    :param min_tile_size: The minimum tile size, defaults to *chunk_size*.
+    :param max_tile_size: The maximum tile size.
+    :param min_workers: The minimum number of concurrent requests.
+    :param max_workers: The maximum number of concurrent requests.
+    :param target_latency: Optional maximum 95th percentile of the request latencies in seconds.
+    :param tolerance: Minimum relative gain of throughput for a change to be kept.
+    :param min_round_size: Minimum number of requests measured per round, rounds
+        consist of at least twice as many requests as there are workers.
+    :param dataset_name: The name of the dataset whose settings are recorded by :meth:`save`.
+    :param settings_dir: Directory for the file of recorded settings. If ``None``, settings are not recorded.
+    """
+
+    def __init__(self,
+                 chunk_size: Tuple[int, int] = DEFAULT_CHUNK_SIZE,
+                 tile_size: Tuple[int, int] = None,
+                 num_workers: int = DEFAULT_NUM_WORKERS,
+                 min_tile_size: Tuple[int, int] = None,
+                 max_tile_size: Tuple[int, int] = DEFAULT_MAX_TILE_SIZE,
+                 min_workers: int = DEFAULT_MIN_WORKERS,
+                 max_workers: int = DEFAULT_MAX_WORKERS,
+                 target_latency: float = None,
+                 tolerance: float = DEFAULT_TOLERANCE,
+                 min_round_size: int = DEFAULT_MIN_ROUND_SIZE,
+                 dataset_name: str = None,
+                 settings_dir: Optional[str] = None):
+        min_tile_size = min_tile_size or chunk_size
+        self._chunk_size = tuple(chunk_size)
+        self._scales = [scale for scale in (2 ** i for i in range(16))
+                        if all(min_length <= chunk_length * scale <= max_length
+                               for chunk_length, min_length, max_length in zip(chunk_size, min_tile_size,
+                                                                               max_tile_size))]
+        if not self._scales:
+            raise ValueError(f'no tile size between {tuple(min_tile_size)} and {tuple(max_tile_size)}'
+                             f' is a multiple of chunk size {tuple(chunk_size)} by a power of two')
+        if not 1 <= min_workers <= max_workers:
+            raise ValueError('min_workers and max_workers must be positive and in order')
+        self._min_workers = min_workers
+        self._max_workers = max_workers
+        self._target_latency = target_latency
+        self._tolerance = tolerance
+        self._min_round_size = min_round_size
+        self._dataset_name = dataset_name
+        self._settings_dir = settings_dir
+
+        self._scale = self._fit_scale(tile_size or chunk_size)
+        self._num_workers = min(max(num_workers, min_workers), max_workers)
+        self._samples: List[Tuple[float, float, int]] = []
+        # Best settings as (scale, num_workers, throughput)
+        self._best: Optional[Tuple[int, int, float]] = None
+        self._move_index = 0
+        self._failures = 0
+        self._converged = False
+        self._history: List[Dict[str, Any]] = []
+
+    @classmethod
+    def for_dataset(cls,
+                    dataset_name: str,
+                    chunk_size: Tuple[int, int] = DEFAULT_CHUNK_SIZE,
+                    settings_dir: str = DEFAULT_AUTOTUNE_DIR,
+                    **kwargs) -> 'Autotuner':
+        """
+        Create an autotuner that starts from the best settings recorded for *dataset_name*, if any.
+
+        Further keyword arguments are passed to :class:`Autotuner`.
+        """
+        settings = load_settings(dataset_name, settings_dir=settings_dir)
+        if settings is not None:
+            kwargs.update(tile_size=settings.tile_size, num_workers=settings.num_workers)
+        return cls(chunk_size, dataset_name=dataset_name, settings_dir=settings_dir, **kwargs)
+
+    @property
+    def chunk_size(self) -> Tuple[int, int]:
+        return self._chunk_size
+
+    @property
+    def max_workers(self) -> int:
+        return self._max_workers
+
+    @property
+    def settings(self) -> TuningSettings:
+        """The settings to be used for the next requests."""
+        return TuningSettings(self._tile_size(self._scale), self._num_workers)
+
+    @property
+    def best(self) -> Optional[TuningSettings]:
+        """The settings with the highest throughput measured so far, if any."""
+        if self._best is None:
+            return None
+        scale, num_workers, _ = self._best
+        return TuningSettings(self._tile_size(scale), num_workers)
+
+    @property
+    def converged(self) -> bool:
+        return self._converged
+
+    @property
+    def history(self) -> List[Dict[str, Any]]:
+        """The measurements of all rounds: settings, throughput in MB/s, 95th percentile latency, and the decision."""
+        return [dict(record) for record in self._history]
+
+    def observe(self, settings: TuningSettings, start_time: float, end_time: float, num_bytes: int):
+        """
+        Record a completed request.
+
+        :param settings: The settings the request has been made with. Requests made
+            with other than the current settings are ignored.
+        :param start_time: The time the request has been sent, e.g. from ``time.perf_counter()``.
+        :param end_time: The time the response has been received.
+        :param num_bytes: The number of bytes received.
+        """
+        if self._converged or settings != self.settings:
+            return
+        self._samples.append((start_time, end_time, num_bytes))
+        if len(self._samples) >= max(self._min_round_size, 2 * self._num_workers):
+            self._end_round()
+
+    def save(self):
+        """Record the best settings for the dataset, if a dataset name and settings directory are given."""
+        if self._best is None or self._dataset_name is None or self._settings_dir is None:
+            return
+        save_settings(self._dataset_name, self.best, throughput=self._best[2], settings_dir=self._settings_dir)
+
+    def _end_round(self):
+        samples, self._samples = self._samples, []
+        duration = max(end for _, end, _ in samples) - min(start for start, _, _ in samples)
+        throughput = sum(num_bytes for _, _, num_bytes in samples) / 2 ** 20 / max(duration, 1e-9)
+        latency = float(np.percentile([end - start for start, end, _ in samples], 95))
+        within_target = self._target_latency is None or latency <= self._target_latency
+        record = dict(tile_size=self._tile_size(self._scale), num_workers=self._num_workers,
+                      mb_per_sec=throughput, p95_latency=latency)
+
+        if self._best is None:
+            if not within_target and self._shrink():
+                record.update(decision='latency')
+            else:
+                self._best = self._scale, self._num_workers, throughput
+                record.update(decision='start')
+                self._next_trial()
+        elif within_target and throughput > self._best[2] * (1 + self._tolerance):
+            self._best = self._scale, self._num_workers, throughput
+            self._failures = 0
+            record.update(decision='kept')
+            self._next_trial()
+        else:
+            self._failures += 1
+            self._move_index = (self._move_index + 1) % len(_MOVES)
+            record.update(decision='latency' if not within_target else 'rejected')
+            self._next_trial()
+        self._history.append(record)
+
+    def _next_trial(self):
+        best_scale, best_num_workers, _ = self._best
+        while self._failures < len(_MOVES):
+            name, factor = _MOVES[self._move_index]
+            if name == 'tile_size':
+                scale = int(best_scale * factor)
+                if scale in self._scales:
+                    self._scale, self._num_workers = scale, best_num_workers
+                    return
+            else:
+                num_workers = min(max(int(best_num_workers * factor), self._min_workers), self._max_workers)
+                if num_workers != best_num_workers:
+                    self._scale, self._num_workers = best_scale, num_workers
+                    return
+            # Not possible within the bounds
+            self._failures += 1
+            self._move_index = (self._move_index + 1) % len(_MOVES)
+        self._scale, self._num_workers = best_scale, best_num_workers
+        self._converged = True
+
+    def _shrink(self) -> bool:
+        # Smaller tiles first, then fewer workers
+        index = self._scales.index(self._scale)
+        if index > 0:
+            self._scale = self._scales[index - 1]
+            return True
+        if self._num_workers > self._min_workers:
+            self._num_workers = max(self._num_workers // 2, self._min_workers)
+            return True
+        return False
+
+    def _fit_scale(self, tile_size: Tuple[int, int]) -> int:
+        fitting_scales = [scale for scale in self._scales
+                          if all(chunk_length * scale <= length for chunk_length, length in zip(self._chunk_size,
+                                                                                                 tile_size))]
+        return fitting_scales[-1] if fitting_scales else self._scales[0]
+
+    def _tile_size(self, scale: int) -> Tuple[int, int]:
+        return self._chunk_size[0] * scale, self._chunk_size[1] * scale
+
+
+def load_settings(dataset_name: str, settings_dir: str = DEFAULT_AUTOTUNE_DIR) -> Optional[TuningSettings]:
+    """Get the settings recorded for *dataset_name*, or ``None``."""
+    path = os.path.join(settings_dir, _SETTINGS_FILE_NAME)
+    if not os.path.exists(path):
+        return None
+    with FileLock(path + '.lock'):
+        entry = (read_json(path) or {}).get(dataset_name)
+    if entry is None:
+        return None
+    return TuningSettings(tuple(entry['tile_size']), int(entry['num_workers']))
+
+
+def save_settings(dataset_name: str,
+                  settings: TuningSettings,
+                  throughput: float = None,
+                  settings_dir: str = DEFAULT_AUTOTUNE_DIR):
+    """Record the *settings* for *dataset_name*, replacing earlier ones."""
+    os.makedirs(settings_dir, exist_ok=True)
+    path = os.path.join(settings_dir, _SETTINGS_FILE_NAME)
+    with FileLock(path + '.lock'):
+        entries = read_json(path) or {}
+        entries[dataset_name] = dict(tile_size=list(settings.tile_size),
+                                     num_workers=settings.num_workers,
+                                     mb_per_sec=throughput,
+                                     updated_at=time.time())
+        write_json_atomic(path, entries)
+
+
+def fetch_tiles(sentinel_hub: SentinelHub,
+                template: RequestTemplate,
+                bbox: Tuple[float, float, float, float],
+                spatial_res: float,
+                time_range: Tuple[str, str] = None,
+                autotuner: Autotuner = None) -> Iterator[Tuple[Tile, Dict[str, np.ndarray]]]:
+    """
+    Fetch the image of *bbox* tile by tile, with tile sizes and concurrency chosen by *autotuner*.
+
+    The image is covered by chunks of the autotuner's chunk size. Every tile
+    consists of a square block of chunks whose number of rows and columns is
+    the tile's scale, a power of two, and starts at a chunk index that is a
+    multiple of its scale, so tiles of different sizes never overlap.
+    Tiles are yielded as they complete, and the best settings are recorded
+    once all tiles have been fetched.
+
+    :param sentinel_hub: The SentinelHub client.
+    :param template: The request template, e.g. for the bands to be fetched.
+    :param bbox: Bounding box (x1, y1, x2, y2) in CRS84 coordinates.
+    :param spatial_res: Spatial resolution in degrees.
+    :param time_range: Time range (start, end).
+    :param autotuner: The autotuner, defaults to a new one.
+    :return: An iterator of pairs of a :class:`Tile`, whose *tile_x* and *tile_y* are
+        the indices of its upper left chunk, and a mapping from band names to arrays.
+    """
+    autotuner = autotuner or Autotuner()
+    chunk_grid = TileGrid(bbox, spatial_res, autotuner.chunk_size)
+    num_chunks_x, num_chunks_y = chunk_grid.num_tiles
+    pending = np.ones((num_chunks_y, num_chunks_x), dtype=bool)
+
+    def next_tile(settings: TuningSettings) -> Tile:
+        # The first pending chunk, row by row, and the largest aligned block of pending chunks starting there
+        chunk_y, chunk_x = np.unravel_index(np.argmax(pending), pending.shape)
+        scale = settings.tile_size[0] // autotuner.chunk_size[0]
+        while scale > 1 and not (chunk_x % scale == 0 and chunk_y % scale == 0
+                                 and pending[chunk_y: chunk_y + scale, chunk_x: chunk_x + scale].all()):
+            scale //= 2
+        pending[chunk_y: chunk_y + scale, chunk_x: chunk_x + scale] = False
+        tile_size = autotuner.chunk_size[0] * scale, autotuner.chunk_size[1] * scale
+        tile = TileGrid(bbox, spatial_res, tile_size).tile(chunk_x // scale, chunk_y // scale)
+        return tile._replace(tile_x=int(chunk_x), tile_y=int(chunk_y))
+
+    def fetch(request: Dict) -> Tuple[float, float, Dict[str, np.ndarray]]:
+        start_time = time.perf_counter()
+        arrays = sentinel_hub.get_arrays(request)
+        return start_time, time.perf_counter(), arrays
+
+    error = None
+    with concurrent.futures.ThreadPoolExecutor(max_workers=autotuner.max_workers) as executor:
+        futures = {}
+        while True:
+            # Keep as many requests in flight as the current settings allow
+            while error is None and len(futures) < autotuner.settings.num_workers and pending.any():
+                settings = autotuner.settings
+                tile = next_tile(settings)
+                request = template.new_request((tile.width, tile.height), time_range=time_range, bbox=tile.bbox)
+                futures[executor.submit(fetch, request)] = tile, settings
+            if not futures:
+                break
+            completed, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in completed:
+                tile, settings = futures.pop(future)
+                try:
+                    start_time, end_time, arrays = future.result()
+                except Exception as e:
+                    error = error or e
+                    continue
+                autotuner.observe(settings, start_time, end_time, sum(array.nbytes for array in arrays.values()))
+                yield tile, template.split_bands(arrays)
+    if error is not None:
+        raise error
+    autotuner.save()
@@ -0,0 +1,213 @@
+"""
+Throughput and latency benchmarks for the SentinelHub client, run against a
+local :class:`SentinelHubStandIn` server, so no credentials are required.
+
+Usage::
+
+    python -m xcube_dcfs.benchmark --size 1000 --bands 4 --num-requests 20 --latency 0.05
+"""
+
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Any, Sequence
+
+import numpy as np
+import xarray as xr
+
+from xcube_dcfs.sentinelhub import SentinelHub
+from xcube_dcfs.standin import SentinelHubStandIn
+from xcube_dcfs.store import SentinelHubStore
+from xcube_dcfs.template import RequestTemplate
+
+DATASET_NAME = 'S2L1C'
+BAND_NAMES = ['B01', 'B02', 'B03', 'B04', 'B05', 'B06', 'B07', 'B08', 'B8A', 'B09', 'B10', 'B11', 'B12']
+BBOX = (10.0, 50.0, 11.0, 51.0)
+
+
+class BenchmarkResult:
+    """
+    Measurements of a single benchmark.
+
+    :param name: Benchmark name.
+    :param latencies: Duration of each operation in seconds.
+    :param total_time: Wall-clock time of the whole benchmark in seconds.
+    :param num_bytes: Number of payload bytes processed.
+    :param peak_alloc: Peak size of memory allocations traced during the benchmark in bytes.
+    """
+
+    def __init__(self, name: str, latencies: Sequence[float], total_time: float, num_bytes: int, peak_alloc: int):
+        self.name = name
+        self.latencies = list(latencies)
+        self.total_time = total_time
+        self.num_bytes = num_bytes
+        self.peak_alloc = peak_alloc
+        self.peak_rss = _get_peak_rss()
+
+    @property
+    def ops_per_sec(self) -> float:
+        return len(self.latencies) / self.total_time if self.total_time > 0 else float('inf')
+
+    @property
+    def mb_per_sec(self) -> float:
+        return self.num_bytes / 1e6 / self.total_time if self.total_time > 0 else float('inf')
+
+    def percentile(self, q: float) -> float:
+        return float(np.percentile(self.latencies, q)) if self.latencies else float('nan')
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(name=self.name,
+                    count=len(self.latencies),
+                    ops_per_sec=self.ops_per_sec,
+                    mb_per_sec=self.mb_per_sec,
+                    p50_ms=1000 * self.percentile(50),
+                    p99_ms=1000 * self.percentile(99),
+                    peak_alloc_mb=self.peak_alloc / 1e6,
+                    peak_rss_mb=self.peak_rss / 1e6)
+
+
+def measure(name: str, operations: Sequence[Callable[[], Any]], trace_alloc: bool = False) -> BenchmarkResult:
+    """
+    Run *operations* sequentially and measure them.
+
+    :param name: Benchmark name.
+    :param operations: Functions that may return the number of payload bytes they processed as int.
+    :param trace_alloc: Whether to trace the peak size of memory allocations.
+        This slows down Python code considerably.
+    """
+    latencies = []
+    num_bytes = 0
+    if trace_alloc:
+        tracemalloc.start()
+    start_time = time.perf_counter()
+    for operation in operations:
+        t0 = time.perf_counter()
+        result = operation()
+        if isinstance(result, int):
+            num_bytes += result
+        latencies.append(time.perf_counter() - t0)
+    total_time = time.perf_counter() - start_time
+    peak_alloc = 0
+    if trace_alloc:
+        _, peak_alloc = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return BenchmarkResult(name, latencies, total_time, num_bytes, peak_alloc)
+
+
+def run_benchmarks(size: int = 512,
+                   num_bands: int = 4,
+                   num_requests: int = 10,
+                   max_workers: int = 8,
+                   latency: float = 0.0,
+                   bandwidth: float = None,
+                   throttle_every: int = None,
+                   trace_alloc: bool = False) -> List[BenchmarkResult]:
+    """Run all benchmarks against a new stand-in server and return their results."""
+    os.environ.setdefault('OAUTHLIB_INSECURE_TRANSPORT', '1')
+    band_names = BAND_NAMES[:num_bands]
+    results = []
+
+    template = RequestTemplate(DATASET_NAME, band_names)
+    bboxes = [(BBOX[0] + 0.001 * i, BBOX[1], BBOX[2], BBOX[3]) for i in range(1000)]
+    results.append(measure('new_data_request',
+                           [lambda b=b: SentinelHub.new_data_request(DATASET_NAME, band_names, (size, size), bbox=b)
+                            for b in bboxes]))
+    results.append(measure('template.new_request',
+                           [lambda b=b: template.new_request((size, size), bbox=b) for b in bboxes]))
+    results.append(measure('template.new_request_json',
+                           [lambda b=b: template.new_request_json((size, size), bbox=b) for b in bboxes]))
+
+    with SentinelHubStandIn(latency=latency, bandwidth=bandwidth, throttle_every=throttle_every) as stand_in:
+        sentinel_hub = SentinelHub('benchmark', 'benchmark',
+                                   api_url=stand_in.api_url,
+                                   oauth2_url=stand_in.oauth2_url,
+                                   token_cache_dir=None)
+        try:
+            # Distinct bboxes, so that requests are not coalesced
+            requests = [template.new_request((size, size), bbox=bboxes[i]) for i in range(num_requests)]
+
+            def get_data(request):
+                return len(sentinel_hub.get_data(request)[1])
+
+            def get_arrays(request):
+                return sum(array.nbytes for array in sentinel_hub.get_arrays(request).values())
+
+            results.append(measure('get_data', [lambda r=r: get_data(r) for r in requests], trace_alloc))
+            results.append(measure('get_arrays', [lambda r=r: get_arrays(r) for r in requests], trace_alloc))
+
+            def get_data_many():
+                return sum(len(result[1]) for _, result in sentinel_hub.get_data_many(requests,
+                                                                                     max_workers=max_workers))
+
+            result = measure(f'get_data_many[{max_workers}]', [get_data_many], trace_alloc)
+            result.latencies = [result.total_time / num_requests] * num_requests
+            results.append(result)
+
+            num_tiles = max(1, int(np.ceil(np.sqrt(num_requests))))
+            store = SentinelHubStore(sentinel_hub, DATASET_NAME, band_names,
+                                     bbox=(0.0, 0.0, num_tiles * size * 0.001, num_tiles * size * 0.001),
+                                     spatial_res=0.001,
+                                     time_range=('2019-01-01', '2019-01-02'),
+                                     tile_size=(size, size))
+            # Warm up, the first call imports modules
+            dataset = xr.open_zarr(store, consolidated=False)
+            results.append(measure('xr.open_zarr', [lambda: xr.open_zarr(store, consolidated=False)] * 10))
+            results.append(measure('xr.open_zarr[consolidated]',
+                                   [lambda: xr.open_zarr(store, consolidated=True)] * 10))
+            results.append(measure('xr.open_zarr.compute',
+                                   [lambda: int(sum(var.nbytes for var in dataset.compute().data_vars.values()))],
+                                   trace_alloc))
+        finally:
+            sentinel_hub.close()
+
+    return results
+
+
+def format_results(results: Sequence[BenchmarkResult]) -> str:
+    lines = [f'{"benchmark":<28} {"count":>6} {"ops/s":>10} {"MB/s":>9} {"p50 ms":>9} {"p99 ms":>9}'
+             f' {"alloc MB":>9} {"RSS MB":>8}']
+    for result in results:
+        d = result.to_dict()
+        lines.append(f'{d["name"]:<28} {d["count"]:>6} {d["ops_per_sec"]:>10.1f} {d["mb_per_sec"]:>9.1f}'
+                     f' {d["p50_ms"]:>9.2f} {d["p99_ms"]:>9.2f} {d["peak_alloc_mb"]:>9.1f} {d["peak_rss_mb"]:>8.1f}')
+    return '\n'.join(lines)
+
+
+def _get_peak_rss() -> int:
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak_rss if sys.platform == 'darwin' else 1024 * peak_rss
+
+
+def main(args: Sequence[str] = None):
+    parser = argparse.ArgumentParser(description='Benchmark the SentinelHub client against a local stand-in server.')
+    parser.add_argument('--size', type=int, default=512, help='Width and height of requested images in pixels')
+    parser.add_argument('--bands', type=int, default=4, help='Number of requested bands')
+    parser.add_argument('--num-requests', type=int, default=10, help='Number of data requests per benchmark')
+    parser.add_argument('--workers', type=int, default=8, help='Maximum number of concurrent requests')
+    parser.add_argument('--latency', type=float, default=0.0, help='Simulated server latency in seconds')
+    parser.add_argument('--bandwidth', type=float, default=None, help='Simulated bandwidth in bytes per second')
+    parser.add_argument('--throttle-every', type=int, default=None, help='Reject every n-th request with HTTP 429')
+    parser.add_argument('--trace-alloc', action='store_true', help='Trace peak memory allocations (slow)')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    options = parser.parse_args(args)
+    results = run_benchmarks(size=options.size,
+                             num_bands=options.bands,
+                             num_requests=options.num_requests,
+                             max_workers=options.workers,
+                             latency=options.latency,
+                             bandwidth=options.bandwidth,
+                             throttle_every=options.throttle_every,
+                             trace_alloc=options.trace_alloc)
+    if options.json:
+        print(json.dumps([result.to_dict() for result in results], indent=2))
+    else:
+        print(format_results(results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Dict, Optional
+
+from xcube_dcfs.filelock import FileLock, write_atomic
+
+DEFAULT_MAX_CACHE_SIZE = 2 ** 30
+
+_FLOAT_DIGITS = 12
+_ENTRY_EXT = '.bin'
+_LOCK_FILE_NAME = '.lock'
+
+
+def canonicalize_request(request: Any) -> bytes:
+    """
+    Get a canonical byte representation of a request as returned by
+    :meth:`SentinelHub.new_data_request`.
+
+    Object keys are sorted, insignificant whitespace is removed, tuples are
+    treated as lists, and floats are normalized to a fixed number of
+    significant digits, so that e.g. bounding boxes computed in different ways
+    yield the same representation.
+
+    :param request: The request, a JSON-serializable object.
+    :return: The canonical JSON representation encoded as UTF-8.
+    """
+    return json.dumps(_normalize(request), sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def request_hash(request: Any, api_url: str = None) -> str:
+    """
+    Get a hexadecimal SHA-256 hash of the canonical representation of a *request*.
+
+    :param request: The request, a JSON-serializable object.
+    :param api_url: If given, the URL of the API the request is sent to, which is
+        then part of the hash, so that equal requests to different services differ.
+    :return: The hash.
+    """
+    hash_ = hashlib.sha256()
+    if api_url is not None:
+        hash_.update(api_url.rstrip('/').encode('utf-8') + b'\n')
+    hash_.update(canonicalize_request(request))
+    return hash_.hexdigest()
+
+
+def _normalize(obj: Any) -> Any:
+    if isinstance(obj, dict):
+        return {str(k): _normalize(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_normalize(v) for v in obj]
+    if isinstance(obj, float):
+        value = float(f'{obj:.{_FLOAT_DIGITS}g}')
+        return int(value) if value.is_integer() else value
+    if hasattr(obj, 'item') and callable(obj.item):
+        # numpy scalars
+        return _normalize(obj.item())
+    return obj
+
+
+class ResponseCache:
+    """
+    A persistent, size-capped cache for response contents in a local directory.
+
+    Entries are files named by their key. Every entry is written to a temporary
+    file first and then atomically renamed, so concurrent readers in other
+    processes never see partial entries. A cache hit updates the entry's
+    modification time, which serves as its last access time. Once the total
+    size exceeds *max_size*, the least recently used entries are removed.
+    Eviction is serialized across processes using a lock file where supported.
+
+    :param directory: The cache directory, created if it does not exist.
+    :param max_size: Maximum total size of all entries in bytes.
+    """
+
+    def __init__(self, directory: str, max_size: int = DEFAULT_MAX_CACHE_SIZE):
+        self._directory = directory
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._puts = 0
+        self._evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(size for _, _, size in self._scan())
+
+    @property
+    def directory(self) -> str:
+        return self._directory
+
+    @property
+    def max_size(self) -> int:
+        return self._max_size
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Hit and miss statistics of this cache instance."""
+        with self._lock:
+            return dict(hits=self._hits,
+                        misses=self._misses,
+                        puts=self._puts,
+                        evictions=self._evictions,
+                        size=self._size)
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Get the content stored for *key*.
+
+        :return: The content or ``None`` if there is no entry for *key*.
+        """
+        path = self._entry_path(key)
+        try:
+            with open(path, 'rb') as fp:
+                data = fp.read()
+        except FileNotFoundError:
+            with self._lock:
+                self._misses += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            # Evicted meanwhile or read-only, the content is valid nevertheless
+            pass
+        with self._lock:
+            self._hits += 1
+        return data
+
+    def put(self, key: str, data: bytes):
+        """Store *data* for *key*, evicting least recently used entries if required."""
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            # An existing entry is replaced
+            replaced_size = os.path.getsize(path)
+        except OSError:
+            replaced_size = 0
+        write_atomic(path, data)
+        with self._lock:
+            self._puts += 1
+            self._size += len(data) - replaced_size
+            must_evict = self._size > self._max_size
+        if must_evict:
+            self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the total size fits into *max_size*."""
+        with self._lock, FileLock(os.path.join(self._directory, _LOCK_FILE_NAME)):
+            # Entries may have been added by other processes, so always rescan
+            entries = sorted(self._scan())
+            size = sum(entry_size for _, _, entry_size in entries)
+            for _, path, entry_size in entries:
+                if size <= self._max_size:
+                    break
+                try:
+                    os.remove(path)
+                    self._evictions += 1
+                except FileNotFoundError:
+                    pass
+                size -= entry_size
+            self._size = size
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock:
+            for _, path, _ in self._scan():
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            self._size = 0
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self._directory, key[:2], key + _ENTRY_EXT)
+
+    def _scan(self):
+        for dir_path, _, file_names in os.walk(self._directory):
+            for file_name in file_names:
+                if file_name.endswith(_ENTRY_EXT):
+                    path = os.path.join(dir_path, file_name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    yield stat.st_mtime, path, stat.st_size
+
@@ -0,0 +1,171 @@
+import concurrent.futures
+import hashlib
+import math
+import os
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Union
+
+import numpy as np
+
+from xcube_dcfs.encoding import ANGLE_BANDS, MASK_BANDS
+from xcube_dcfs.filelock import FileLock, read_json, write_json_atomic
+from xcube_dcfs.sentinelhub import DEFAULT_MAX_WORKERS, SAMPLE_TYPE_TO_DTYPE, SentinelHub
+
+DEFAULT_CATALOG_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'xcube-dcfs', 'catalog')
+DEFAULT_CATALOG_TTL = 24 * 3600.0
+
+# Sample types and units of bands that are not floating point reflectances
+_BAND_DEFAULTS = {
+    **{band_name: ('UINT8', 'DN') for band_name in MASK_BANDS},
+    **{band_name: ('FLOAT32', 'degrees') for band_name in ANGLE_BANDS},
+    'DEM': ('FLOAT32', 'meters'),
+    'VV': ('FLOAT32', 'linear'),
+    'VH': ('FLOAT32', 'linear'),
+    'HH': ('FLOAT32', 'linear'),
+    'HV': ('FLOAT32', 'linear'),
+}
+_DEFAULT_SAMPLE_TYPE = 'FLOAT32'
+_DEFAULT_UNITS = 'reflectance'
+
+
+class BandDescriptor(NamedTuple):
+    """The properties of a band needed to describe it as variable of a data cube."""
+    name: str
+    sample_type: str
+    units: str
+    fill_value: Union[float, int]
+
+    @property
+    def dtype(self) -> np.dtype:
+        return np.dtype(SAMPLE_TYPE_TO_DTYPE[self.sample_type])
+
+    @classmethod
+    def from_band_name(cls, band_name: str) -> 'BandDescriptor':
+        sample_type, units = _BAND_DEFAULTS.get(band_name, (_DEFAULT_SAMPLE_TYPE, _DEFAULT_UNITS))
+        fill_value = math.nan if np.dtype(SAMPLE_TYPE_TO_DTYPE[sample_type]).kind == 'f' else 0
+        return cls(band_name, sample_type, units, fill_value)
+
+
+class MetadataCatalog:
+    """
+    A catalog of the datasets of a SentinelHub service and their bands.
+
+    On first use, the names of all datasets and then the band names of all
+    datasets are fetched concurrently in a single pass. They are then served
+    from memory until *ttl* seconds have passed. The catalog is persisted in
+    a file per API URL within *cache_dir*, so that other processes, and later
+    runs, start without any metadata request. Access to the file is serialized
+    using a file lock, so that processes started at the same time fetch the
+    metadata only once.
+
+    The service only provides band names. Band descriptors with sample type,
+    units, and fill value are derived from them, so that cube metadata can be
+    created without requests.
+
+    :param sentinel_hub: The SentinelHub client.
+    :param ttl: Time in seconds after which the metadata is fetched again.
+    :param cache_dir: Directory for catalog files. If ``None``, the catalog is not persisted.
+    :param max_workers: Maximum number of concurrent requests.
+    """
+
+    def __init__(self,
+                 sentinel_hub: SentinelHub,
+                 ttl: float = DEFAULT_CATALOG_TTL,
+                 cache_dir: Optional[str] = DEFAULT_CATALOG_DIR,
+                 max_workers: int = DEFAULT_MAX_WORKERS):
+        self._sentinel_hub = sentinel_hub
+        self._ttl = ttl
+        self._cache_dir = cache_dir
+        self._max_workers = max_workers
+        self._lock = threading.RLock()
+        self._catalog: Optional[Dict[str, Any]] = None
+        self._num_fetches = 0
+
+    @property
+    def num_fetches(self) -> int:
+        """The number of times this catalog has fetched the metadata from the service."""
+        return self._num_fetches
+
+    @property
+    def dataset_names(self) -> List[str]:
+        return list(self._get_catalog()['datasets'].keys())
+
+    def band_names(self, dataset_name: str) -> List[str]:
+        """
+        Get the band names of the dataset *dataset_name*.
+
+        :raise ValueError: If there is no such dataset.
+        """
+        datasets = self._get_catalog()['datasets']
+        if dataset_name not in datasets:
+            raise ValueError(f'unknown dataset {dataset_name!r}')
+        return list(datasets[dataset_name])
+
+    def band_descriptors(self, dataset_name: str, band_names: Sequence[str] = None) -> Dict[str, BandDescriptor]:
+        """
+        Get descriptors of the bands of *dataset_name*.
+
+        :param dataset_name: The dataset name.
+        :param band_names: Names of the bands to be described, defaults to all bands of the dataset.
+        :return: A mapping from band names to band descriptors.
+        :raise ValueError: If there is no such dataset or band.
+        """
+        available_band_names = self.band_names(dataset_name)
+        if band_names is None:
+            band_names = available_band_names
+        unknown_band_names = [band_name for band_name in band_names if band_name not in available_band_names]
+        if unknown_band_names:
+            raise ValueError(f'unknown bands {unknown_band_names!r} of dataset {dataset_name!r}')
+        return {band_name: BandDescriptor.from_band_name(band_name) for band_name in band_names}
+
+    def prefetch(self):
+        """Make the catalog available, fetching it only if neither memory nor file provide a valid one."""
+        self._get_catalog()
+
+    def refresh(self):
+        """Fetch the catalog from the service, regardless of its age."""
+        with self._lock:
+            self._catalog = self._load(force=True)
+
+    def clear(self):
+        """Drop the catalog held in memory."""
+        with self._lock:
+            self._catalog = None
+
+    def _get_catalog(self) -> Dict[str, Any]:
+        with self._lock:
+            if self._catalog is None or not self._is_valid(self._catalog):
+                self._catalog = self._load(force=False)
+            return self._catalog
+
+    def _load(self, force: bool) -> Dict[str, Any]:
+        if self._cache_dir is None:
+            return self._fetch()
+        os.makedirs(self._cache_dir, exist_ok=True)
+        path = self._cache_path()
+        with FileLock(path + '.lock'):
+            catalog = None if force else read_json(path)
+            if catalog is None or not self._is_valid(catalog):
+                catalog = self._fetch()
+                write_json_atomic(path, catalog)
+        return catalog
+
+    def _fetch(self) -> Dict[str, Any]:
+        fetched_at = time.time()
+        dataset_names = self._sentinel_hub.dataset_names
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            band_names = list(executor.map(self._sentinel_hub.band_names, dataset_names))
+        self._num_fetches += 1
+        return dict(api_url=self._sentinel_hub.api_url,
+                    fetched_at=fetched_at,
+                    datasets=dict(zip(dataset_names, band_names)))
+
+    def _is_valid(self, catalog: Dict[str, Any]) -> bool:
+        return (catalog.get('api_url') == self._sentinel_hub.api_url
+                and float(catalog.get('fetched_at', 0)) + self._ttl > time.time())
+
+    def _cache_path(self) -> str:
+        key = hashlib.sha256(self._sentinel_hub.api_url.encode('utf-8')).hexdigest()[:32]
+        return os.path.join(self._cache_dir, key + '.json')
+
@@ -0,0 +1,142 @@
+from typing import Dict, Sequence, Tuple, Union
+
+import dask.array as da
+import numpy as np
+import pandas as pd
+import xarray as xr
+from dask.base import tokenize
+
+from xcube_dcfs.catalog import MetadataCatalog
+from xcube_dcfs.encoding import BandEncoding
+from xcube_dcfs.sentinelhub import SentinelHub, SAMPLE_TYPE_TO_DTYPE
+from xcube_dcfs.store import format_time, split_time_range
+from xcube_dcfs.template import RequestTemplate
+from xcube_dcfs.tiling import DEFAULT_CHUNK_SIZE, TileGrid, new_dataset
+
+
+def open_cube(dataset_name: str,
+              band_names: Sequence[str],
+              bbox: Tuple[float, float, float, float],
+              resolution: float,
+              time_range: Tuple[str, str],
+              time_period: str = '1D',
+              chunks: Tuple[int, int] = DEFAULT_CHUNK_SIZE,
+              band_units: Union[str, Sequence[str]] = None,
+              sample_types: Union[str, Sequence[str]] = None,
+              sentinel_hub: SentinelHub = None,
+              catalog: MetadataCatalog = None,
+              encodings: Dict[str, BandEncoding] = None) -> xr.Dataset:
+    """
+    Open a SentinelHub dataset as a data cube whose variables are dask arrays.
+
+    No request is sent until the cube is computed. Every chunk, i.e. every
+    spatial tile of every time step, is fetched by a single task that requests
+    all bands at once; each band's chunk is then selected from that task's result.
+    Chunks at the right and bottom edges may be smaller than *chunks*.
+
+    The client is part of the task graph. When computed by ``dask.distributed``
+    or other multi-process schedulers, it is pickled as its configuration and
+    every worker process creates its own session and token on first use.
+
+    :param dataset_name: Dataset name, e.g. "S2L1C".
+    :param band_names: Names of the bands to be provided as variables.
+    :param bbox: Bounding box (x1, y1, x2, y2) in CRS84 coordinates.
+    :param resolution: Spatial resolution in degrees.
+    :param time_range: Time range (start, end) of the cube.
+    :param time_period: Duration of each time step, a pandas frequency string.
+    :param chunks: Spatial chunk size (width, height) in pixels.
+    :param band_units: Band units, either one for all bands or one per band.
+        Defaults to the units given by *catalog*, or "reflectance".
+    :param sample_types: Sample types, either one for all bands or one per band.
+        Defaults to the sample types given by *catalog*, or "FLOAT32".
+    :param sentinel_hub: The SentinelHub client, defaults to a new client using
+        the credentials given by the environment variables "SH_CLIENT_ID" and "SH_CLIENT_SECRET".
+    :param catalog: Optional metadata catalog used to validate the band names
+        and to provide units, sample types, and fill values of the bands.
+    :param encodings: Optional mapping from band names to encodings, see :func:`plan_encodings`.
+        Such bands are transferred and held as compact samples, which are decoded lazily.
+    :return: A dataset with a variable of dimensions ("time", "lat", "lon") for each band.
+    """
+    if sentinel_hub is None:
+        sentinel_hub = SentinelHub()
+    if catalog is not None:
+        descriptors = catalog.band_descriptors(dataset_name, band_names)
+        if band_units is None:
+            band_units = [descriptors[band_name].units for band_name in band_names]
+        if sample_types is None:
+            sample_types = [descriptors[band_name].sample_type for band_name in band_names]
+    if band_units is None:
+        band_units = 'reflectance'
+    if sample_types is None:
+        sample_types = 'FLOAT32'
+    if isinstance(band_units, str):
+        band_units = [band_units] * len(band_names)
+    if isinstance(sample_types, str):
+        sample_types = [sample_types] * len(band_names)
+
+    grid = TileGrid(bbox, resolution, chunks)
+    time_ranges = split_time_range(time_range, time_period)
+    template = RequestTemplate(dataset_name, band_names, band_units=band_units, sample_types=sample_types,
+                               encodings=encodings)
+    sample_types = template.sample_types
+
+    token = tokenize(dataset_name, list(band_names), grid.bbox, resolution, grid.tile_size,
+                     [(str(start), str(end)) for start, end in time_ranges], band_units, list(sample_types),
+                     template.evalscript, sentinel_hub.api_url)
+    fetch_name = f'fetch-{dataset_name}-{token}'
+    graph = {}
+    for time_index, (time_start, time_end) in enumerate(time_ranges):
+        for tile in grid:
+            request = template.new_request((tile.width, tile.height),
+                                           time_range=(format_time(time_start), format_time(time_end)),
+                                           bbox=tile.bbox)
+            graph[(fetch_name, time_index, tile.tile_y, tile.tile_x)] = (_fetch_tile, sentinel_hub, request)
+
+    num_tiles_x, num_tiles_y = grid.num_tiles
+    chunk_sizes = ((1,) * len(time_ranges),
+                   tuple(grid.tile(0, tile_y).height for tile_y in range(num_tiles_y)),
+                   tuple(grid.tile(tile_x, 0).width for tile_x in range(num_tiles_x)))
+
+    arrays = {}
+    for band_name, sample_type in zip(band_names, sample_types):
+        name = f'{band_name}-{token}'
+        band_graph = dict(graph)
+        for fetch_key in graph.keys():
+            band_graph[(name,) + fetch_key[1:]] = (_select_band, fetch_key, band_name)
+        arrays[band_name] = da.Array(band_graph, name, chunk_sizes, dtype=np.dtype(SAMPLE_TYPE_TO_DTYPE[sample_type]))
+
+    cube = _new_cube(grid, time_ranges, arrays, title=f'{dataset_name} Data Cube')
+    for band_name, units in zip(band_names, band_units):
+        cube[band_name].attrs['units'] = units
+        if encodings and band_name in encodings:
+            # Float32 scale factors and offsets make xarray decode to float32 instead of float64
+            cube[band_name].attrs.update({name: np.float32(value) if name != '_FillValue' else value
+                                          for name, value in encodings[band_name].attrs.items()})
+    if encodings:
+        # Lazily decode compact samples
+        cube = xr.decode_cf(cube, decode_times=False)
+    return cube
+
+
+def _fetch_tile(sentinel_hub: SentinelHub, request: Dict) -> Dict[str, np.ndarray]:
+    return sentinel_hub.get_arrays(request)
+
+
+def _select_band(arrays: Dict[str, np.ndarray], band_name: str) -> np.ndarray:
+    return arrays[band_name][np.newaxis, ...]
+
+
+def _new_cube(grid: TileGrid,
+              time_ranges: Sequence[Tuple[pd.Timestamp, pd.Timestamp]],
+              arrays: Dict[str, da.Array],
+              title: str) -> xr.Dataset:
+    time_data = np.array([start + (end - start) / 2 for start, end in time_ranges], dtype='datetime64[ns]')
+    time_bnds_data = np.array(time_ranges, dtype='datetime64[ns]')
+    cube = new_dataset(grid, {}, title=title)
+    cube = cube.assign_coords(time=xr.DataArray(time_data, dims='time', attrs=dict(bounds='time_bnds')),
+                              time_bnds=xr.DataArray(time_bnds_data, dims=('time', 'bnds')))
+    for name, array in arrays.items():
+        cube[name] = (('time', 'lat', 'lon'), array)
+    cube.attrs.update(time_coverage_start=format_time(time_ranges[0][0]),
+                      time_coverage_end=format_time(time_ranges[-1][1]))
+    return cube
@@ -0,0 +1,116 @@
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+from typing import Dict, BinaryIO
+
+import numpy as np
+import tifffile
+
+
+def decode_tar(data: bytes) -> Dict[str, np.ndarray]:
+    """
+    Decode a SentinelHub "application/tar" response into arrays.
+
+    :param data: The raw response content, a TAR archive of single-band TIFF files.
+    :return: A mapping from output identifiers (band names) to 2D arrays.
+    """
+    return decode_tar_stream(io.BytesIO(data))
+
+
+def decode_tar_stream(fileobj: BinaryIO) -> Dict[str, np.ndarray]:
+    """
+    Decode a SentinelHub "application/tar" response while it is being received.
+
+    The TAR members are visited strictly sequentially, so *fileobj* does not need
+    to be seekable, e.g. it may be the raw body of a streamed HTTP response.
+    Only the encoded bytes of the current member are held in memory; each TIFF
+    is decoded directly into a newly allocated array.
+
+    :param fileobj: A readable binary file object providing the TAR archive.
+    :return: A mapping from output identifiers (band names) to 2D arrays,
+        or 3D arrays of shape (band, y, x) for multi-band outputs.
+    """
+    arrays = {}
+    with tarfile.open(fileobj=fileobj, mode='r|') as tar:
+        for member in tar:
+            identifier, ext = os.path.splitext(member.name)
+            if member.isfile() and ext in ('.tif', '.tiff'):
+                arrays[identifier] = decode_tiff(tar.extractfile(member).read())
+    return arrays
+
+
+def decode_tar_memmap(fileobj: BinaryIO, spool_dir: str = None) -> Dict[str, np.ndarray]:
+    """
+    Decode a SentinelHub "application/tar" response into memory-mapped arrays.
+
+    The archive is first spooled into an anonymous temporary file in *spool_dir*.
+    Uncompressed images are then mapped directly from that file, other images
+    are decoded into further temporary files, which are mapped. So neither the
+    response nor the decoded images are ever held in memory, and the pages
+    of the arrays are loaded by the operating system on demand.
+
+    The arrays are writable, modifying them never changes the spooled response.
+    The temporary files are removed once the arrays are garbage collected.
+    Interleaved multi-band images are returned as non-contiguous views of shape
+    (band, y, x).
+
+    :param fileobj: A readable binary file object providing the TAR archive.
+    :param spool_dir: Directory for temporary files, defaults to the system's temporary directory.
+    :return: A mapping from output identifiers (band names) to 2D or 3D :class:`numpy.memmap` arrays.
+    """
+    arrays = {}
+    with tempfile.TemporaryFile(dir=spool_dir) as spool_file:
+        shutil.copyfileobj(fileobj, spool_file)
+        spool_file.seek(0)
+        with tarfile.open(fileobj=spool_file, mode='r:') as tar:
+            for member in tar:
+                identifier, ext = os.path.splitext(member.name)
+                if member.isfile() and ext in ('.tif', '.tiff'):
+                    arrays[identifier] = _decode_tiff_memmap(tar.extractfile(member), member.name,
+                                                             spool_file, member.offset_data, spool_dir)
+    # The mappings keep the closed temporary files alive
+    return arrays
+
+
+def decode_tiff(data: bytes) -> np.ndarray:
+    """
+    Decode the first image of a TIFF file into a preallocated array.
+
+    Multi-band images are returned with shape (band, y, x). Images with separate
+    planes are decoded directly in this layout, images with interleaved samples
+    are transposed.
+
+    :param data: The TIFF file's content.
+    :return: The decoded image.
+    """
+    with tifffile.TiffFile(io.BytesIO(data)) as tif:
+        page = tif.pages[0]
+        axes = page.axes
+        out = np.empty(page.shape, dtype=page.dtype)
+        page.asarray(out=out)
+    if out.ndim == 3 and axes.endswith('S'):
+        out = np.ascontiguousarray(np.moveaxis(out, -1, 0))
+    return out
+
+
+def _decode_tiff_memmap(fileobj: BinaryIO, name: str, spool_file: BinaryIO, offset: int, spool_dir: str) \
+        -> np.ndarray:
+    # Anonymous temporary files have no name, which tifffile requires
+    with tifffile.TiffFile(fileobj, name=name) as tif:
+        page = tif.pages[0]
+        axes = page.axes
+        if page.is_contiguous:
+            # Map the image data within the spooled archive
+            dtype = page.dtype.newbyteorder(tif.byteorder)
+            out = np.memmap(spool_file, dtype=dtype, mode='c', offset=offset + page.dataoffsets[0],
+                            shape=page.shape)
+        else:
+            with tempfile.TemporaryFile(dir=spool_dir) as out_file:
+                out = np.memmap(out_file, dtype=page.dtype, mode='w+', shape=page.shape)
+                page.asarray(out=out)
+                out.flush()
+    if out.ndim == 3 and axes.endswith('S'):
+        out = np.moveaxis(out, -1, 0)
+    return out
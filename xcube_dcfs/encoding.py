@@ -0,0 +1,107 @@
+import math
+from typing import Dict, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+# Bands with small integer values, e.g. masks and classifications
+MASK_BANDS = ('dataMask', 'CLM', 'CLP', 'SCL', 'SNW', 'CLD')
+
+# Bands given in degrees between 0 and 360
+ANGLE_BANDS = ('viewZenithMean', 'viewAzimuthMean', 'sunZenithAngles', 'sunAzimuthAngles')
+
+# Sentinel-2 reflectances are digital numbers divided by this value
+_REFLECTANCE_QUANTIFICATION = 10000
+
+
+class BandEncoding(NamedTuple):
+    """
+    The encoding of band values as compact integer samples, following the CF conventions.
+
+    Values are encoded as ``round((value - add_offset) / scale_factor)``, missing
+    values as *fill_value*, and decoded as ``sample * scale_factor + add_offset``.
+    """
+    sample_type: str
+    scale_factor: float = 1.0
+    add_offset: float = 0.0
+    fill_value: Optional[int] = None
+
+    @property
+    def dtype(self) -> np.dtype:
+        # Sample types are the upper case names of numpy dtypes, see SAMPLE_TYPE_TO_DTYPE
+        return np.dtype(self.sample_type.lower())
+
+    @property
+    def is_identity(self) -> bool:
+        """Whether values are returned as they are."""
+        return self.scale_factor == 1.0 and self.add_offset == 0.0 and self.fill_value is None
+
+    @property
+    def valid_range(self) -> Optional[Tuple[int, int]]:
+        """The range of valid encoded samples, excluding the fill value, or None for floating point samples."""
+        if self.dtype.kind == 'f':
+            return None
+        info = np.iinfo(self.dtype)
+        return (info.min + 1 if self.fill_value == info.min else info.min,
+                info.max - 1 if self.fill_value == info.max else info.max)
+
+    @property
+    def attrs(self) -> Dict[str, Union[int, float]]:
+        """CF attributes of variables holding encoded samples."""
+        attrs = {}
+        if self.scale_factor != 1.0:
+            attrs['scale_factor'] = self.scale_factor
+        if self.add_offset != 0.0:
+            attrs['add_offset'] = self.add_offset
+        if self.fill_value is not None:
+            attrs['_FillValue'] = self.fill_value
+        return attrs
+
+    def encode(self, values: np.ndarray) -> np.ndarray:
+        """Encode *values*, NaN values become the fill value."""
+        if self.dtype.kind == 'f':
+            return np.asarray(values, dtype=self.dtype)
+        valid = np.isfinite(values)
+        samples = np.round((np.where(valid, values, 0) - self.add_offset) / self.scale_factor)
+        samples = np.clip(samples, *self.valid_range)
+        if self.fill_value is not None:
+            samples = np.where(valid, samples, self.fill_value)
+        return samples.astype(self.dtype)
+
+    def decode(self, samples: np.ndarray) -> np.ndarray:
+        """Decode *samples* into floating point values, the fill value becomes NaN."""
+        values = samples * np.float32(self.scale_factor) + np.float32(self.add_offset)
+        if self.fill_value is not None:
+            values = np.where(samples == self.fill_value, np.float32(math.nan), values)
+        return values.astype(np.float32, copy=False)
+
+
+def plan_encoding(band_name: str, units: str = 'reflectance') -> BandEncoding:
+    """
+    Get the most compact encoding of the values of a band that preserves their information.
+
+    Reflectances are quantified as 16-bit integers by SentinelHub, so they are
+    returned as UINT16 with a scale factor. Masks and classifications are
+    returned as UINT8, angles as UINT16 with a precision of 0.01 degrees, and
+    digital numbers as UINT16. Values of other bands remain 32-bit floats.
+
+    :param band_name: The band name.
+    :param units: The units the band is requested in.
+    :return: The encoding.
+    """
+    if band_name in MASK_BANDS:
+        return BandEncoding('UINT8')
+    if band_name in ANGLE_BANDS:
+        return BandEncoding('UINT16', scale_factor=0.01, fill_value=65535)
+    if units == 'reflectance' and band_name.startswith('B'):
+        return BandEncoding('UINT16', scale_factor=1.0 / _REFLECTANCE_QUANTIFICATION, fill_value=65535)
+    if units == 'DN' and band_name.startswith('B'):
+        return BandEncoding('UINT16', fill_value=65535)
+    return BandEncoding('FLOAT32')
+
+
+def plan_encodings(band_names: Sequence[str],
+                   band_units: Union[str, Sequence[str]] = 'reflectance') -> Dict[str, BandEncoding]:
+    """Get a mapping from *band_names* to their encodings, see :func:`plan_encoding`."""
+    if isinstance(band_units, str):
+        band_units = [band_units] * len(band_names)
+    return {band_name: plan_encoding(band_name, units) for band_name, units in zip(band_names, band_units)}
@@ -0,0 +1,133 @@
+import ast
+from typing import Dict
+
+# Functions that may be used in band math expressions and their JavaScript counterparts
+FUNCTIONS = {
+    'abs': 'Math.abs',
+    'sqrt': 'Math.sqrt',
+    'exp': 'Math.exp',
+    'log': 'Math.log',
+    'log10': 'Math.log10',
+    'sin': 'Math.sin',
+    'cos': 'Math.cos',
+    'tan': 'Math.tan',
+    'min': 'Math.min',
+    'max': 'Math.max',
+    'pow': 'Math.pow',
+    'floor': 'Math.floor',
+    'ceil': 'Math.ceil',
+}
+
+_BINARY_OPERATORS = {
+    ast.Add: '+',
+    ast.Sub: '-',
+    ast.Mult: '*',
+    ast.Div: '/',
+    ast.Mod: '%',
+}
+
+_UNARY_OPERATORS = {
+    ast.USub: '-',
+    ast.UAdd: '+',
+    ast.Not: '!',
+}
+
+_COMPARE_OPERATORS = {
+    ast.Eq: '===',
+    ast.NotEq: '!==',
+    ast.Lt: '<',
+    ast.LtE: '<=',
+    ast.Gt: '>',
+    ast.GtE: '>=',
+}
+
+_BOOLEAN_OPERATORS = {
+    ast.And: '&&',
+    ast.Or: '||',
+}
+
+
+def compile_expression(expression: str, names: Dict[str, str]) -> str:
+    """
+    Compile a band math expression into a JavaScript expression for evalscripts.
+
+    Expressions use Python syntax and may contain numbers, the given names,
+    the arithmetic operators +, -, *, /, %, and **, comparisons, "and", "or",
+    "not", conditional expressions "a if condition else b", and calls of
+    the functions in :const:`FUNCTIONS`, e.g. "(B08 - B04) / (B08 + B04)".
+
+    :param expression: The expression.
+    :param names: Mapping from the names that may be used in the expression to their JavaScript code,
+        e.g. {"B04": "sample.B04"}.
+    :return: The JavaScript expression.
+    :raise ValueError: If the expression is invalid or uses unknown names or unsupported syntax.
+    """
+    try:
+        tree = ast.parse(expression.strip(), mode='eval')
+    except SyntaxError as e:
+        raise ValueError(f'invalid expression {expression!r}: {e.msg}') from e
+    return _Compiler(expression, names).visit(tree.body)
+
+
+class _Compiler(ast.NodeVisitor):
+    def __init__(self, expression: str, names: Dict[str, str]):
+        self._expression = expression
+        self._names = names
+
+    def generic_visit(self, node):
+        raise ValueError(f'unsupported syntax in expression {self._expression!r}: {type(node).__name__}')
+
+    def visit_Constant(self, node: ast.Constant) -> str:
+        return self._visit_number(node, node.value)
+
+    def visit_Num(self, node) -> str:
+        # Python < 3.8 parses numeric literals as ast.Num rather than ast.Constant
+        return self._visit_number(node, node.n)
+
+    def _visit_number(self, node, value) -> str:
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return self.generic_visit(node)
+        return repr(value)
+
+    def visit_Name(self, node: ast.Name) -> str:
+        if node.id not in self._names:
+            raise ValueError(f'unknown name {node.id!r} in expression {self._expression!r}')
+        return self._names[node.id]
+
+    def visit_BinOp(self, node: ast.BinOp) -> str:
+        left, right = self.visit(node.left), self.visit(node.right)
+        if isinstance(node.op, ast.Pow):
+            return f'Math.pow({left}, {right})'
+        operator = _BINARY_OPERATORS.get(type(node.op))
+        if operator is None:
+            return self.generic_visit(node.op)
+        return f'({left} {operator} {right})'
+
+    def visit_UnaryOp(self, node: ast.UnaryOp) -> str:
+        operator = _UNARY_OPERATORS.get(type(node.op))
+        if operator is None:
+            return self.generic_visit(node.op)
+        return f'({operator}{self.visit(node.operand)})'
+
+    def visit_Compare(self, node: ast.Compare) -> str:
+        # a < b < c becomes (a < b) && (b < c)
+        operands = [self.visit(node.left)] + [self.visit(comparator) for comparator in node.comparators]
+        comparisons = []
+        for i, op in enumerate(node.ops):
+            operator = _COMPARE_OPERATORS.get(type(op))
+            if operator is None:
+                return self.generic_visit(op)
+            comparisons.append(f'({operands[i]} {operator} {operands[i + 1]})')
+        return comparisons[0] if len(comparisons) == 1 else '(' + ' && '.join(comparisons) + ')'
+
+    def visit_BoolOp(self, node: ast.BoolOp) -> str:
+        operator = _BOOLEAN_OPERATORS[type(node.op)]
+        return '(' + f' {operator} '.join(self.visit(value) for value in node.values) + ')'
+
+    def visit_IfExp(self, node: ast.IfExp) -> str:
+        return f'({self.visit(node.test)} ? {self.visit(node.body)} : {self.visit(node.orelse)})'
+
+    def visit_Call(self, node: ast.Call) -> str:
+        if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS or node.keywords:
+            raise ValueError(f'unsupported function call in expression {self._expression!r}')
+        return FUNCTIONS[node.func.id] + '(' + ', '.join(self.visit(arg) for arg in node.args) + ')'
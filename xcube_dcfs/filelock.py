@@ -0,0 +1,87 @@
+import json
+import os
+import tempfile
+from typing import Any
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+class FileLock:
+    """
+    An exclusive inter-process lock based on ``flock()`` on the given lock file.
+
+    On platforms without ``fcntl`` the lock is a no-op.
+
+    :param path: Path of the lock file, created if it does not exist.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._fp = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self._fp = open(self._path, 'a')
+            fcntl.flock(self._fp.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._fp is not None:
+            fcntl.flock(self._fp.fileno(), fcntl.LOCK_UN)
+            self._fp.close()
+            self._fp = None
+
+
+def read_json(path: str) -> Any:
+    """
+    Read a JSON file written by :func:`write_json_atomic`.
+
+    :param path: Path of the file.
+    :return: The decoded object, or ``None`` if the file does not exist or is invalid.
+    """
+    try:
+        with open(path) as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+
+def write_json_atomic(path: str, obj: Any, mode: int = None):
+    """
+    Write *obj* as JSON to the file at *path*, see :func:`write_atomic`.
+
+    :param path: Path of the file, replaced if it exists.
+    :param obj: A JSON-serializable object.
+    :param mode: Optional permission bits of the file.
+    """
+    write_atomic(path, json.dumps(obj).encode('utf-8'), mode=mode)
+
+
+def write_atomic(path: str, data: bytes, mode: int = None):
+    """
+    Write *data* to the file at *path* so that readers, also in other processes,
+    never see a partially written file.
+
+    The data is written to a temporary file in the same directory first,
+    which is then atomically renamed to *path*.
+
+    :param path: Path of the file, replaced if it exists.
+    :param data: The file content.
+    :param mode: Optional permission bits of the file, set before any data is written.
+    """
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        if mode is not None:
+            os.chmod(temp_path, mode)
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
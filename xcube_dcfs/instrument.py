@@ -0,0 +1,205 @@
+import bisect
+import contextlib
+import json
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+DEFAULT_TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Durations recorded for each request, in seconds
+TIMING_NAMES = ('token_time', 'throttle_time', 'ttfb', 'transfer_time', 'decode_time', 'total_time')
+
+# Per-request counts accumulated into counters
+_COUNTER_FIELDS = (('request_bytes', 'request_bytes_total'),
+                   ('response_bytes', 'response_bytes_total'),
+                   ('retries', 'retries_total'),
+                   ('processing_units', 'processing_units_total'))
+
+
+class RequestRecord:
+    """
+    Measurements of a single call to the SentinelHub API.
+
+    Durations are given in seconds. *ttfb* (time to first byte) spans from
+    sending the request until the response headers have been received, so it
+    includes name resolution, connection setup, upload, and server-side
+    processing. *transfer_time* is the time spent receiving the response body,
+    *decode_time* the time spent decoding it. *token_time* is the time spent
+    obtaining OAuth2 tokens, *throttle_time* the time spent waiting because
+    of rate limits.
+
+    :param name: Name of the operation, e.g. "process".
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.start_time = time.time()
+        self.status_code: Optional[int] = None
+        self.retries = 0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.processing_units: Optional[float] = None
+        self.error: Optional[str] = None
+        self.token_time = 0.0
+        self.throttle_time = 0.0
+        self.ttfb = 0.0
+        self.transfer_time = 0.0
+        self.decode_time = 0.0
+        self.total_time = 0.0
+        self._t0 = time.perf_counter()
+
+    def finish(self):
+        self.total_time = time.perf_counter() - self._t0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(name=self.name,
+                    start_time=self.start_time,
+                    status_code=self.status_code,
+                    retries=self.retries,
+                    request_bytes=self.request_bytes,
+                    response_bytes=self.response_bytes,
+                    processing_units=self.processing_units,
+                    error=self.error,
+                    **{name: getattr(self, name) for name in TIMING_NAMES})
+
+
+class Histogram:
+    """A cumulative histogram with fixed bucket upper bounds, as used by Prometheus."""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_TIME_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        cumulative_counts = []
+        total = 0
+        for count in self.counts:
+            total += count
+            cumulative_counts.append(total)
+        bounds = [str(bound) for bound in self.buckets] + ['+Inf']
+        return dict(buckets=dict(zip(bounds, cumulative_counts)), sum=self.sum, count=self.count)
+
+
+class Instrumentation:
+    """
+    Collects a :class:`RequestRecord` for every call to the SentinelHub API,
+    aggregates them into counters and histograms, and passes them to callbacks.
+
+    :param buckets: Upper bounds of the histogram buckets for durations in seconds.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_TIME_BUCKETS):
+        self._buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[RequestRecord], None]] = []
+        self._counters: Dict[str, float] = {}
+        self._histograms: Dict[str, Histogram] = {}
+        self.reset()
+
+    def add_callback(self, callback: Callable[[RequestRecord], None]):
+        """Add a *callback* that is called with every finished :class:`RequestRecord`."""
+        self._callbacks.append(callback)
+
+    def remove_callback(self, callback: Callable[[RequestRecord], None]):
+        self._callbacks.remove(callback)
+
+    @contextlib.contextmanager
+    def recording(self, name: str) -> Iterator[RequestRecord]:
+        """
+        Context manager that yields a new :class:`RequestRecord` to be filled in,
+        and records it on exit. Errors raised in the context are stored in the record.
+        """
+        record = RequestRecord(name)
+        try:
+            yield record
+        except BaseException as error:
+            record.error = str(error) or type(error).__name__
+            raise
+        finally:
+            self.record(record)
+
+    def record(self, record: RequestRecord):
+        """Finish the *record*, aggregate it, and pass it to all callbacks."""
+        record.finish()
+        with self._lock:
+            self._counters['requests_total'] += 1
+            if record.error is not None:
+                self._counters['errors_total'] += 1
+            for field_name, counter_name in _COUNTER_FIELDS:
+                value = getattr(record, field_name)
+                if value:
+                    self._counters[counter_name] += value
+            for name in TIMING_NAMES:
+                self._histograms[name].observe(getattr(record, name))
+        for callback in self._callbacks:
+            callback(record)
+
+    def reset(self):
+        with self._lock:
+            self._counters = dict(requests_total=0, errors_total=0,
+                                  **{counter_name: 0 for _, counter_name in _COUNTER_FIELDS})
+            self._histograms = {name: Histogram(self._buckets) for name in TIMING_NAMES}
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Get the current counters and histograms as JSON-serializable dictionary."""
+        with self._lock:
+            return dict(counters=dict(self._counters),
+                        histograms={name: histogram.to_dict() for name, histogram in self._histograms.items()})
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot())
+
+    def to_prometheus(self, prefix: str = 'xcube_dcfs') -> str:
+        """Get the current counters and histograms in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in snapshot['counters'].items():
+            lines.append(f'# TYPE {prefix}_{name} counter')
+            lines.append(f'{prefix}_{name} {value}')
+        for name, histogram in snapshot['histograms'].items():
+            if name.endswith('_time'):
+                name = name[:-len('_time')]
+            metric_name = f'{prefix}_{name}_seconds'
+            lines.append(f'# TYPE {metric_name} histogram')
+            for bound, count in histogram['buckets'].items():
+                lines.append(f'{metric_name}_bucket{{le="{bound}"}} {count}')
+            lines.append(f'{metric_name}_sum {histogram["sum"]}')
+            lines.append(f'{metric_name}_count {histogram["count"]}')
+        return '\n'.join(lines) + '\n'
+
+
+def new_json_logger(logger: logging.Logger = None, level: int = logging.INFO) -> Callable[[RequestRecord], None]:
+    """Create a callback that logs every :class:`RequestRecord` as a JSON object."""
+    logger = logger or logging.getLogger('xcube_dcfs')
+
+    def log_record(record: RequestRecord):
+        logger.log(level, json.dumps(record.to_dict()))
+
+    return log_record
+
+
+class TimedReader:
+    """
+    Wraps a binary file object and measures the time spent in and the number of bytes returned by ``read()``.
+    """
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self.read_time = 0.0
+        self.num_bytes = 0
+
+    def read(self, size: int = -1) -> bytes:
+        t0 = time.perf_counter()
+        data = self._fileobj.read(size)
+        self.read_time += time.perf_counter() - t0
+        self.num_bytes += len(data)
+        return data
@@ -0,0 +1,341 @@
+import concurrent.futures
+import json
+import os
+from collections.abc import MutableMapping
+from typing import Any, Callable, Dict, Iterable, Optional, Set, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+import zarr
+from numcodecs.abc import Codec
+
+from xcube_dcfs.encoding import BandEncoding
+from xcube_dcfs.sentinelhub import DEFAULT_MAX_WORKERS, SAMPLE_TYPE_TO_DTYPE, SentinelHub
+from xcube_dcfs.store import BBox, SentinelHubStore, TimeRange, format_time, new_consolidated_metadata, \
+    to_timestamp
+
+MANIFEST_NAME = '.manifest'
+
+# Use zarr's default, currently Blosc with LZ4
+DEFAULT_COMPRESSOR = 'default'
+
+# Cube attribute recording an update whose chunks have all been written, but which has not been completed yet
+PENDING_UPDATE_ATTR = 'pending_update'
+
+
+def materialize(store: SentinelHubStore,
+                target: Union[str, MutableMapping],
+                manifest_path: str = None,
+                compressor: Union[str, Codec, None] = DEFAULT_COMPRESSOR,
+                max_workers: int = DEFAULT_MAX_WORKERS,
+                progress: Callable[[int, int], None] = None) -> Dict[str, int]:
+    """
+    Copy a remote cube into a local Zarr store, resuming an interrupted copy.
+
+    Chunks are fetched concurrently and each chunk is written into the target
+    store as soon as it has been received. The key of every written chunk is then
+    appended to a manifest file, so that a restarted copy fetches only the chunks
+    that are missing. At most twice *max_workers* chunks are held in memory at any
+    time, regardless of the size of the cube.
+
+    If fetching a chunk fails, no further chunks are started, the chunks in flight
+    are completed, and the error is raised. Calling this function again with the
+    same arguments continues the copy.
+
+    :param store: The source store.
+    :param target: Path of a local directory or a Zarr store to write to.
+    :param manifest_path: Path of the manifest file. Defaults to the file
+        :const:`MANIFEST_NAME` within *target* if it is a path.
+    :param compressor: The compressor used for band chunks, "default" for zarr's default compressor.
+    :param max_workers: Maximum number of concurrent chunk requests.
+    :param progress: Optional function called with the numbers of completed and
+        total chunks after each written chunk.
+    :return: The numbers of "total" chunks, of chunks "skipped" because they had been
+        written before, and of "written" chunks. Of the written chunks, those that
+        hold fill values only are not stored, the store serves them as Zarr's fill
+        value. Their number is given as "empty".
+    """
+    if isinstance(target, str):
+        if manifest_path is None:
+            manifest_path = os.path.join(target, MANIFEST_NAME)
+        target = zarr.DirectoryStore(target)
+    elif manifest_path is None:
+        raise ValueError('manifest_path must be given if target is not a path')
+    if isinstance(compressor, str):
+        compressor = zarr.storage.default_compressor
+
+    _write_metadata(store, target, compressor)
+
+    done = _read_manifest(manifest_path)
+    keys = [key for band_name in store.band_names for key in store.chunk_keys(band_name)]
+    missing_keys = [key for key in keys if key not in done]
+    stats = dict(total=len(keys), skipped=len(keys) - len(missing_keys), written=0, empty=0)
+
+    def on_copied(key: str, stored: bool):
+        manifest.write(key + '\n')
+        manifest.flush()
+        stats['written'] += 1
+        stats['empty'] += not stored
+        if progress is not None:
+            progress(stats['skipped'] + stats['written'], stats['total'])
+
+    with open(manifest_path, 'a') as manifest:
+        _copy_chunks(store, target, ((key, key, compressor) for key in missing_keys), max_workers, on_copied)
+    return stats
+
+
+def update_cube(sentinel_hub: SentinelHub,
+                target: Union[str, MutableMapping],
+                dataset_name: str,
+                time_end: str = None,
+                time_period: str = None,
+                max_workers: int = DEFAULT_MAX_WORKERS,
+                coverage: Callable[[BBox, TimeRange], bool] = None) -> Dict[str, Any]:
+    """
+    Bring a local cube up to date by appending new time steps.
+
+    The cube's grid, bands, units, sample types, and chunking are read from the
+    existing Zarr store. Only time steps after the cube's "time_coverage_end" are
+    requested, and their chunks are written next to the existing ones, which are
+    never rewritten. Only complete time periods are appended, so the time
+    coordinate stays regular.
+
+    The new chunks remain invisible until the arrays are resized, so an update
+    interrupted while chunks are written leaves the cube unchanged. Once all
+    chunks have been written, the new time coordinate values are recorded in the
+    cube's "pending_update" attribute before the coordinates and arrays are
+    resized and "time_coverage_end" is updated. An update interrupted at that
+    stage is completed by the next call, before any new time steps are requested.
+
+    :param sentinel_hub: The SentinelHub client.
+    :param target: Path or Zarr store of a cube, e.g. one written by :func:`materialize`.
+        Band variables must have dimensions ("time", "lat", "lon") and one time step per chunk.
+    :param dataset_name: Dataset name, e.g. "S2L1C".
+    :param time_end: End of the time range to be covered, defaults to now.
+    :param time_period: Duration of each time step, e.g. "1D". Defaults to the
+        duration of the cube's existing time steps.
+    :param max_workers: Maximum number of concurrent chunk requests.
+    :param coverage: Optional function that tells whether there are acquisitions within a
+        bounding box and time range, see :class:`SentinelHubStore`.
+    :return: The number of appended "time_steps", including those of a completed pending update,
+        the number of written "chunks", of which "empty_chunks" held fill values only and
+        were not stored, and the new "time_coverage_end".
+    """
+    if isinstance(target, str):
+        target = zarr.DirectoryStore(target)
+    group = zarr.open_group(store=target, mode='r+')
+    # The cube cannot be opened with inconsistent dimensions, so complete a pending update first
+    num_completed_steps = _complete_update(target, group)
+    cube = xr.open_zarr(target, consolidated=False)
+
+    time_values = pd.DatetimeIndex(cube.time.values)
+    coverage_end = to_timestamp(cube.attrs['time_coverage_end'])
+    if time_period is not None:
+        period = pd.to_timedelta(time_period)
+    elif len(time_values) > 1:
+        period = pd.Series(time_values).diff().median()
+    else:
+        # Time values are at the centers of their periods
+        period = 2 * (coverage_end - time_values[-1])
+    time_end = to_timestamp(time_end) if time_end is not None else pd.Timestamp.now(tz='UTC').tz_convert(None)
+    num_steps = int((time_end - coverage_end) // period)
+    result = dict(time_steps=num_completed_steps, chunks=0, empty_chunks=0,
+                  time_coverage_end=format_time(coverage_end))
+    if num_steps < 1:
+        return result
+
+    band_names = [name for name, var in cube.data_vars.items() if var.dims == ('time', 'lat', 'lon')]
+    for band_name in band_names:
+        if group[band_name].chunks[0] != 1:
+            raise ValueError(f'variable {band_name!r} must have one time step per chunk')
+    dtype_to_sample_type = {np.dtype(dtype): sample_type for sample_type, dtype in SAMPLE_TYPE_TO_DTYPE.items()}
+    tile_size = tuple(reversed(group[band_names[0]].chunks[1:]))
+    spatial_res = (cube.attrs['geospatial_lon_max'] - cube.attrs['geospatial_lon_min']) / cube.lon.size
+    new_time_end = coverage_end + num_steps * period
+    store = SentinelHubStore(sentinel_hub, dataset_name, band_names,
+                             bbox=(cube.attrs['geospatial_lon_min'], cube.attrs['geospatial_lat_min'],
+                                   cube.attrs['geospatial_lon_max'], cube.attrs['geospatial_lat_max']),
+                             spatial_res=spatial_res,
+                             time_range=(coverage_end, new_time_end),
+                             time_period=period,
+                             tile_size=tile_size,
+                             band_units=[cube[band_name].attrs.get('units', 'reflectance') for band_name in band_names],
+                             sample_types=[dtype_to_sample_type[group[band_name].dtype] for band_name in band_names],
+                             encodings={band_name: _read_encoding(group[band_name], dtype_to_sample_type)
+                                        for band_name in band_names},
+                             coverage=coverage)
+    if store.size != (cube.lon.size, cube.lat.size):
+        raise ValueError('grid of the cube cannot be reproduced')
+
+    num_times = len(time_values)
+    items = []
+    for band_name in band_names:
+        compressor = group[band_name].compressor
+        for key in store.chunk_keys(band_name):
+            time_index, tile_index = key[len(band_name) + 1:].split('.', 1)
+            items.append((key, f'{band_name}/{int(time_index) + num_times}.{tile_index}', compressor))
+
+    def on_copied(key: str, stored: bool):
+        result['chunks'] += 1
+        result['empty_chunks'] += not stored
+
+    _copy_chunks(store, target, items, max_workers, on_copied)
+
+    # Record the new time coordinates, then make the new chunks visible
+    time_ranges = store.time_ranges
+    time_attrs = group['time'].attrs
+    pending_update = dict(num_times=num_times,
+                          band_names=band_names,
+                          time=_encode_times(group['time'], [start + (end - start) / 2 for start, end in time_ranges],
+                                             time_attrs).tolist(),
+                          time_coverage_end=format_time(new_time_end))
+    if 'time_bnds' in group:
+        pending_update['time_bnds'] = _encode_times(group['time_bnds'], time_ranges, time_attrs).tolist()
+    group.attrs[PENDING_UPDATE_ATTR] = pending_update
+    _complete_update(target, group)
+
+    result.update(time_steps=result['time_steps'] + num_steps, time_coverage_end=format_time(new_time_end))
+    return result
+
+
+def _complete_update(target: MutableMapping, group: zarr.Group) -> int:
+    """
+    Resize the coordinates and arrays of *group* as recorded by :func:`update_cube`,
+    and return the number of appended time steps. Every step can be repeated, so an
+    interrupted completion can be completed again.
+    """
+    pending_update = group.attrs.get(PENDING_UPDATE_ATTR)
+    if pending_update is None:
+        return 0
+    num_times = pending_update['num_times']
+    num_steps = len(pending_update['time'])
+    for name in ('time', 'time_bnds'):
+        if name in pending_update:
+            array = group[name]
+            array.resize((num_times + num_steps,) + array.shape[1:])
+            array[num_times:] = np.array(pending_update[name], dtype=array.dtype)
+    for band_name in pending_update['band_names']:
+        array = group[band_name]
+        array.resize((num_times + num_steps,) + array.shape[1:])
+    # Update the time coverage and remove the record at once
+    attrs = group.attrs.asdict()
+    del attrs[PENDING_UPDATE_ATTR]
+    attrs['time_coverage_end'] = pending_update['time_coverage_end']
+    group.attrs.put(attrs)
+    if '.zmetadata' in target:
+        zarr.consolidate_metadata(target)
+    return num_steps
+
+
+def _read_encoding(array: zarr.Array, dtype_to_sample_type: Dict[np.dtype, str]) -> BandEncoding:
+    # Variables written from compact samples have CF attributes, the array's fill value is their "_FillValue"
+    fill_value = array.fill_value if array.dtype.kind != 'f' else None
+    return BandEncoding(dtype_to_sample_type[array.dtype],
+                        scale_factor=array.attrs.get('scale_factor', 1.0),
+                        add_offset=array.attrs.get('add_offset', 0.0),
+                        fill_value=int(fill_value) if fill_value is not None else None)
+
+
+def _encode_times(array: zarr.Array, times, time_attrs) -> np.ndarray:
+    # Bounds variables may lack units and calendar, they share those of the time coordinate
+    values, _, _ = xr.coding.times.encode_cf_datetime(np.array(times, dtype='datetime64[ns]'),
+                                                      units=array.attrs.get('units', time_attrs['units']),
+                                                      calendar=array.attrs.get('calendar',
+                                                                               time_attrs.get('calendar')))
+    return values.astype(array.dtype)
+
+
+def _copy_chunks(store: SentinelHubStore,
+                 target: MutableMapping,
+                 items: Iterable[Tuple[str, str, Optional[Codec]]],
+                 max_workers: int,
+                 on_copied: Callable[[str, bool], None]):
+    """
+    Copy chunks given as (source_key, target_key, compressor) triples concurrently
+    from *store* to *target*, and call *on_copied* with each written target key and
+    whether the chunk has been stored. Chunks of fill values only are not stored.
+    """
+    fill_values = {band_name: _read_fill_value(store, band_name) for band_name in store.band_names}
+
+    def copy_chunk(source_key: str, target_key: str, compressor: Optional[Codec]) -> Tuple[str, bool]:
+        data = store[source_key]
+        if _is_fill_chunk(data, *fill_values[source_key.split('/', 1)[0]]):
+            return target_key, False
+        target[target_key] = compressor.encode(data) if compressor is not None else data
+        return target_key, True
+
+    items = iter(items)
+    error = None
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = set()
+        while True:
+            # Keep a bounded number of chunks in flight
+            while error is None and len(futures) < 2 * max_workers:
+                item = next(items, None)
+                if item is None:
+                    break
+                futures.add(executor.submit(copy_chunk, *item))
+            if not futures:
+                break
+            completed, futures = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in completed:
+                try:
+                    key, stored = future.result()
+                except Exception as e:
+                    error = error or e
+                    continue
+                on_copied(key, stored)
+    if error is not None:
+        raise error
+
+
+def _read_fill_value(store: SentinelHubStore, band_name: str) -> Tuple[np.dtype, Any]:
+    metadata = json.loads(store[band_name + '/.zarray'])
+    dtype = np.dtype(metadata['dtype'])
+    fill_value = metadata['fill_value']
+    if fill_value is not None and dtype.kind == 'f':
+        # "NaN" is given as string
+        fill_value = float(fill_value)
+    return dtype, fill_value
+
+
+def _is_fill_chunk(data: bytes, dtype: np.dtype, fill_value) -> bool:
+    if fill_value is None:
+        # Missing chunks of arrays without fill value are undefined
+        return False
+    values = np.frombuffer(data, dtype=dtype)
+    if dtype.kind == 'f' and np.isnan(fill_value):
+        return bool(np.isnan(values).all())
+    return bool((values == fill_value).all())
+
+
+def _write_metadata(store: SentinelHubStore, target: MutableMapping, compressor: Optional[Codec]):
+    band_array_keys = {band_name + '/.zarray' for band_name in store.band_names}
+    metadata_keys = [key for key in store.metadata_keys() if key != '.zmetadata']
+    for key in metadata_keys:
+        value = store[key]
+        if key in band_array_keys:
+            metadata = json.loads(value)
+            metadata['compressor'] = compressor.get_config() if compressor is not None else None
+            value = json.dumps(metadata, indent=2).encode('utf-8')
+        if key in target:
+            if target[key] != value:
+                raise ValueError(f'target differs from store at {key!r}, it contains another cube')
+        else:
+            target[key] = value
+    # Consolidate the written metadata, whose compressors may differ from those of the store
+    target['.zmetadata'] = new_consolidated_metadata({key: target[key] for key in metadata_keys})
+
+
+def _read_manifest(manifest_path: str) -> Set[str]:
+    try:
+        with open(manifest_path) as fp:
+            lines = fp.readlines()
+    except FileNotFoundError:
+        return set()
+    if lines and not lines[-1].endswith('\n'):
+        # Terminate a partially written last line, which is ignored
+        with open(manifest_path, 'a') as fp:
+            fp.write('\n')
+    return {line[:-1] for line in lines if line.endswith('\n')}
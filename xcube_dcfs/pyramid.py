@@ -0,0 +1,349 @@
+import json
+import math
+import os
+import warnings
+from collections.abc import MutableMapping
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import xarray as xr
+import zarr
+
+from xcube_dcfs.sentinelhub import SentinelHub
+from xcube_dcfs.store import SentinelHubStore, new_consolidated_metadata
+
+RESAMPLING_METHODS = ('mean', 'nearest')
+DEFAULT_RESAMPLING = 'mean'
+
+# Spatial dimensions, the last two dimensions of downsampled variables
+_SPATIAL_DIMS = ['lat', 'lon']
+
+
+class DownsampledStore(MutableMapping):
+    """
+    A read-only Zarr store that represents the cube of a *parent* store at half its spatial resolution.
+
+    Variables with spatial dimensions ("lat", "lon") keep their chunk sizes,
+    so every chunk is computed from the corresponding 2 x 2 chunks of the
+    parent, using a vectorized block mean, which ignores NaN values, or
+    nearest-neighbour selection. Chunks are computed on first access and then
+    kept in *cache*. All other variables are taken from the parent. The
+    metadata is also served consolidated as ".zmetadata".
+
+    :param parent: The parent Zarr store, e.g. a :class:`SentinelHubStore`, a
+        local Zarr directory store, or another downsampled store.
+    :param resampling: The resampling method, "mean" or "nearest", either one for
+        all variables or a mapping from variable names to methods.
+    :param cache: Mapping in which computed chunks are kept, defaults to a new dict.
+    """
+
+    def __init__(self,
+                 parent: MutableMapping,
+                 resampling: Union[str, Dict[str, str]] = DEFAULT_RESAMPLING,
+                 cache: MutableMapping = None):
+        self._parent = parent
+        self._group = zarr.open_group(store=parent, mode='r')
+        self._resampling = resampling
+        self._cache = cache if cache is not None else {}
+        self._arrays: Dict[str, zarr.Array] = {}
+        self._vfs = self._new_vfs()
+
+    @property
+    def parent(self) -> MutableMapping:
+        return self._parent
+
+    def listdir(self, path: str = '') -> List[str]:
+        # Only enumerate the chunk keys of a listed array, there may be millions in total
+        path = path.rstrip('/')
+        prefix = path + '/' if path else ''
+        entries = [key[len(prefix):] for key in self._vfs.keys() if key.startswith(prefix)]
+        if path in self._arrays:
+            entries.extend(key[len(prefix):] for key in self._chunk_keys(path))
+        return sorted(set(entry.split('/')[0] for entry in entries))
+
+    def __len__(self) -> int:
+        return len(self._vfs) + sum(math.prod(array.cdata_shape) for array in self._arrays.values())
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self._vfs.keys()
+        for name in self._arrays.keys():
+            yield from self._chunk_keys(name)
+
+    def __contains__(self, key) -> bool:
+        return key in self._vfs or self._parse_chunk_key(key) is not None
+
+    def __getitem__(self, key: str) -> bytes:
+        value = self._vfs.get(key)
+        if value is not None:
+            return value
+        value = self._cache.get(key)
+        if value is not None:
+            return value
+        chunk_index = self._parse_chunk_key(key)
+        if chunk_index is None:
+            raise KeyError(key)
+        value = self._compute_chunk(*chunk_index)
+        self._cache[key] = value
+        return value
+
+    def __setitem__(self, key: str, value: bytes) -> None:
+        raise TypeError(f'{type(self).__name__} is read-only')
+
+    def __delitem__(self, key: str) -> None:
+        raise TypeError(f'{type(self).__name__} is read-only')
+
+    def _compute_chunk(self, name: str, chunk_index: Tuple[int, ...]) -> bytes:
+        parent_array = self._group[name]
+        array = self._arrays[name]
+        chunks = array.chunks
+        selection = tuple(slice(i * c, (i + 1) * c) for i, c in zip(chunk_index[:-2], chunks[:-2]))
+        selection += tuple(slice(2 * i * c, 2 * (i + 1) * c) for i, c in zip(chunk_index[-2:], chunks[-2:]))
+        # Integer arrays only have fill values if they hold encoded samples
+        fill_value = parent_array.fill_value if parent_array.dtype.kind != 'f' else None
+        data = downsample(parent_array[selection], self._get_resampling(name), fill_value=fill_value)
+        if data.shape != chunks:
+            # Pad chunks at the edges
+            chunk = np.full(chunks, _fill_value(array), dtype=array.dtype)
+            chunk[tuple(slice(0, n) for n in data.shape)] = data
+            data = chunk
+        return data.astype(array.dtype, copy=False).tobytes()
+
+    def _chunk_keys(self, name: str) -> Iterator[str]:
+        for chunk_index in np.ndindex(*self._arrays[name].cdata_shape):
+            yield name + '/' + '.'.join(map(str, chunk_index))
+
+    def _get_resampling(self, name: str) -> str:
+        if isinstance(self._resampling, str):
+            return self._resampling
+        return self._resampling.get(name, DEFAULT_RESAMPLING)
+
+    def _parse_chunk_key(self, key: str) -> Optional[Tuple[str, Tuple[int, ...]]]:
+        if not isinstance(key, str):
+            return None
+        name, sep, index = key.rpartition('/')
+        array = self._arrays.get(name)
+        if not sep or array is None:
+            return None
+        try:
+            chunk_index = tuple(map(int, index.split('.')))
+        except ValueError:
+            return None
+        if len(chunk_index) != len(array.cdata_shape) \
+                or not all(0 <= i < n for i, n in zip(chunk_index, array.cdata_shape)):
+            return None
+        return name, chunk_index
+
+    def _new_vfs(self) -> Dict[str, bytes]:
+        vfs = {'.zgroup': self._parent['.zgroup']}
+        if '.zattrs' in self._parent:
+            vfs['.zattrs'] = self._parent['.zattrs']
+        # zarr lists arrays by iterating all keys of mappings, including all chunks of remote stores
+        parent_arrays = [(name, self._group[name]) for name in _list_arrays(self._parent)]
+        for name, parent_array in parent_arrays:
+            dims = parent_array.attrs.get('_ARRAY_DIMENSIONS', [])
+            zarray = json.loads(self._parent[name + '/.zarray'])
+            if dims in (['lat'], ['lon']):
+                values = downsample_coordinate(parent_array[:])
+                zarray.update(shape=[values.size], chunks=[values.size], compressor=None, filters=None)
+                vfs[name + '/0'] = values.astype(parent_array.dtype).tobytes()
+            elif dims[-2:] == _SPATIAL_DIMS:
+                shape = list(parent_array.shape[:-2]) + [(n + 1) // 2 for n in parent_array.shape[-2:]]
+                zarray.update(shape=shape, compressor=None, filters=None)
+            else:
+                # Not spatial, take it as is. Its keys follow from its metadata,
+                # listing the parent's keys would enumerate all of its chunks.
+                separator = zarray.get('dimension_separator') or '.'
+                keys = [name + '/.zarray', name + '/.zattrs']
+                keys += [name + '/' + separator.join(map(str, chunk_index))
+                         for chunk_index in np.ndindex(*parent_array.cdata_shape)]
+                for key in keys:
+                    if key in self._parent:
+                        vfs[key] = self._parent[key]
+                continue
+            vfs[name + '/.zarray'] = json.dumps(zarray, indent=2).encode('utf-8')
+            vfs[name + '/.zattrs'] = self._parent[name + '/.zattrs']
+        # Arrays whose chunks are computed
+        group = zarr.open_group(store=vfs, mode='r')
+        for name, parent_array in parent_arrays:
+            if parent_array.attrs.get('_ARRAY_DIMENSIONS', [])[-2:] == _SPATIAL_DIMS:
+                self._arrays[name] = group[name]
+        vfs['.zmetadata'] = new_consolidated_metadata(vfs)
+        return vfs
+
+
+class Pyramid:
+    """
+    A multi-resolution pyramid of Zarr stores.
+
+    Level 0 has the native resolution, every further level half the resolution
+    of the previous one. Use :meth:`from_base` to compute coarse levels locally
+    from level 0, :meth:`from_sentinel_hub` to request every level with server-side
+    downsampling, or :meth:`open`, which does the former if level 0 is available
+    locally and the latter otherwise.
+
+    :param levels: The stores of all levels, finest first.
+    """
+
+    def __init__(self, levels: Sequence[MutableMapping]):
+        if not levels:
+            raise ValueError('levels must not be empty')
+        self._levels = list(levels)
+
+    @classmethod
+    def from_base(cls,
+                  base: MutableMapping,
+                  num_levels: int = None,
+                  resampling: Union[str, Dict[str, str]] = DEFAULT_RESAMPLING) -> 'Pyramid':
+        """
+        Create a pyramid whose levels are computed from *base* on first access.
+
+        :param base: The level 0 store.
+        :param num_levels: Number of levels, by default as many as needed for
+            the coarsest level to fit into a single chunk.
+        :param resampling: The resampling method, see :class:`DownsampledStore`.
+        """
+        if num_levels is None:
+            array = _find_spatial_array(base)
+            num_levels = get_num_levels(tuple(reversed(array.shape[-2:])), tuple(reversed(array.chunks[-2:])))
+        levels = [base]
+        for _ in range(1, num_levels):
+            levels.append(DownsampledStore(levels[-1], resampling=resampling))
+        return cls(levels)
+
+    @classmethod
+    def from_sentinel_hub(cls,
+                          sentinel_hub: SentinelHub,
+                          dataset_name: str,
+                          band_names: Sequence[str],
+                          bbox: Tuple[float, float, float, float],
+                          spatial_res: float,
+                          time_range: Tuple[str, str],
+                          num_levels: int = None,
+                          downsampling: str = 'BILINEAR',
+                          **kwargs) -> 'Pyramid':
+        """
+        Create a pyramid whose levels are requested from SentinelHub using server-side *downsampling*.
+
+        Further keyword arguments are passed to :class:`SentinelHubStore`.
+        """
+        levels = []
+        while num_levels is None or len(levels) < num_levels:
+            store = SentinelHubStore(sentinel_hub, dataset_name, band_names, bbox,
+                                     spatial_res * 2 ** len(levels), time_range,
+                                     downsampling=downsampling, **kwargs)
+            levels.append(store)
+            if num_levels is None:
+                num_levels = get_num_levels(store.size, store.tile_size)
+        return cls(levels)
+
+    @classmethod
+    def open(cls,
+             sentinel_hub: SentinelHub,
+             dataset_name: str,
+             band_names: Sequence[str],
+             bbox: Tuple[float, float, float, float],
+             spatial_res: float,
+             time_range: Tuple[str, str],
+             path: str = None,
+             num_levels: int = None,
+             resampling: Union[str, Dict[str, str]] = DEFAULT_RESAMPLING,
+             downsampling: str = 'BILINEAR',
+             **kwargs) -> 'Pyramid':
+        """
+        Create a pyramid from the local level 0 cube at *path*, e.g. one written by
+        :func:`materialize`, if it exists, otherwise request every level from SentinelHub.
+        """
+        if path is not None and os.path.exists(os.path.join(path, '.zgroup')):
+            return cls.from_base(zarr.DirectoryStore(path), num_levels=num_levels, resampling=resampling)
+        return cls.from_sentinel_hub(sentinel_hub, dataset_name, band_names, bbox, spatial_res, time_range,
+                                     num_levels=num_levels, downsampling=downsampling, **kwargs)
+
+    @property
+    def num_levels(self) -> int:
+        return len(self._levels)
+
+    @property
+    def levels(self) -> List[MutableMapping]:
+        return list(self._levels)
+
+    def open_level(self, level: int) -> xr.Dataset:
+        return xr.open_zarr(self._levels[level], consolidated=False)
+
+    def write(self, path: str):
+        """Write all levels as Zarr directories "0.zarr", "1.zarr", ... into *path*."""
+        os.makedirs(path, exist_ok=True)
+        for index, level in enumerate(self._levels):
+            target = zarr.DirectoryStore(os.path.join(path, f'{index}.zarr'))
+            for key in level.keys():
+                target[key] = level[key]
+
+
+def get_num_levels(size: Tuple[int, int], tile_size: Tuple[int, int]) -> int:
+    """Get the number of levels needed for the coarsest level of an image of *size* to fit into one tile."""
+    num_tiles = max(math.ceil(size[0] / tile_size[0]), math.ceil(size[1] / tile_size[1]))
+    return 1 + max(0, math.ceil(math.log2(num_tiles)))
+
+
+def downsample(data: np.ndarray, resampling: str = DEFAULT_RESAMPLING, fill_value: int = None) -> np.ndarray:
+    """
+    Downsample the last two dimensions of *data* by a factor of two.
+
+    :param data: The data, odd sizes are allowed.
+    :param resampling: "mean" for the mean of 2 x 2 blocks, ignoring NaN values,
+        or "nearest" for the upper left value of every block.
+    :param fill_value: Optional value of integer data that marks missing values,
+        which are ignored like NaN values.
+    :return: The downsampled data of the same dtype.
+    """
+    if resampling == 'nearest':
+        return data[..., ::2, ::2]
+    if resampling != 'mean':
+        raise ValueError(f'resampling must be one of {RESAMPLING_METHODS}')
+    if data.dtype.kind != 'f' and fill_value is not None:
+        # Encoded samples, e.g. reflectances with scale factor
+        values = downsample(np.where(data == fill_value, np.nan, data), resampling)
+        return np.where(np.isnan(values), fill_value, np.round(values)).astype(data.dtype)
+    height, width = data.shape[-2:]
+    if height % 2 or width % 2:
+        # Repeat the last row or column, which does not change the block means
+        data = np.pad(data, [(0, 0)] * (data.ndim - 2) + [(0, height % 2), (0, width % 2)], mode='edge')
+    blocks = data.reshape(data.shape[:-2] + (data.shape[-2] // 2, 2, data.shape[-1] // 2, 2))
+    if data.dtype.kind == 'f':
+        valid = ~np.isnan(blocks)
+        sums = np.where(valid, blocks, 0).sum(axis=(-3, -1), dtype=np.float64)
+        counts = valid.sum(axis=(-3, -1))
+        with warnings.catch_warnings():
+            # Blocks without valid values become NaN
+            warnings.simplefilter('ignore', RuntimeWarning)
+            return (sums / counts).astype(data.dtype)
+    return np.round(blocks.mean(axis=(-3, -1))).astype(data.dtype)
+
+
+def downsample_coordinate(values: np.ndarray) -> np.ndarray:
+    """Get the pixel centers of a regular 1D coordinate after downsampling by a factor of two."""
+    res = values[1] - values[0] if values.size > 1 else 0
+    return values[::2] + res / 2
+
+
+def _list_arrays(store: MutableMapping) -> List[str]:
+    if hasattr(store, 'listdir'):
+        names = store.listdir('')
+    else:
+        # Mappings without listdir(), e.g. dicts, are scanned
+        names = set(key.split('/')[0] for key in store.keys())
+    return sorted(name for name in names if name + '/.zarray' in store)
+
+
+def _find_spatial_array(store: MutableMapping) -> zarr.Array:
+    group = zarr.open_group(store=store, mode='r')
+    for name in _list_arrays(store):
+        array = group[name]
+        if array.attrs.get('_ARRAY_DIMENSIONS', [])[-2:] == _SPATIAL_DIMS:
+            return array
+    raise ValueError('store has no variable with dimensions ("lat", "lon")')
+
+
+def _fill_value(array: zarr.Array):
+    if array.fill_value is not None:
+        return array.fill_value
+    return np.nan if array.dtype.kind == 'f' else 0
@@ -0,0 +1,250 @@
+import concurrent.futures
+import json
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+from xcube_dcfs.sentinelhub import DEFAULT_MAX_WORKERS, SentinelHub, SentinelHubError, get_result
+
+# Output size of one processing unit
+PROCESSING_UNIT_PIXELS = 512 * 512
+PROCESSING_UNIT_BANDS = 3
+MIN_PROCESSING_UNITS = 0.005
+
+_INPUT_BANDS_PATTERN = re.compile(r"bands:\s*\[([^\]]*)\]")
+_SAMPLE_TYPE_PATTERN = re.compile(r"sampleType:\s*['\"](\w+)['\"]")
+
+
+def estimate_processing_units(request: Union[Dict, bytes]) -> float:
+    """
+    Estimate the processing units SentinelHub charges for *request*.
+
+    Following SentinelHub's rules, one unit is charged for an output of 512 x 512
+    pixels and 3 input bands. The charge is proportional to the output size and
+    to the number of input bands, doubled for 32-bit float outputs, and multiplied
+    by the number of data sources. Charges for multiple acquisitions within the
+    time range cannot be known in advance and are not included.
+
+    :param request: A request as returned by :meth:`SentinelHub.new_data_request`, or its JSON encoding.
+    :return: The estimated processing units.
+    """
+    if isinstance(request, bytes):
+        request = json.loads(request)
+    output = request.get('output', {})
+    evalscript = request.get('evalscript', '')
+    num_pixels = output.get('width', 512) * output.get('height', 512)
+    input_bands = _INPUT_BANDS_PATTERN.search(evalscript)
+    num_bands = len([name for name in input_bands.group(1).split(',') if name.strip()]) if input_bands else 1
+    sample_types = set(_SAMPLE_TYPE_PATTERN.findall(evalscript))
+    num_data = max(1, len(request.get('input', {}).get('data', [])))
+    processing_units = (max(num_pixels / PROCESSING_UNIT_PIXELS, 0.01)
+                        * num_bands / PROCESSING_UNIT_BANDS
+                        * (2 if 'FLOAT32' in sample_types else 1)
+                        * num_data)
+    return max(processing_units, MIN_PROCESSING_UNITS)
+
+
+class TokenBucket:
+    """
+    A token bucket as used by SentinelHub to limit requests and processing units per minute.
+
+    The bucket holds up to *capacity* tokens and is refilled continuously at
+    *rate* tokens per minute. This class is not thread-safe.
+
+    :param rate: Number of tokens added per minute.
+    :param capacity: Maximum number of tokens, defaults to *rate*.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self._rate = rate / 60.0
+        self._capacity = capacity if capacity is not None else rate
+        self._tokens = self._capacity
+        self._time = time.monotonic()
+
+    @property
+    def rate(self) -> float:
+        """Number of tokens added per minute."""
+        return self._rate * 60.0
+
+    @property
+    def capacity(self) -> float:
+        return self._capacity
+
+    def tokens(self, now: float = None) -> float:
+        """The number of tokens available at *now*."""
+        now = time.monotonic() if now is None else now
+        return min(self._capacity, self._tokens + (now - self._time) * self._rate)
+
+    def delay(self, amount: float, now: float = None) -> float:
+        """
+        Seconds until *amount* tokens are available.
+        Amounts larger than the capacity are available once the bucket is full.
+        """
+        missing = min(amount, self._capacity) - self.tokens(now)
+        return missing / self._rate if missing > 0 else 0.0
+
+    def consume(self, amount: float, now: float = None):
+        """Take *amount* tokens. The bucket may be overdrawn, so that later requests are delayed."""
+        now = time.monotonic() if now is None else now
+        self._tokens = self.tokens(now) - amount
+        self._time = now
+
+
+class RequestScheduler:
+    """
+    Sends requests as fast as the rate limits of a SentinelHub account allow.
+
+    Requests are paced by two token buckets, one for the number of requests and
+    one for the estimated processing units per minute, so that they never exceed
+    the account's limits and are not throttled. The most expensive requests are
+    sent first, and while they wait for processing units, cheaper requests that
+    fit into the remaining budget are sent in between. So the budget is used as
+    fully as possible.
+
+    Use :meth:`estimate` to learn the number of processing units and the duration
+    of a job before starting it. The client's adaptive :class:`Throttle` still
+    handles "429 Too Many Requests" responses, e.g. if other jobs share the account.
+
+    :param sentinel_hub: The SentinelHub client.
+    :param requests_per_minute: The account's request rate limit, None for no limit.
+    :param processing_units_per_minute: The account's processing unit rate limit, None for no limit.
+    :param max_workers: Maximum number of concurrent requests.
+    :param request_burst: Number of requests that may be sent at once, defaults to *requests_per_minute*.
+    :param processing_unit_burst: Processing units that may be spent at once,
+        defaults to *processing_units_per_minute*.
+    """
+
+    def __init__(self,
+                 sentinel_hub: SentinelHub,
+                 requests_per_minute: float = None,
+                 processing_units_per_minute: float = None,
+                 max_workers: int = DEFAULT_MAX_WORKERS,
+                 request_burst: float = None,
+                 processing_unit_burst: float = None):
+        self._sentinel_hub = sentinel_hub
+        self._request_bucket = TokenBucket(requests_per_minute, capacity=request_burst) \
+            if requests_per_minute else None
+        self._unit_bucket = TokenBucket(processing_units_per_minute, capacity=processing_unit_burst) \
+            if processing_units_per_minute else None
+        self._max_workers = max_workers
+        self._lock = threading.Lock()
+        self._pending_costs: List[float] = []
+        self._processing_units = 0.0
+
+    @property
+    def processing_units(self) -> float:
+        """The estimated processing units of all requests sent so far."""
+        return self._processing_units
+
+    @property
+    def remaining(self) -> Dict[str, float]:
+        """The estimate for the requests of the running job that have not been sent yet, see :meth:`estimate`."""
+        with self._lock:
+            return self._estimate(self._pending_costs)
+
+    def estimate(self, requests: Iterable[Union[Dict, bytes]], request_time: float = None) -> Dict[str, float]:
+        """
+        Estimate the cost and duration of sending *requests*.
+
+        :param requests: The requests.
+        :param request_time: Average duration of a request in seconds, if known,
+            to take *max_workers* into account.
+        :return: The "num_requests", the estimated "processing_units", and the
+            estimated "duration" in seconds, given the current state of the rate limits.
+        """
+        with self._lock:
+            return self._estimate([estimate_processing_units(request) for request in requests], request_time)
+
+    def get_data_many(self, requests: Iterable[Dict]) \
+            -> Iterator[Tuple[int, Union[Tuple[str, Any], SentinelHubError]]]:
+        """Like :meth:`SentinelHub.get_data_many`, but paced by the rate limits."""
+        return self.run(requests, self._sentinel_hub.get_data)
+
+    def get_arrays_many(self, requests: Iterable[Dict]) \
+            -> Iterator[Tuple[int, Union[Dict[str, np.ndarray], SentinelHubError]]]:
+        """Like :meth:`SentinelHub.get_arrays_many`, but paced by the rate limits."""
+        return self.run(requests, self._sentinel_hub.get_arrays)
+
+    def run(self, data_requests: Iterable[Dict], func: Callable[[Dict], Any]) \
+            -> Iterator[Tuple[int, Union[Any, SentinelHubError]]]:
+        """
+        Call *func* for every request, paced by the rate limits.
+
+        :return: An iterator of (index, result) pairs in the order of completion, where
+            index refers to *data_requests* and result is either the return value
+            of *func* or a :class:`SentinelHubError`.
+        """
+        data_requests = list(data_requests)
+        costs = [estimate_processing_units(request) for request in data_requests]
+        # Most expensive first
+        pending = sorted(range(len(data_requests)), key=lambda i: costs[i], reverse=True)
+        with self._lock:
+            self._pending_costs = [costs[i] for i in pending]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            futures = {}
+            try:
+                while pending or futures:
+                    timeout = None
+                    if pending and len(futures) < self._max_workers:
+                        position, timeout = self._select(pending, costs)
+                        if position is not None:
+                            index = pending.pop(position)
+                            futures[executor.submit(func, data_requests[index])] = index
+                            continue
+                    if not futures:
+                        time.sleep(timeout)
+                        continue
+                    done, _ = concurrent.futures.wait(futures, timeout=timeout,
+                                                      return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        yield futures.pop(future), get_result(future)
+            finally:
+                for future in futures:
+                    future.cancel()
+                with self._lock:
+                    self._pending_costs = []
+
+    def _select(self, pending: List[int], costs: List[float]) -> Tuple[Optional[int], float]:
+        """
+        Find the position of the most expensive pending request that can be sent now
+        and take its tokens. If there is none, return the seconds until one can be sent.
+        """
+        with self._lock:
+            now = time.monotonic()
+            request_delay = self._request_bucket.delay(1, now) if self._request_bucket else 0.0
+            min_delay = None
+            if request_delay <= 0:
+                last_cost = None
+                for position, index in enumerate(pending):
+                    cost = costs[index]
+                    if cost == last_cost:
+                        # Requests of equal cost are equally affordable
+                        continue
+                    last_cost = cost
+                    unit_delay = self._unit_bucket.delay(cost, now) if self._unit_bucket else 0.0
+                    if unit_delay <= 0:
+                        if self._request_bucket:
+                            self._request_bucket.consume(1, now)
+                        if self._unit_bucket:
+                            self._unit_bucket.consume(cost, now)
+                        self._processing_units += cost
+                        del self._pending_costs[position]
+                        return position, 0.0
+                    min_delay = unit_delay if min_delay is None else min(min_delay, unit_delay)
+            return None, max(request_delay, min_delay or 0.0, 1e-3)
+
+    def _estimate(self, costs: List[float], request_time: float = None) -> Dict[str, float]:
+        now = time.monotonic()
+        num_requests = len(costs)
+        processing_units = sum(costs)
+        duration = 0.0
+        for bucket, amount in ((self._request_bucket, num_requests), (self._unit_bucket, processing_units)):
+            if bucket is not None and amount:
+                # Available tokens are used at once, the rest at the bucket's rate
+                duration = max(duration, 60.0 * max(0.0, amount - bucket.tokens(now)) / bucket.rate)
+        if request_time is not None:
+            duration = max(duration, num_requests * request_time / self._max_workers)
+        return dict(num_requests=num_requests, processing_units=processing_units, duration=duration)
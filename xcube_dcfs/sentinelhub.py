@@ -1,12 +1,45 @@
+import concurrent.futures
+import email.utils
+import io
 import json
 import os
-from typing import List, Any, Dict, Tuple, Union, Sequence
+import tarfile
+import threading
+import time
+import weakref
+from typing import List, Any, Dict, Tuple, Union, Sequence, Iterable, Iterator, Callable, Optional
 
+import numpy as np
 import oauthlib.oauth2
+import requests
 import requests_oauthlib
 
+from xcube_dcfs.auth import DEFAULT_TOKEN_CACHE_DIR, TokenManager
+from xcube_dcfs.cache import ResponseCache, request_hash
+from xcube_dcfs.decoder import decode_tar, decode_tar_memmap, decode_tar_stream
+from xcube_dcfs.encoding import BandEncoding
+from xcube_dcfs.instrument import Instrumentation, RequestRecord, TimedReader
+from xcube_dcfs.singleflight import SingleFlight
+from xcube_dcfs.template import RequestTemplate
+from xcube_dcfs.throttle import Throttle
+from xcube_dcfs.tileindex import TileIndex
+
 DEFAULT_OAUTH2_URL = 'https://services.sentinel-hub.com/oauth'
 DEFAULT_API_URL = 'https://services.sentinel-hub.com/api/v1'
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_MAX_RETRIES = 5
+
+_TAR_MIME_TYPE = 'application/tar'
+# Response header reporting the processing units charged for a request
+_PROCESSING_UNITS_HEADER = 'x-processingunits-spent'
+
+SAMPLE_TYPE_TO_DTYPE = {
+    'INT8': 'int8',
+    'UINT8': 'uint8',
+    'INT16': 'int16',
+    'UINT16': 'uint16',
+    'FLOAT32': 'float32',
+}
 
 
 class SentinelHub:
@@ -15,61 +48,374 @@ class SentinelHub:
                  client_secret=None,
                  session=None,
                  api_url=DEFAULT_API_URL,
-                 oauth2_url=DEFAULT_OAUTH2_URL):
+                 oauth2_url=DEFAULT_OAUTH2_URL,
+                 max_retries=DEFAULT_MAX_RETRIES,
+                 throttle: Throttle = None,
+                 cache: ResponseCache = None,
+                 token_manager: TokenManager = None,
+                 token_cache_dir: Optional[str] = DEFAULT_TOKEN_CACHE_DIR,
+                 singleflight: SingleFlight = None,
+                 instrumentation: Instrumentation = None,
+                 tile_index: TileIndex = None,
+                 memmap: bool = False,
+                 spool_dir: str = None):
         self.api_url = api_url
         self.oauth2_url = oauth2_url
-        if session is None:
-            # Client credentials
-            client_id = client_id or os.environ.get('SH_CLIENT_ID')
-            client_secret = client_secret or os.environ.get('SH_CLIENT_SECRET')
-
-            # Create a OAuth2 session
-            client = oauthlib.oauth2.BackendApplicationClient(client_id=client_id)
-            self.session = requests_oauthlib.OAuth2Session(client=client)
-
-            # Get OAuth2 token for the session
-            self.token = self.session.fetch_token(token_url=oauth2_url + '/token',
-                                                  client_id=client_id,
-                                                  client_secret=client_secret)
-        else:
-            self.session = session
-            self.token = None
+        self.max_retries = max_retries
+        self.throttle = throttle or Throttle()
+        self.cache = cache
+        # Coalesces identical requests in flight
+        self.singleflight = singleflight or SingleFlight()
+        # Records timings, sizes, and retries of all API calls
+        self.instrumentation = instrumentation or Instrumentation()
+        # Answers requests for previously fetched regions locally, if given
+        self.tile_index = tile_index
+        # Decode responses into memory-mapped temporary files, see get_arrays()
+        self.memmap = memmap
+        self.spool_dir = spool_dir
+        self._client_id = client_id or os.environ.get('SH_CLIENT_ID')
+        self._client_secret = client_secret or os.environ.get('SH_CLIENT_SECRET')
+        self._token_cache_dir = token_cache_dir
+        # If no session is given, it is created on first use, see session property.
+        # Clients without custom session and token manager can be pickled, see __reduce__()
+        self._from_config = session is None and token_manager is None
+        self._session = session
+        self._session_lock = threading.Lock()
+        self.token_manager = token_manager
+        self.token = None
+        if session is not None:
+            self._init_token()
+
+    def __reduce__(self):
+        # Clients are pickled as their configuration, e.g. to be sent to dask.distributed
+        # workers. Unpickling yields one client per process and configuration, whose
+        # session and token are created on first use. Run-time state is not part of
+        # the configuration, restored clients get a new throttle, singleflight and
+        # instrumentation, and no tile index.
+        if not self._from_config:
+            raise TypeError(f'cannot pickle {type(self).__name__} with a custom session or token manager')
+        config = (('client_id', self._client_id),
+                  ('client_secret', self._client_secret),
+                  ('api_url', self.api_url),
+                  ('oauth2_url', self.oauth2_url),
+                  ('max_retries', self.max_retries),
+                  ('token_cache_dir', self._token_cache_dir),
+                  ('memmap', self.memmap),
+                  ('spool_dir', self.spool_dir),
+                  ('cache', (self.cache.directory, self.cache.max_size) if self.cache is not None else None))
+        return _restore_sentinel_hub, (config,)
+
+    @property
+    def session(self):
+        """The HTTP session, created on first use."""
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    self._session = self._new_session()
+        return self._session
+
+    def _new_session(self):
+        # Get a shared OAuth2 token, which is refreshed before it expires
+        if self.token_manager is None:
+            self.token_manager = TokenManager(self._client_id, self._client_secret,
+                                              token_url=self.oauth2_url + '/token',
+                                              cache_dir=self._token_cache_dir)
+            # Stop refreshing tokens once this client is released, e.g. an unpickled one
+            weakref.finalize(self, self.token_manager.close)
+        self._init_token()
+
+        # Create a OAuth2 session
+        client = oauthlib.oauth2.BackendApplicationClient(client_id=self._client_id)
+        session = requests_oauthlib.OAuth2Session(client=client, token=self.token)
+        # Allow for as many pooled connections as concurrent requests
+        session.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=4 * DEFAULT_MAX_WORKERS))
+        return session
+
+    def _init_token(self):
+        if self.token_manager is not None:
+            self.token = self.token_manager.get_token()
+            # The token manager's refresh timer must not keep this client alive
+            self.token_manager.add_listener(_new_weak_listener(self._set_token))
 
     def close(self):
-        self.session.close()
+        if self.token_manager is not None:
+            self.token_manager.close()
+        if self._session is not None:
+            self._session.close()
 
     @property
     def token_info(self) -> Dict[str, Any]:
-        resp = self.session.get(self.oauth2_url + '/tokeninfo')
+        resp = self._get(self.oauth2_url + '/tokeninfo')
         return json.loads(resp.content)
 
     # noinspection PyMethodMayBeStatic
     @property
     def dataset_names(self) -> List[str]:
-        resp = self.session.get(self.api_url + '/process/dataset')
+        resp = self._get(self.api_url + '/process/dataset')
         obj = json.loads(resp.content)
         return obj.get('data')
 
     def band_names(self, dataset_name) -> Dict[str, Any]:
-        resp = self.session.get(self.api_url + f'/process/dataset/{dataset_name}/bands')
+        resp = self._get(self.api_url + f'/process/dataset/{dataset_name}/bands')
         obj = json.loads(resp.content)
         return obj.get('data')
 
-    def get_data(self, request: Dict) -> Tuple[str, Any]:
-        outputs = request['output']['responses']
-        accept_header = 'application/tar'  # if len(outputs) > 1 else 'image/tiff'
-        resp = self.session.post(self.api_url + f'/process', json=request,
-                                 headers={
-                                     'Accept': accept_header,
-                                     'cache-control': 'no-cache'
-                                 })
+    def get_data(self, request: Union[Dict, bytes]) -> Tuple[str, Any]:
+        """
+        Get the data for the given *request* as a TAR archive.
+
+        Concurrent calls with equivalent requests are coalesced into a single
+        HTTP request and all callers receive the same bytes object.
+
+        :param request: A request as returned by :meth:`new_data_request`,
+            or its JSON encoding as returned by :meth:`RequestTemplate.new_request_json`.
+        :return: A pair (mime_type, content).
+        """
+        request_key = _request_key(request, self.api_url)
+        data = self.singleflight.do(('data', request_key), lambda: self._get_content(request, request_key))
+        return _TAR_MIME_TYPE, data
+
+    def get_arrays(self, request: Union[Dict, bytes]) -> Dict[str, np.ndarray]:
+        """
+        Get the data for the given *request* as arrays.
+
+        In contrast to :meth:`get_data`, the response is streamed: the TAR members
+        are decoded while the response body is still being received, and the
+        complete body is never held in memory.
+
+        If this client has been created with *memmap*, the response is spooled
+        into a temporary file in *spool_dir* instead, and the arrays are
+        :class:`numpy.memmap` arrays backed by temporary files, see :func:`decode_tar_memmap`.
+        So large responses can be decoded with little memory.
+
+        If this client has a response cache, the response is not streamed
+        but read from or stored in the cache. If it has a tile index, requests
+        covered by previously fetched tiles are answered without a request,
+        and of partially covered requests only the uncovered part is requested.
+
+        Concurrent calls with equivalent requests are coalesced into a single
+        HTTP request. Their callers share the resulting arrays, which are then
+        made read-only.
+
+        :param request: A request as returned by :meth:`new_data_request`,
+            or its JSON encoding as returned by :meth:`RequestTemplate.new_request_json`.
+        :return: A mapping from band names to 2D arrays. The single output of
+            multi-band requests is returned as a 3D array of shape (band, y, x).
+        """
+        if self.tile_index is not None:
+            return self.tile_index.get_arrays(request, self._fetch_arrays)
+        return self._fetch_arrays(request)
+
+    def _fetch_arrays(self, request: Union[Dict, bytes]) -> Dict[str, np.ndarray]:
+        request_key = _request_key(request, self.api_url)
+        return self.singleflight.do(('arrays', request_key),
+                                    lambda: self._get_arrays(request, request_key),
+                                    on_shared=_set_read_only)
+
+    def _get_content(self, request: Union[Dict, bytes], request_key: str) -> bytes:
+        if self.cache is not None:
+            data = self.cache.get(request_key)
+            if data is not None:
+                return data
+        with self.instrumentation.recording('process') as record:
+            resp = self._post_data(request, record)
+            t0 = time.perf_counter()
+            data = resp.content
+            record.transfer_time = time.perf_counter() - t0
+            record.response_bytes = len(data)
+        if self.cache is not None:
+            self.cache.put(request_key, data)
+        return data
+
+    def _get_arrays(self, request: Union[Dict, bytes], request_key: str) -> Dict[str, np.ndarray]:
+        if self.cache is not None:
+            data = self._get_content(request, request_key)
+            if self.memmap:
+                return decode_tar_memmap(io.BytesIO(data), self.spool_dir)
+            return decode_tar(data)
+        with self.instrumentation.recording('process') as record:
+            resp = self._post_data(request, record)
+            try:
+                resp.raw.decode_content = True
+                reader = TimedReader(resp.raw)
+                t0 = time.perf_counter()
+                if self.memmap:
+                    arrays = decode_tar_memmap(reader, self.spool_dir)
+                else:
+                    arrays = decode_tar_stream(reader)
+                # Reading and decoding are interleaved, tell them apart
+                record.transfer_time = reader.read_time
+                record.decode_time = time.perf_counter() - t0 - reader.read_time
+                record.response_bytes = reader.num_bytes
+                return arrays
+            finally:
+                resp.close()
+
+    def get_data_many(self,
+                      requests: Iterable[Dict],
+                      max_workers: int = DEFAULT_MAX_WORKERS) \
+            -> Iterator[Tuple[int, Union[Tuple[str, Any], 'SentinelHubError']]]:
+        """
+        Get the data for many *requests* concurrently.
+
+        At most *max_workers* requests are in flight at any time, and *requests* is
+        consumed only as far as needed to keep twice as many queued, so it may be a
+        lazy iterable of many requests. All requests share this client's session and
+        throttle, so HTTP 429 responses slow down all of them.
+
+        :param requests: The requests as returned by :meth:`new_data_request`.
+        :param max_workers: Maximum number of concurrent requests.
+        :return: An iterator of (index, result) pairs in the order of completion, where
+            index refers to *requests* and result is either the return value
+            of :meth:`get_data` or a :class:`SentinelHubError`, also for connection
+            errors and responses that cannot be decoded.
+        """
+        return self._map_concurrently(self.get_data, requests, max_workers)
+
+    def get_arrays_many(self,
+                        requests: Iterable[Dict],
+                        max_workers: int = DEFAULT_MAX_WORKERS) \
+            -> Iterator[Tuple[int, Union[Dict[str, np.ndarray], 'SentinelHubError']]]:
+        """
+        Like :meth:`get_data_many`, but results are the return values of :meth:`get_arrays`.
+        """
+        return self._map_concurrently(self.get_arrays, requests, max_workers)
+
+    # noinspection PyMethodMayBeStatic
+    def _map_concurrently(self, func: Callable[[Dict], Any], data_requests: Iterable[Dict], max_workers: int):
+        items = enumerate(data_requests)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {}
+            try:
+                while True:
+                    # Keep a bounded number of requests queued
+                    while len(futures) < 2 * max_workers:
+                        item = next(items, None)
+                        if item is None:
+                            break
+                        index, request = item
+                        futures[executor.submit(func, request)] = index
+                    if not futures:
+                        break
+                    completed, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in completed:
+                        yield futures.pop(future), get_result(future)
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    def _set_token(self, token: Dict[str, Any]):
+        self.token = token
+        if self._session is not None:
+            self._session.token = token
 
-        if not resp.ok:
+    def _get(self, url: str):
+        with self.instrumentation.recording('get') as record:
+            session = self.session
+            self._check_token(record)
+            token = self.token
+            t0 = time.perf_counter()
+            try:
+                resp = session.get(url)
+            except oauthlib.oauth2.TokenExpiredError:
+                # Expired before it could be sent
+                if not self._refresh_token(token, record):
+                    raise
+                resp = None
+            if resp is None or (resp.status_code == 401 and self._refresh_token(token, record)):
+                record.retries += 1
+                t0 = time.perf_counter()
+                resp = session.get(url)
+            record.ttfb = time.perf_counter() - t0
+            record.status_code = resp.status_code
+            record.response_bytes = len(resp.content)
+        return resp
+
+    def _check_token(self, record: RequestRecord):
+        # OAuth2Session refuses to send expired tokens, so replace tokens about to expire
+        # before sending a request, e.g. if their background refresh has failed
+        if self.token_manager is None:
+            return
+        t0 = time.perf_counter()
+        token = self.token_manager.get_token()
+        record.token_time += time.perf_counter() - t0
+        if token is not self.token:
+            self._set_token(token)
+
+    def _refresh_token(self, expired_token: Optional[Dict[str, Any]], record: RequestRecord) -> bool:
+        if self.token_manager is None:
+            return False
+        t0 = time.perf_counter()
+        self.token_manager.refresh_token(expired_token)
+        record.token_time += time.perf_counter() - t0
+        return True
+
+    def _post_data(self, request: Union[Dict, bytes], record: RequestRecord):
+        """
+        Post a process *request* and fill in the *record*.
+
+        The response is streamed, the caller must read or close it.
+        """
+        headers = {
+            'Accept': _TAR_MIME_TYPE,
+            'cache-control': 'no-cache'
+        }
+        if isinstance(request, bytes):
+            # Pre-serialized, see RequestTemplate.new_request_json()
+            headers['Content-Type'] = 'application/json'
+            body = dict(data=request)
+            record.request_bytes = len(request)
+        else:
+            body = dict(json=request)
+        session = self.session
+        num_retries = 0
+        token_refreshed = False
+        while True:
+            t0 = time.perf_counter()
+            self.throttle.wait()
+            t1 = time.perf_counter()
+            self._check_token(record)
+            token = self.token
+            try:
+                resp = session.post(self.api_url + f'/process', **body,
+                                    stream=True,
+                                    headers=headers)
+            except oauthlib.oauth2.TokenExpiredError:
+                # Expired before it could be sent
+                if token_refreshed or not self._refresh_token(token, record):
+                    raise
+                token_refreshed = True
+                record.retries += 1
+                continue
+            t2 = time.perf_counter()
+            record.throttle_time += t1 - t0
+            record.ttfb = t2 - t1
+            if resp.status_code == 401 and not token_refreshed and self._refresh_token(token, record):
+                # The token has expired, retry once with a new one
+                resp.close()
+                token_refreshed = True
+                record.retries += 1
+                continue
+            if resp.status_code != 429 or num_retries >= self.max_retries:
+                break
+            self.throttle.on_throttled(get_retry_after(resp))
+            record.throttle_time += time.perf_counter() - t2
+            resp.close()
+            num_retries += 1
+            record.retries += 1
+
+        record.status_code = resp.status_code
+        if not record.request_bytes:
+            record.request_bytes = _get_request_body_size(resp)
+        record.processing_units = get_processing_units(resp)
+        if resp.ok:
+            self.throttle.on_success()
+        else:
             raise SentinelHubError(resp.reason,
                                    status_code=resp.status_code,
                                    content=resp.content)
 
-        return accept_header, resp.content
+        return resp
 
     @classmethod
     def new_data_request(cls,
@@ -81,104 +427,90 @@ class SentinelHub:
                          upsampling: str = 'BILINEAR',
                          downsampling: str = 'BILINEAR',
                          band_units: Union[str, Sequence[str]] = 'reflectance',
-                         sample_types: Union[str, Sequence[str]] = 'FLOAT32') -> Dict:
+                         sample_types: Union[str, Sequence[str]] = 'FLOAT32',
+                         multi_band: bool = False,
+                         expressions: Dict[str, str] = None,
+                         temporal_reducer: str = None,
+                         encodings: Dict[str, BandEncoding] = None) -> Dict:
+        template = RequestTemplate(dataset_name,
+                                   band_names,
+                                   upsampling=upsampling,
+                                   downsampling=downsampling,
+                                   band_units=band_units,
+                                   sample_types=sample_types,
+                                   multi_band=multi_band,
+                                   expressions=expressions,
+                                   temporal_reducer=temporal_reducer,
+                                   encodings=encodings)
+        return template.new_request(size, time_range=time_range, bbox=bbox)
 
-        if bbox is None:
-            bbox = [-180., -90., 180., 90.]
 
-        if isinstance(band_units, str):
-            band_units = [band_units] * len(band_names)
+# Unpickled clients, shared as long as they are in use. The configurations
+# include credentials, so they must not be kept beyond their clients.
+_RESTORED_CLIENTS: 'weakref.WeakValueDictionary[Tuple, SentinelHub]' = weakref.WeakValueDictionary()
+_RESTORED_CLIENTS_LOCK = threading.Lock()
 
-        if isinstance(sample_types, str):
-            sample_types = [sample_types] * len(band_names)
 
-        data_element = {
-            "type": dataset_name,
-            "processing": {
-                "upsampling": upsampling,
-                "downsampling": downsampling
-            },
-        }
+def _restore_sentinel_hub(config: Tuple[Tuple[str, Any], ...]) -> 'SentinelHub':
+    with _RESTORED_CLIENTS_LOCK:
+        sentinel_hub = _RESTORED_CLIENTS.get(config)
+        if sentinel_hub is None:
+            kwargs = dict(config)
+            cache = kwargs.pop('cache')
+            sentinel_hub = SentinelHub(cache=ResponseCache(*cache) if cache is not None else None, **kwargs)
+            _RESTORED_CLIENTS[config] = sentinel_hub
+        return sentinel_hub
 
-        if time_range is not None:
-            time_range_from, time_range_to = time_range
-            time_range_element = {}
-            if time_range_from:
-                time_range_element['from'] = str(time_range_from)
-            if time_range_to:
-                time_range_element['to'] = str(time_range_to)
-            data_element["dataFilter"] = dict(timeRange=time_range_element)
-
-        input_element = {
-            "bounds": {
-                "bbox": bbox,
-                "properties": {
-                    "crs": "http://www.opengis.net/def/crs/OGC/9.5.3/CRS84"
-                }
-            },
-            "data": [data_element]
-        }
 
-        width, height = size
-        responses_element = []
-
-        for band_name in band_names:
-            responses_element.append({
-                "identifier": band_name,
-                "format": {
-                    "type": "image/tiff"
-                }
-            })
-
-        output_element = {
-            "width": width,
-            "height": height,
-            "responses": responses_element
-        }
+def _new_weak_listener(method: Callable[[Dict[str, Any]], None]) -> Callable[[Dict[str, Any]], None]:
+    method_ref = weakref.WeakMethod(method)
+
+    def listener(token: Dict[str, Any]):
+        bound_method = method_ref()
+        if bound_method is not None:
+            bound_method(token)
+
+    return listener
 
-        evalscript = []
-        evalscript.extend([
-            "//VERSION=3",
-            "function setup() {",
-            "    return {",
-            "        input: [{",
-            "            bands: [" + ", ".join(map(repr, band_names)) + "],",
-            "            units: [" + ", ".join(map(repr, band_units)) + "],",
-            "        }],",
-            "        output: [",
-        ])
-        evalscript.extend(["            {id: " + repr(band_name) + ", bands: 1, sampleType: " + repr(sample_type) + "},"
-                           for band_name, sample_type in zip(band_names, sample_types)])
-        evalscript.extend([
-            "        ]",
-            "    };",
-            "}"
-        ])
-        # if len(band_names) > 1:
-        if len(band_names) > 0:
-            evalscript.extend([
-                "function evaluatePixel(sample) {",
-                "    return {",
-            ])
-            evalscript.extend(["        " + band_name + ": [sample." + band_name + "]," for band_name in band_names])
-            evalscript.extend([
-                "    };",
-                "}",
-            ])
-        else:
-            # Doesn't work, buts docs say so: https://docs.sentinel-hub.com/api/latest/#/Evalscript/V3/README
-            evalscript.extend([
-                "function evaluatePixel(sample) {",
-                "    return [sample." + band_names[0] + "];",
-                "}",
-            ])
 
-        # Convert into valid JSON
-        return json.loads(json.dumps({
-            "input": input_element,
-            "output": output_element,
-            "evalscript": "\n".join(evalscript)
-        }))
+def _request_key(request: Union[Dict, bytes], api_url: str) -> str:
+    # Services sharing a cache directory must not answer each other's requests
+    return request_hash(json.loads(request) if isinstance(request, bytes) else request, api_url=api_url)
+
+
+def _set_read_only(arrays: Dict[str, np.ndarray]):
+    for array in arrays.values():
+        array.flags.writeable = False
+
+
+def _get_request_body_size(resp) -> int:
+    prepared_request = getattr(resp, 'request', None)
+    body = getattr(prepared_request, 'body', None)
+    return len(body) if body else 0
+
+
+def get_processing_units(resp) -> Optional[float]:
+    """Get the processing units charged for a request from its response *resp*, if reported."""
+    value = resp.headers.get(_PROCESSING_UNITS_HEADER)
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+def get_retry_after(resp) -> Optional[float]:
+    """Get the seconds to wait before retrying, as given by the "Retry-After" header of response *resp*."""
+    value = resp.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
 
 
 class SentinelHubError(Exception):
@@ -196,3 +528,24 @@ class SentinelHubError(Exception):
         if self.content:
             text += f':\n{self.content}\n'
         return text
+
+
+# Errors of single requests, which batches return as results rather than raise: HTTP and
+# connection errors, tokens expired before sending, and corrupt responses, which fail to
+# decode with tarfile.TarError or, for corrupt images, a ValueError
+REQUEST_ERRORS = (SentinelHubError, requests.RequestException, OSError, oauthlib.oauth2.TokenExpiredError,
+                  tarfile.TarError, ValueError)
+
+
+def get_result(future: concurrent.futures.Future) -> Any:
+    """
+    Get the result of a completed *future* of a single request.
+
+    :return: The result, or the request's error as :class:`SentinelHubError`, if it is one of :data:`REQUEST_ERRORS`.
+    """
+    try:
+        return future.result()
+    except SentinelHubError as error:
+        return error
+    except REQUEST_ERRORS as error:
+        return SentinelHubError(str(error) or type(error).__name__, status_code=None)
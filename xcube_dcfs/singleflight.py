@@ -0,0 +1,83 @@
+import threading
+from typing import Any, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into a single call.
+
+    The first caller for a key executes the function, callers arriving with
+    the same key while it is in flight wait for and receive the very same
+    result object, or the same exception. Once the call has completed, the
+    next caller for the key starts a new call, so results are never cached.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._num_calls = 0
+        self._num_coalesced = 0
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Number of executed calls, of coalesced calls, and of calls currently in flight."""
+        with self._lock:
+            return dict(calls=self._num_calls,
+                        coalesced=self._num_coalesced,
+                        in_flight=len(self._calls))
+
+    def do(self,
+           key: Hashable,
+           func: Callable[[], Any],
+           on_shared: Callable[[Any], None] = None) -> Any:
+        """
+        Call *func* unless a call with the same *key* is in flight, in which
+        case wait for that call and return its result.
+
+        :param key: The key identifying equivalent calls.
+        :param func: The function to be called.
+        :param on_shared: Optional function called with the result before it is
+            handed out if other callers have been coalesced into this call.
+        :return: The result of *func*.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+                self._num_calls += 1
+                leader = True
+            else:
+                call.num_waiters += 1
+                self._num_coalesced += 1
+                leader = False
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                num_waiters = call.num_waiters
+            try:
+                if num_waiters and call.error is None and on_shared is not None:
+                    on_shared(call.result)
+            finally:
+                call.event.set()
+        return call.result
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.num_waiters = 0
+        self.result = None
+        self.error = None
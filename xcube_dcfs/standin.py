@@ -0,0 +1,252 @@
+import functools
+import io
+import json
+import re
+import tarfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+import tifffile
+
+from xcube_dcfs.sentinelhub import SAMPLE_TYPE_TO_DTYPE
+
+DEFAULT_DATASETS = {
+    'S2L1C': ['B01', 'B02', 'B03', 'B04', 'B05', 'B06', 'B07', 'B08', 'B8A', 'B09', 'B10', 'B11', 'B12'],
+    'S2L2A': ['B01', 'B02', 'B03', 'B04', 'B05', 'B06', 'B07', 'B08', 'B8A', 'B09', 'B11', 'B12', 'SCL'],
+    'DEM': ['DEM'],
+}
+
+_OUTPUT_PATTERN = re.compile(r"\{id: '([^']+)', bands: (\d+), sampleType: '([A-Z0-9]+)'\}")
+_CHUNK_SIZE = 64 * 1024
+
+
+class SentinelHubStandIn:
+    """
+    A local HTTP server that stands in for the SentinelHub service.
+
+    It implements the OAuth2 "/oauth/token" and "/oauth/tokeninfo" endpoints as well as
+    the "/api/v1/process/dataset", "/api/v1/process/dataset/{name}/bands", and
+    "/api/v1/process" endpoints. Process requests are answered with TAR archives
+    of synthetic TIFF images of the requested size, bands, and sample types.
+    Network conditions can be simulated using *latency*, *bandwidth*, and
+    *throttle_every*.
+
+    Clients must allow OAuth2 over plain HTTP by setting the environment
+    variable ``OAUTHLIB_INSECURE_TRANSPORT=1``.
+
+    :param host: Host name to bind to.
+    :param port: Port to bind to, 0 picks a free port.
+    :param datasets: Mapping from dataset names to band names.
+    :param latency: Seconds to wait before responding to a process request.
+    :param bandwidth: Maximum bytes per second sent for each process response, ``None`` means unlimited.
+    :param throttle_every: If given, every n-th process request is rejected with HTTP 429.
+    :param retry_after: Value of the "Retry-After" header of HTTP 429 responses in seconds.
+    :param token_lifetime: Lifetime of issued tokens in seconds.
+    """
+
+    def __init__(self,
+                 host: str = '127.0.0.1',
+                 port: int = 0,
+                 datasets: Dict[str, List[str]] = None,
+                 latency: float = 0.0,
+                 bandwidth: float = None,
+                 throttle_every: int = None,
+                 retry_after: float = 0.0,
+                 token_lifetime: float = 3600.0):
+        self.datasets = dict(datasets or DEFAULT_DATASETS)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self.token_lifetime = token_lifetime
+        self._lock = threading.Lock()
+        self._counters = dict(token_requests=0, process_requests=0, throttled_requests=0, bytes_sent=0)
+        self._server = ThreadingHTTPServer((host, port), _new_handler_class(self))
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def api_url(self) -> str:
+        return self.url + '/api/v1'
+
+    @property
+    def oauth2_url(self) -> str:
+        return self.url + '/oauth'
+
+    @property
+    def counters(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+    def start(self) -> 'SentinelHubStandIn':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self) -> 'SentinelHubStandIn':
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _count(self, name: str, value: int = 1) -> int:
+        with self._lock:
+            self._counters[name] += value
+            return self._counters[name]
+
+
+def new_tar_response(width: int, height: int, outputs: Sequence[Tuple[str, int, str]]) -> bytes:
+    """
+    Create the content of a process response with synthetic images.
+
+    :param width: Image width.
+    :param height: Image height.
+    :param outputs: Sequence of (identifier, num_bands, sample_type) triples.
+    :return: A TAR archive with a TIFF file for each output.
+    """
+    return _new_tar_response(int(width), int(height), tuple(tuple(output) for output in outputs))
+
+
+@functools.lru_cache(maxsize=32)
+def _new_tar_response(width: int, height: int, outputs: Tuple[Tuple[str, int, str], ...]) -> bytes:
+    fp = io.BytesIO()
+    with tarfile.open(fileobj=fp, mode='w') as tar:
+        for index, (identifier, num_bands, sample_type) in enumerate(outputs):
+            data = _new_image(width, height, num_bands, np.dtype(SAMPLE_TYPE_TO_DTYPE[sample_type]), index)
+            tiff_fp = io.BytesIO()
+            if num_bands > 1:
+                tifffile.imwrite(tiff_fp, data, photometric='minisblack', planarconfig='separate')
+            else:
+                tifffile.imwrite(tiff_fp, data[0])
+            info = tarfile.TarInfo(identifier + '.tif')
+            info.size = tiff_fp.tell()
+            tiff_fp.seek(0)
+            tar.addfile(info, tiff_fp)
+    return fp.getvalue()
+
+
+def _new_image(width: int, height: int, num_bands: int, dtype: np.dtype, index: int) -> np.ndarray:
+    y, x = np.mgrid[0:height, 0:width]
+    bands = [(x + y + 10 * (index + i)) % 100 for i in range(num_bands)]
+    data = np.stack(bands)
+    if dtype.kind == 'f':
+        return (data / 100.).astype(dtype)
+    return data.astype(dtype)
+
+
+def _parse_outputs(request: Dict) -> List[Tuple[str, int, str]]:
+    outputs = {identifier: (identifier, int(num_bands), sample_type)
+               for identifier, num_bands, sample_type in _OUTPUT_PATTERN.findall(request.get('evalscript', ''))}
+    return [outputs.get(response['identifier'], (response['identifier'], 1, 'FLOAT32'))
+            for response in request['output']['responses']]
+
+
+def _new_handler_class(stand_in: SentinelHubStandIn):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        # noinspection PyPep8Naming
+        def do_GET(self):
+            path = self.path.split('?')[0]
+            if path == '/oauth/tokeninfo':
+                self._send_json(dict(sub=str(uuid.uuid4()), exp=int(time.time() + stand_in.token_lifetime),
+                                     active=True))
+            elif path == '/api/v1/process/dataset':
+                self._send_json(dict(data=list(stand_in.datasets.keys())))
+            elif path.startswith('/api/v1/process/dataset/') and path.endswith('/bands'):
+                dataset_name = path[len('/api/v1/process/dataset/'):-len('/bands')]
+                if dataset_name not in stand_in.datasets:
+                    self._send_error(404, 'Not Found', f'dataset {dataset_name!r} not found')
+                else:
+                    self._send_json(dict(data=stand_in.datasets[dataset_name]))
+            else:
+                self._send_error(404, 'Not Found', f'no such endpoint {path!r}')
+
+        # noinspection PyPep8Naming
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            path = self.path.split('?')[0]
+            if path == '/oauth/token':
+                stand_in._count('token_requests')
+                self._send_json(dict(access_token=uuid.uuid4().hex,
+                                     token_type='Bearer',
+                                     expires_in=stand_in.token_lifetime))
+            elif path == '/api/v1/process':
+                self._process(body)
+            else:
+                self._send_error(404, 'Not Found', f'no such endpoint {path!r}')
+
+        def _process(self, body: bytes):
+            count = stand_in._count('process_requests')
+            if stand_in.throttle_every and count % stand_in.throttle_every == 0:
+                stand_in._count('throttled_requests')
+                self._send_error(429, 'Too Many Requests', 'rate limit exceeded',
+                                 headers={'Retry-After': str(stand_in.retry_after)})
+                return
+            try:
+                request = json.loads(body)
+                width = request['output']['width']
+                height = request['output']['height']
+                outputs = _parse_outputs(request)
+            except (ValueError, KeyError, TypeError) as error:
+                self._send_error(400, 'Bad Request', f'invalid request: {error}')
+                return
+            content = new_tar_response(width, height, outputs)
+            if stand_in.latency > 0:
+                time.sleep(stand_in.latency)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/tar')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self._write_throttled(content)
+            stand_in._count('bytes_sent', len(content))
+
+        def _write_throttled(self, content: bytes):
+            view = memoryview(content)
+            start_time = time.perf_counter()
+            for offset in range(0, len(view), _CHUNK_SIZE):
+                self.wfile.write(view[offset: offset + _CHUNK_SIZE])
+                if stand_in.bandwidth:
+                    delay = (offset + _CHUNK_SIZE) / stand_in.bandwidth - (time.perf_counter() - start_time)
+                    if delay > 0:
+                        time.sleep(delay)
+
+        def _send_json(self, obj, status: int = 200):
+            content = json.dumps(obj).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def _send_error(self, status: int, reason: str, message: str, headers: Dict[str, str] = None):
+            content = json.dumps(dict(error=dict(status=status, reason=reason, message=message))).encode('utf-8')
+            self.send_response(status, reason)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        # noinspection PyShadowingBuiltins
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
@@ -0,0 +1,388 @@
+import json
+import threading
+from collections.abc import MutableMapping
+from typing import Callable, Iterable, Iterator, List, Sequence, Tuple, Union, Dict, Any
+
+import numpy as np
+import pandas as pd
+
+from xcube_dcfs.encoding import BandEncoding
+from xcube_dcfs.sentinelhub import SentinelHub, SAMPLE_TYPE_TO_DTYPE
+from xcube_dcfs.template import RequestTemplate
+from xcube_dcfs.tiling import TileGrid
+
+_TIME_UNITS = "seconds since 1970-01-01T00:00:00"
+_TIME_CALENDAR = "proleptic_gregorian"
+
+BBox = Tuple[float, float, float, float]
+TimeRange = Tuple[pd.Timestamp, pd.Timestamp]
+
+
+class SentinelHubStore(MutableMapping):
+    """
+    A read-only Zarr store that represents a SentinelHub dataset as a data cube.
+
+    Zarr metadata (".zgroup", ".zattrs", ".zarray") is synthesized from the given
+    parameters, so opening the store does not require any request. It is also
+    served as consolidated metadata ".zmetadata", so that
+    ``xr.open_zarr(store, consolidated=True)`` reads it with a single lookup. Every chunk key
+    of a band variable, e.g. "B04/3.0.7", is translated into exactly one tile
+    request, which is sent only when the chunk is read.
+
+    If a *coverage* function is given, chunks of tiles and time steps without
+    acquisitions are served as chunks of fill values without any request.
+    The numbers of avoided requests and their bytes are reported by :attr:`stats`.
+    Pixels without data are requested as NaN in floating point bands and as fill
+    values in encoded bands, like the values of the chunks served without requests.
+
+    :param sentinel_hub: The SentinelHub client.
+    :param dataset_name: Dataset name, e.g. "S2L1C".
+    :param band_names: Names of the bands to be provided as variables.
+    :param bbox: Bounding box (x1, y1, x2, y2) in CRS84 coordinates.
+    :param spatial_res: Spatial resolution in degrees.
+    :param time_range: Time range (start, end) of the cube.
+    :param time_period: Duration of each time step, a pandas frequency string.
+    :param tile_size: Spatial chunk size (width, height) in pixels.
+    :param band_units: Band units, either one for all bands or one per band.
+    :param sample_types: Sample types, either one for all bands or one per band.
+    :param upsampling: Upsampling method used if *spatial_res* is finer than the dataset's resolution.
+    :param downsampling: Downsampling method used if *spatial_res* is coarser than the dataset's resolution.
+    :param encodings: Optional mapping from band names to encodings, see :func:`plan_encodings`.
+        Such bands are requested as compact samples, which replace the given sample types,
+        and described by the CF attributes "scale_factor", "add_offset", and "_FillValue",
+        so that xarray decodes them.
+    :param coverage: Optional function that tells whether there are acquisitions within a
+        bounding box and time range, e.g. one returned by :func:`new_acquisition_coverage`.
+    """
+
+    def __init__(self,
+                 sentinel_hub: SentinelHub,
+                 dataset_name: str,
+                 band_names: Sequence[str],
+                 bbox: Tuple[float, float, float, float],
+                 spatial_res: float,
+                 time_range: Tuple[str, str],
+                 time_period: str = '1D',
+                 tile_size: Tuple[int, int] = (512, 512),
+                 band_units: Union[str, Sequence[str]] = 'reflectance',
+                 sample_types: Union[str, Sequence[str]] = 'FLOAT32',
+                 upsampling: str = 'BILINEAR',
+                 downsampling: str = 'BILINEAR',
+                 encodings: Dict[str, BandEncoding] = None,
+                 coverage: Callable[[BBox, TimeRange], bool] = None):
+        if isinstance(band_units, str):
+            band_units = [band_units] * len(band_names)
+        if isinstance(sample_types, str):
+            sample_types = [sample_types] * len(band_names)
+
+        self._sentinel_hub = sentinel_hub
+        self._dataset_name = dataset_name
+        self._band_names = list(band_names)
+        self._band_units = dict(zip(band_names, band_units))
+        self._encodings = {band_name: encoding for band_name, encoding in (encodings or {}).items()
+                           if band_name in self._band_units and not encoding.is_identity}
+        self._grid = TileGrid(bbox, spatial_res, tile_size)
+        self._templates = {band_name: RequestTemplate(dataset_name,
+                                                      [band_name],
+                                                      band_units=[self._band_units[band_name]],
+                                                      sample_types=[sample_type],
+                                                      upsampling=upsampling,
+                                                      downsampling=downsampling,
+                                                      encodings=encodings,
+                                                      fill_no_data=True)
+                           for band_name, sample_type in zip(band_names, sample_types)}
+        self._sample_types = {band_name: template.sample_types[0] for band_name, template in self._templates.items()}
+        self._time_ranges = split_time_range(time_range, time_period)
+        self._coverage = coverage
+        # Whether tiles have acquisitions, by (time_index, tile_y, tile_x)
+        self._covered: Dict[Tuple[int, int, int], bool] = {}
+        self._lock = threading.Lock()
+        self._num_requests = 0
+        self._num_avoided_requests = 0
+        self._num_avoided_bytes = 0
+
+        self._vfs = self._new_vfs()
+
+    @property
+    def dataset_name(self) -> str:
+        return self._dataset_name
+
+    @property
+    def band_names(self) -> List[str]:
+        return list(self._band_names)
+
+    @property
+    def grid(self) -> TileGrid:
+        return self._grid
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return self._grid.size
+
+    @property
+    def tile_size(self) -> Tuple[int, int]:
+        return self._grid.tile_size
+
+    @property
+    def time_ranges(self) -> List[Tuple[pd.Timestamp, pd.Timestamp]]:
+        return list(self._time_ranges)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Numbers of sent tile requests, of requests avoided because tiles had no acquisitions, and of their bytes."""
+        with self._lock:
+            return dict(requests=self._num_requests,
+                        avoided_requests=self._num_avoided_requests,
+                        avoided_bytes=self._num_avoided_bytes)
+
+    def is_covered(self, time_index: int, tile_y: int, tile_x: int) -> bool:
+        """Whether the tile with row *tile_y* and column *tile_x* may have acquisitions at time step *time_index*."""
+        if self._coverage is None:
+            return True
+        key = time_index, tile_y, tile_x
+        with self._lock:
+            covered = self._covered.get(key)
+        if covered is None:
+            covered = bool(self._coverage(self.tile_bbox(tile_x, tile_y), self._time_ranges[time_index]))
+            with self._lock:
+                self._covered[key] = covered
+        return covered
+
+    def metadata_keys(self) -> Iterator[str]:
+        """Get the keys of the synthesized metadata and coordinate data, i.e. all keys but the band chunks."""
+        return iter(self._vfs.keys())
+
+    def chunk_keys(self, band_name: str) -> Iterator[str]:
+        num_tiles_x, num_tiles_y = self._grid.num_tiles
+        for t in range(len(self._time_ranges)):
+            for y in range(num_tiles_y):
+                for x in range(num_tiles_x):
+                    yield f'{band_name}/{t}.{y}.{x}'
+
+    def tile_bbox(self, tile_x: int, tile_y: int) -> Tuple[float, float, float, float]:
+        """Get the bounding box of the tile with column *tile_x* and row *tile_y*, rows start in the north."""
+        return self._grid.tile(tile_x, tile_y).bbox
+
+    def new_tile_request(self, band_name: str, time_index: int, tile_y: int, tile_x: int) -> Dict:
+        tile = self._grid.tile(tile_x, tile_y)
+        time_start, time_end = self._time_ranges[time_index]
+        return self._templates[band_name].new_request((tile.width, tile.height),
+                                                      time_range=(format_time(time_start), format_time(time_end)),
+                                                      bbox=tile.bbox)
+
+    def listdir(self, path: str = '') -> List[str]:
+        # Only enumerate the chunk keys of a listed band, there may be millions in total
+        path = path.rstrip('/')
+        prefix = path + '/' if path else ''
+        entries = [key[len(prefix):] for key in self._vfs.keys() if key.startswith(prefix)]
+        if path in self._band_names:
+            entries.extend(key[len(prefix):] for key in self.chunk_keys(path))
+        return sorted(set(entry.split('/')[0] for entry in entries))
+
+    def __len__(self) -> int:
+        return len(self._vfs) + len(self._band_names) * len(self._time_ranges) * len(self._grid)
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self._vfs.keys()
+        for band_name in self._band_names:
+            yield from self.chunk_keys(band_name)
+
+    def __contains__(self, key) -> bool:
+        return key in self._vfs or self._parse_chunk_key(key) is not None
+
+    def __getitem__(self, key: str) -> bytes:
+        value = self._vfs.get(key)
+        if value is not None:
+            return value
+        chunk_index = self._parse_chunk_key(key)
+        if chunk_index is None:
+            raise KeyError(key)
+        band_name, time_index, tile_y, tile_x = chunk_index
+        return self._fetch_chunk(band_name, time_index, tile_y, tile_x)
+
+    def __setitem__(self, key: str, value: bytes) -> None:
+        raise TypeError(f'{type(self).__name__} is read-only')
+
+    def __delitem__(self, key: str) -> None:
+        raise TypeError(f'{type(self).__name__} is read-only')
+
+    def _fetch_chunk(self, band_name: str, time_index: int, tile_y: int, tile_x: int) -> bytes:
+        tile_width, tile_height = self._grid.tile_size
+        dtype = np.dtype(SAMPLE_TYPE_TO_DTYPE[self._sample_types[band_name]])
+        if not self.is_covered(time_index, tile_y, tile_x):
+            tile = self._grid.tile(tile_x, tile_y)
+            with self._lock:
+                self._num_avoided_requests += 1
+                self._num_avoided_bytes += tile.width * tile.height * dtype.itemsize
+            return np.full((tile_height, tile_width), self._get_fill_value(band_name), dtype=dtype).tobytes()
+
+        request = self.new_tile_request(band_name, time_index, tile_y, tile_x)
+        with self._lock:
+            self._num_requests += 1
+        band_data = self._sentinel_hub.get_arrays(request)[band_name]
+
+        if band_data.shape != (tile_height, tile_width):
+            # Pad chunks at the right and bottom edges
+            chunk = np.full((tile_height, tile_width), self._get_fill_value(band_name), dtype=dtype)
+            chunk[0:band_data.shape[0], 0:band_data.shape[1]] = band_data
+            band_data = chunk
+        return band_data.astype(dtype, copy=False).tobytes()
+
+    def _get_fill_value(self, band_name: str):
+        encoding = self._encodings.get(band_name)
+        if encoding is not None and encoding.fill_value is not None:
+            return encoding.fill_value
+        return _fill_value(np.dtype(SAMPLE_TYPE_TO_DTYPE[self._sample_types[band_name]]))
+
+    def _parse_chunk_key(self, key: str):
+        if not isinstance(key, str):
+            return None
+        band_name, sep, index = key.partition('/')
+        if not sep or band_name not in self._sample_types:
+            return None
+        try:
+            time_index, tile_y, tile_x = map(int, index.split('.'))
+        except ValueError:
+            return None
+        num_tiles_x, num_tiles_y = self._grid.num_tiles
+        if not (0 <= time_index < len(self._time_ranges) and 0 <= tile_y < num_tiles_y and 0 <= tile_x < num_tiles_x):
+            return None
+        return band_name, time_index, tile_y, tile_x
+
+    def _new_vfs(self) -> Dict[str, bytes]:
+        x1, y1, x2, y2 = self._grid.bbox
+        width, height = self._grid.size
+        tile_width, tile_height = self._grid.tile_size
+        num_times = len(self._time_ranges)
+
+        lon_data = self._grid.lon_values()
+        lat_data = self._grid.lat_values()
+        epoch = pd.Timestamp('1970-01-01')
+        time_data = np.array([((start + (end - start) / 2) - epoch) // pd.Timedelta(seconds=1)
+                              for start, end in self._time_ranges], dtype=np.int64)
+
+        vfs = {
+            '.zgroup': _to_json({'zarr_format': 2}),
+            '.zattrs': _to_json({
+                'Conventions': 'CF-1.7',
+                'title': f'{self._dataset_name} Data Cube',
+                'time_coverage_start': format_time(self._time_ranges[0][0]),
+                'time_coverage_end': format_time(self._time_ranges[-1][1]),
+                'geospatial_lon_min': x1,
+                'geospatial_lon_max': x2,
+                'geospatial_lon_units': 'degrees_east',
+                'geospatial_lat_min': y1,
+                'geospatial_lat_max': y2,
+                'geospatial_lat_units': 'degrees_north',
+            }),
+        }
+
+        def add_array(name: str, dims: List[str], shape: List[int], chunks: List[int], dtype: np.dtype,
+                      attrs: Dict[str, Any], data: np.ndarray = None, fill_value=None):
+            vfs[name + '/.zarray'] = _to_json({
+                'zarr_format': 2,
+                'shape': shape,
+                'chunks': chunks,
+                'dtype': dtype.str,
+                'compressor': None,
+                'fill_value': fill_value if fill_value is not None else _fill_value_json(dtype),
+                'filters': None,
+                'order': 'C',
+            })
+            vfs[name + '/.zattrs'] = _to_json(dict(_ARRAY_DIMENSIONS=dims, **attrs))
+            if data is not None:
+                vfs[name + '/0'] = data.tobytes()
+
+        add_array('lon', ['lon'], [width], [width], lon_data.dtype,
+                  dict(units='degrees_east', standard_name='longitude'), lon_data)
+        add_array('lat', ['lat'], [height], [height], lat_data.dtype,
+                  dict(units='degrees_north', standard_name='latitude'), lat_data)
+        add_array('time', ['time'], [num_times], [num_times], time_data.dtype,
+                  dict(units=_TIME_UNITS, calendar=_TIME_CALENDAR, standard_name='time'), time_data)
+        for band_name in self._band_names:
+            dtype = np.dtype(SAMPLE_TYPE_TO_DTYPE[self._sample_types[band_name]])
+            attrs = dict(units=self._band_units[band_name])
+            fill_value = None
+            encoding = self._encodings.get(band_name)
+            if encoding is not None:
+                # The array's fill value is the variable's "_FillValue"
+                attrs.update(encoding.attrs)
+                fill_value = attrs.pop('_FillValue', None)
+            add_array(band_name, ['time', 'lat', 'lon'], [num_times, height, width], [1, tile_height, tile_width],
+                      dtype, attrs, fill_value=fill_value)
+        vfs['.zmetadata'] = new_consolidated_metadata(vfs)
+        return vfs
+
+
+def new_consolidated_metadata(store: Dict[str, bytes]) -> bytes:
+    """Create the content of the ".zmetadata" key, which consolidates all metadata of the Zarr *store*."""
+    metadata = {key: json.loads(value) for key, value in store.items()
+                if key.rsplit('/', 1)[-1] in ('.zgroup', '.zattrs', '.zarray')}
+    return _to_json({'zarr_consolidated_format': 1, 'metadata': metadata})
+
+
+def new_acquisition_coverage(acquisitions: Iterable[Tuple[BBox, Any]]) -> Callable[[BBox, TimeRange], bool]:
+    """
+    Create a coverage function for :class:`SentinelHubStore` from known acquisitions,
+    e.g. the footprints and times of the features found by a catalog search.
+
+    :param acquisitions: Pairs of a bounding box (x1, y1, x2, y2) in CRS84 coordinates and an acquisition time.
+    :return: A function that tells whether any acquisition intersects a bounding box and time range.
+    """
+    bboxes = []
+    times = []
+    for bbox, time in acquisitions:
+        bboxes.append(bbox)
+        times.append(to_timestamp(time))
+    bboxes = np.array(bboxes, dtype=np.float64).reshape((-1, 4))
+    times = pd.DatetimeIndex(times)
+
+    def coverage(bbox: BBox, time_range: TimeRange) -> bool:
+        x1, y1, x2, y2 = bbox
+        time_start, time_end = time_range
+        found = ((bboxes[:, 0] < x2) & (bboxes[:, 2] > x1) & (bboxes[:, 1] < y2) & (bboxes[:, 3] > y1)
+                 & (times >= time_start) & (times < time_end))
+        return bool(found.any())
+
+    return coverage
+
+
+def split_time_range(time_range: Tuple[str, str], time_period: str) -> List[Tuple[pd.Timestamp, pd.Timestamp]]:
+    """
+    Split *time_range* into consecutive (start, end) ranges of *time_period*, e.g. "1D".
+    The first and last ranges are shorter if *time_range* is not aligned to *time_period*.
+    """
+    time_start, time_end = map(to_timestamp, time_range)
+    if time_end <= time_start:
+        raise ValueError('time_range must have a positive duration')
+    edges = list(pd.date_range(time_start, time_end, freq=time_period))
+    if not edges or edges[0] > time_start:
+        edges.insert(0, time_start)
+    if edges[-1] < time_end:
+        edges.append(time_end)
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def to_timestamp(value) -> pd.Timestamp:
+    """Convert *value*, e.g. "2019-05-01" or a datetime, into a timezone-naive UTC timestamp."""
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.tz_convert(None)
+    return timestamp
+
+
+def format_time(timestamp: pd.Timestamp) -> str:
+    """Format *timestamp* as used in requests and cube attributes, e.g. "2019-05-01T00:00:00Z"."""
+    return timestamp.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def _fill_value(dtype: np.dtype):
+    return np.nan if dtype.kind == 'f' else 0
+
+
+def _fill_value_json(dtype: np.dtype):
+    return 'NaN' if dtype.kind == 'f' else None
+
+
+def _to_json(obj) -> bytes:
+    return json.dumps(obj, indent=2).encode('utf-8')
@@ -0,0 +1,492 @@
+import json
+from typing import Dict, List, Sequence, Tuple, Union
+
+import numpy as np
+
+from xcube_dcfs.encoding import BandEncoding
+from xcube_dcfs.expression import compile_expression
+
+DEFAULT_BBOX = (-180., -90., 180., 90.)
+CRS84 = "http://www.opengis.net/def/crs/OGC/9.5.3/CRS84"
+
+# Identifier of the single response of multi-band requests
+MULTI_BAND_OUTPUT_ID = 'bands'
+
+# Reducers of the samples of all acquisitions within the time range
+TEMPORAL_REDUCERS = ('mean', 'min', 'max', 'median', 'latest', 'latest_cloud_free')
+
+# Bands used to skip samples without data or with clouds if a temporal reducer is given
+DATA_MASK_BAND = 'dataMask'
+CLOUD_MASK_BAND = 'CLM'
+
+
+class RequestTemplate:
+    """
+    A precompiled template for SentinelHub process requests.
+
+    Everything that only depends on the dataset, bands, units, sample types and
+    resampling methods, in particular the evalscript, is computed once, so that
+    per-tile requests are obtained by filling in only the bounding box, size and
+    time range. :meth:`new_request` returns the same requests as
+    :meth:`SentinelHub.new_data_request`, :meth:`new_request_json` returns their
+    JSON encoding, ready to be posted.
+
+    By default, every band is returned as a separate single-band TIFF. If *multi_band*
+    is set, all bands are packed into a single multi-band TIFF with the identifier
+    :const:`MULTI_BAND_OUTPUT_ID`, which requires a common sample type. Use
+    :meth:`split_bands` to get per-band arrays from decoded multi-band responses.
+
+    Derived variables are computed by SentinelHub if *expressions* are given,
+    e.g. ``{"ndvi": "(B08 - B04) / (B08 + B04)"}``, see :func:`compile_expression`.
+    Then only these variables are returned instead of the bands. Expressions may
+    refer to the bands and to variables defined before them.
+
+    If a *temporal_reducer* is given, the samples of all acquisitions within the
+    time range are reduced into a single value per pixel by SentinelHub, skipping
+    samples without data: "mean", "min", "max", "median", the "latest" sample,
+    or the "latest_cloud_free" sample, using SentinelHub's cloud mask. With
+    expressions, the variables are computed per sample before being reduced.
+
+    :param dataset_name: Dataset name, e.g. "S2L1C".
+    :param band_names: Names of the bands to be requested.
+    :param upsampling: Upsampling method.
+    :param downsampling: Downsampling method.
+    :param band_units: Band units, either one for all bands or one per band.
+    :param sample_types: Sample types, either one for all outputs or one per output,
+        i.e. per band or, if given, per expression.
+    :param multi_band: Whether to request a single multi-band output instead of one output per band.
+    :param expressions: Optional mapping from variable names to band math expressions.
+    :param temporal_reducer: Optional temporal reducer, one of :const:`TEMPORAL_REDUCERS`.
+    :param encodings: Optional mapping from output names to encodings, see :func:`plan_encodings`.
+        Values of these outputs are encoded by SentinelHub as compact samples, whose
+        sample types replace those given by *sample_types*.
+    :param fill_no_data: Whether pixels without data become NaN in floating point outputs,
+        as they become fill values in encoded outputs. Otherwise, SentinelHub returns 0.
+    """
+
+    def __init__(self,
+                 dataset_name: str,
+                 band_names: Sequence[str],
+                 upsampling: str = 'BILINEAR',
+                 downsampling: str = 'BILINEAR',
+                 band_units: Union[str, Sequence[str]] = 'reflectance',
+                 sample_types: Union[str, Sequence[str]] = 'FLOAT32',
+                 multi_band: bool = False,
+                 expressions: Dict[str, str] = None,
+                 temporal_reducer: str = None,
+                 encodings: Dict[str, BandEncoding] = None,
+                 fill_no_data: bool = False):
+        output_names = list(expressions) if expressions else list(band_names)
+
+        if isinstance(band_units, str):
+            band_units = [band_units] * len(band_names)
+
+        if isinstance(sample_types, str):
+            sample_types = [sample_types] * len(output_names)
+
+        encodings = {name: encoding for name, encoding in (encodings or {}).items() if name in output_names}
+        if encodings:
+            sample_types = [encodings[name].sample_type if name in encodings else sample_type
+                            for name, sample_type in zip(output_names, sample_types)]
+
+        if multi_band and len(set(sample_types)) > 1:
+            raise ValueError('multi-band requests require a common sample type for all bands')
+
+        if temporal_reducer is not None and temporal_reducer not in TEMPORAL_REDUCERS:
+            raise ValueError(f'temporal_reducer must be one of {TEMPORAL_REDUCERS}')
+
+        self._dataset_name = dataset_name
+        self._band_names = list(band_names)
+        self._band_units = list(band_units)
+        self._output_names = output_names
+        self._sample_types = list(sample_types)
+        self._upsampling = upsampling
+        self._downsampling = downsampling
+        self._multi_band = multi_band
+        fill_no_data = fill_no_data and any(_is_float(sample_type) for sample_type in self._sample_types)
+        if expressions or temporal_reducer or fill_no_data \
+                or any(not encoding.is_identity for encoding in encodings.values()):
+            self._evalscript = new_expression_evalscript(self._band_names, self._band_units,
+                                                         expressions or {name: name for name in band_names},
+                                                         self._sample_types,
+                                                         temporal_reducer=temporal_reducer,
+                                                         multi_band=multi_band,
+                                                         encodings=encodings,
+                                                         fill_no_data=fill_no_data)
+        elif multi_band:
+            self._evalscript = new_multi_band_evalscript(self._band_names, self._band_units, self._sample_types[0])
+        else:
+            self._evalscript = new_evalscript(self._band_names, self._band_units, self._sample_types)
+
+        # Pre-serialized JSON fragments, see new_request_json()
+        self._json_input_head = '{"input": {"bounds": {"bbox": '
+        self._json_data_head = (', "properties": {"crs": ' + json.dumps(CRS84) + '}}, '
+                                + '"data": [{"type": ' + json.dumps(dataset_name)
+                                + ', "processing": ' + json.dumps(self._new_processing_element()))
+        self._json_output_tail = (', "responses": ' + json.dumps(self._new_responses_element())
+                                  + '}, "evalscript": ' + json.dumps(self._evalscript) + '}')
+
+    @property
+    def dataset_name(self) -> str:
+        return self._dataset_name
+
+    @property
+    def band_names(self) -> List[str]:
+        return list(self._band_names)
+
+    @property
+    def output_names(self) -> List[str]:
+        """The names of the returned variables, the band names or the names of the expressions."""
+        return list(self._output_names)
+
+    @property
+    def sample_types(self) -> List[str]:
+        return list(self._sample_types)
+
+    @property
+    def multi_band(self) -> bool:
+        return self._multi_band
+
+    @property
+    def evalscript(self) -> str:
+        return self._evalscript
+
+    def split_bands(self, arrays: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        """
+        Get per-output arrays from the decoded response to a request of this template.
+
+        For multi-band requests, the result contains views into the (band, y, x) array
+        of the single output, otherwise *arrays* is returned unchanged.
+        """
+        if not self._multi_band:
+            return arrays
+        data = arrays[MULTI_BAND_OUTPUT_ID]
+        if data.ndim == 2:
+            data = data[np.newaxis, ...]
+        return {name: data[i] for i, name in enumerate(self._output_names)}
+
+    def new_request(self,
+                    size: Tuple[int, int],
+                    time_range: Tuple[str, str] = None,
+                    bbox: Tuple[float, float, float, float] = None) -> Dict:
+        """Create a new request for the given *size*, *time_range*, and *bbox*."""
+        if bbox is None:
+            bbox = DEFAULT_BBOX
+
+        data_element = {
+            "type": self._dataset_name,
+            "processing": self._new_processing_element(),
+        }
+
+        time_range_element = _new_time_range_element(time_range)
+        if time_range_element is not None:
+            data_element["dataFilter"] = dict(timeRange=time_range_element)
+
+        width, height = size
+        return {
+            "input": {
+                "bounds": {
+                    "bbox": [float(c) for c in bbox],
+                    "properties": {
+                        "crs": CRS84
+                    }
+                },
+                "data": [data_element]
+            },
+            "output": {
+                "width": int(width),
+                "height": int(height),
+                "responses": self._new_responses_element()
+            },
+            "evalscript": self._evalscript
+        }
+
+    def new_request_json(self,
+                         size: Tuple[int, int],
+                         time_range: Tuple[str, str] = None,
+                         bbox: Tuple[float, float, float, float] = None) -> bytes:
+        """
+        Create the JSON encoding of a new request for the given *size*, *time_range*, and *bbox*.
+
+        The result equals ``json.dumps(self.new_request(size, time_range, bbox)).encode()``,
+        but only the variable parts are encoded on each call.
+        """
+        if bbox is None:
+            bbox = DEFAULT_BBOX
+        width, height = size
+        parts = [self._json_input_head,
+                 json.dumps([float(c) for c in bbox]),
+                 self._json_data_head]
+        time_range_element = _new_time_range_element(time_range)
+        if time_range_element is not None:
+            parts.extend([', "dataFilter": {"timeRange": ', json.dumps(time_range_element), '}'])
+        parts.extend(['}]}, "output": {"width": ', str(int(width)),
+                      ', "height": ', str(int(height)),
+                      self._json_output_tail])
+        return ''.join(parts).encode('utf-8')
+
+    def _new_processing_element(self) -> Dict:
+        return {
+            "upsampling": self._upsampling,
+            "downsampling": self._downsampling
+        }
+
+    def _new_responses_element(self) -> List[Dict]:
+        identifiers = [MULTI_BAND_OUTPUT_ID] if self._multi_band else self._output_names
+        return [{
+            "identifier": identifier,
+            "format": {
+                "type": "image/tiff"
+            }
+        } for identifier in identifiers]
+
+
+def new_evalscript(band_names: Sequence[str],
+                   band_units: Sequence[str],
+                   sample_types: Sequence[str]) -> str:
+    """Create an evalscript that outputs each band as a separate single-band response."""
+    evalscript = []
+    evalscript.extend([
+        "//VERSION=3",
+        "function setup() {",
+        "    return {",
+        "        input: [{",
+        "            bands: [" + ", ".join(map(repr, band_names)) + "],",
+        "            units: [" + ", ".join(map(repr, band_units)) + "],",
+        "        }],",
+        "        output: [",
+    ])
+    evalscript.extend(["            {id: " + repr(band_name) + ", bands: 1, sampleType: " + repr(sample_type) + "},"
+                       for band_name, sample_type in zip(band_names, sample_types)])
+    evalscript.extend([
+        "        ]",
+        "    };",
+        "}"
+    ])
+    # if len(band_names) > 1:
+    if len(band_names) > 0:
+        evalscript.extend([
+            "function evaluatePixel(sample) {",
+            "    return {",
+        ])
+        evalscript.extend(["        " + band_name + ": [sample." + band_name + "]," for band_name in band_names])
+        evalscript.extend([
+            "    };",
+            "}",
+        ])
+    else:
+        # Doesn't work, buts docs say so: https://docs.sentinel-hub.com/api/latest/#/Evalscript/V3/README
+        evalscript.extend([
+            "function evaluatePixel(sample) {",
+            "    return [sample." + band_names[0] + "];",
+            "}",
+        ])
+    return "\n".join(evalscript)
+
+
+def new_multi_band_evalscript(band_names: Sequence[str],
+                              band_units: Sequence[str],
+                              sample_type: str) -> str:
+    """Create an evalscript that outputs all bands as a single multi-band response."""
+    return "\n".join([
+        "//VERSION=3",
+        "function setup() {",
+        "    return {",
+        "        input: [{",
+        "            bands: [" + ", ".join(map(repr, band_names)) + "],",
+        "            units: [" + ", ".join(map(repr, band_units)) + "],",
+        "        }],",
+        "        output: [",
+        "            {id: " + repr(MULTI_BAND_OUTPUT_ID) + ", bands: " + str(len(band_names))
+        + ", sampleType: " + repr(sample_type) + "},",
+        "        ]",
+        "    };",
+        "}",
+        "function evaluatePixel(sample) {",
+        "    return {",
+        "        " + MULTI_BAND_OUTPUT_ID + ": [" + ", ".join("sample." + band_name for band_name in band_names) + "],",
+        "    };",
+        "}",
+    ])
+
+
+def new_expression_evalscript(band_names: Sequence[str],
+                              band_units: Sequence[str],
+                              expressions: Dict[str, str],
+                              sample_types: Sequence[str],
+                              temporal_reducer: str = None,
+                              multi_band: bool = False,
+                              encodings: Dict[str, BandEncoding] = None,
+                              fill_no_data: bool = False) -> str:
+    """
+    Create an evalscript that outputs variables computed from band math *expressions*,
+    optionally reduced over time by *temporal_reducer* and encoded as given by
+    *encodings*, with NaN for pixels without data in floating point outputs if
+    *fill_no_data* is set, see :class:`RequestTemplate`.
+    """
+    band_names = list(band_names)
+    band_units = list(band_units)
+    encodings = {name: encoding for name, encoding in (encodings or {}).items() if not encoding.is_identity}
+    mask_bands = []
+    if temporal_reducer is not None or encodings or fill_no_data:
+        mask_bands.append(DATA_MASK_BAND)
+    if temporal_reducer == 'latest_cloud_free':
+        mask_bands.append(CLOUD_MASK_BAND)
+    if mask_bands:
+        for mask_band in mask_bands:
+            if mask_band not in band_names:
+                band_names.append(mask_band)
+                band_units.append('DN')
+
+    # Variables are local variables of evaluatePixel(), named like the expressions
+    names = {band_name: 'sample.' + band_name for band_name in band_names}
+    statements = []
+    for name, expression in expressions.items():
+        if not name.isidentifier():
+            raise ValueError(f'invalid variable name {name!r}')
+        statements.append(f'var {name} = {compile_expression(expression, names)};')
+        names[name] = name
+
+    if multi_band:
+        outputs = ["{id: " + repr(MULTI_BAND_OUTPUT_ID) + ", bands: " + str(len(expressions))
+                   + ", sampleType: " + repr(sample_types[0]) + "},"]
+    else:
+        outputs = ["{id: " + repr(name) + ", bands: 1, sampleType: " + repr(sample_type) + "},"
+                   for name, sample_type in zip(expressions, sample_types)]
+
+    evalscript = [
+        "//VERSION=3",
+        "function setup() {",
+        "    return {",
+        "        input: [{",
+        "            bands: [" + ", ".join(map(repr, band_names)) + "],",
+        "            units: [" + ", ".join(map(repr, band_units)) + "],",
+        "        }],",
+        "        output: [",
+    ]
+    evalscript.extend("            " + output for output in outputs)
+    evalscript.append("        ],")
+    if temporal_reducer is not None:
+        evalscript.append("        mosaicking: 'ORBIT',")
+    evalscript.extend([
+        "    };",
+        "}",
+    ])
+
+    if encodings:
+        evalscript.extend(_ENCODE_SCRIPT)
+
+    if temporal_reducer is None:
+        # Pixels without data become NaN, so that they are encoded as fill values
+        masked_names = set(encodings)
+        if fill_no_data:
+            masked_names.update(name for name, sample_type in zip(expressions, sample_types)
+                                if _is_float(sample_type) and name != DATA_MASK_BAND)
+        values = {name: (f'(sample.{DATA_MASK_BAND} === 0 ? NaN : {name})' if name in masked_names else name)
+                  for name in expressions}
+        evalscript.append("function evaluatePixel(sample) {")
+        evalscript.extend("    " + statement for statement in statements)
+    else:
+        # Collect the values of all valid samples, most recent first, and reduce them
+        values = {name: f'{_REDUCER_FUNCTIONS[temporal_reducer]}(values_{name})' for name in expressions}
+        evalscript.extend(_REDUCER_SCRIPTS[temporal_reducer])
+        evalscript.append("function evaluatePixel(samples) {")
+        evalscript.extend(f"    var values_{name} = [];" for name in expressions)
+        evalscript.extend([
+            "    for (var i = 0; i < samples.length; i++) {",
+            "        var sample = samples[i];",
+            "        if (sample." + DATA_MASK_BAND + " === 0) continue;",
+        ])
+        if temporal_reducer == 'latest_cloud_free':
+            evalscript.append("        if (sample." + CLOUD_MASK_BAND + " === 1) continue;")
+        evalscript.extend("        " + statement for statement in statements)
+        evalscript.extend(f"        values_{name}.push({name});" for name in expressions)
+        evalscript.append("    }")
+
+    for name, encoding in encodings.items():
+        if name in values:
+            min_value, max_value = encoding.valid_range or ('-Infinity', 'Infinity')
+            fill_value = encoding.fill_value if encoding.fill_value is not None else 'NaN'
+            values[name] = (f'encode({values[name]}, {encoding.scale_factor!r}, {encoding.add_offset!r}, '
+                            f'{fill_value}, {min_value}, {max_value})')
+
+    evalscript.append("    return {")
+    if multi_band:
+        evalscript.append("        " + MULTI_BAND_OUTPUT_ID + ": [" + ", ".join(values.values()) + "],")
+    else:
+        evalscript.extend(f"        {name}: [{value}]," for name, value in values.items())
+    evalscript.extend([
+        "    };",
+        "}",
+    ])
+    return "\n".join(evalscript)
+
+
+_ENCODE_SCRIPT = [
+    "function encode(value, scale, offset, fill, min, max) {",
+    "    if (value === null || !isFinite(value)) return fill;",
+    "    return Math.min(Math.max(Math.round((value - offset) / scale), min), max);",
+    "}",
+]
+
+_REDUCER_FUNCTIONS = {
+    'mean': 'mean',
+    'min': 'minimum',
+    'max': 'maximum',
+    'median': 'median',
+    'latest': 'first',
+    'latest_cloud_free': 'first',
+}
+
+_FIRST_SCRIPT = [
+    "function first(values) {",
+    "    return values.length ? values[0] : NaN;",
+    "}",
+]
+
+_REDUCER_SCRIPTS = {
+    'mean': [
+        "function mean(values) {",
+        "    if (!values.length) return NaN;",
+        "    var sum = 0;",
+        "    for (var i = 0; i < values.length; i++) sum += values[i];",
+        "    return sum / values.length;",
+        "}",
+    ],
+    'min': [
+        "function minimum(values) {",
+        "    return values.length ? Math.min.apply(null, values) : NaN;",
+        "}",
+    ],
+    'max': [
+        "function maximum(values) {",
+        "    return values.length ? Math.max.apply(null, values) : NaN;",
+        "}",
+    ],
+    'median': [
+        "function median(values) {",
+        "    if (!values.length) return NaN;",
+        "    values.sort(function (a, b) { return a - b; });",
+        "    var m = Math.floor(values.length / 2);",
+        "    return values.length % 2 ? values[m] : (values[m - 1] + values[m]) / 2;",
+        "}",
+    ],
+    'latest': _FIRST_SCRIPT,
+    'latest_cloud_free': _FIRST_SCRIPT,
+}
+
+
+def _is_float(sample_type: str) -> bool:
+    return sample_type.startswith('FLOAT')
+
+
+def _new_time_range_element(time_range: Tuple[str, str]):
+    if time_range is None:
+        return None
+    time_range_from, time_range_to = time_range
+    time_range_element = {}
+    if time_range_from:
+        time_range_element['from'] = str(time_range_from)
+    if time_range_to:
+        time_range_element['to'] = str(time_range_to)
+    return time_range_element
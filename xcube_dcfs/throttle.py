@@ -0,0 +1,64 @@
+import threading
+import time
+from typing import Optional
+
+
+class Throttle:
+    """
+    An adaptive, thread-safe pacer for requests to a rate-limited service.
+
+    Before sending a request, callers invoke :meth:`wait`. Whenever the service
+    responds with HTTP 429, :meth:`on_throttled` blocks all callers until the
+    server's "Retry-After" period has passed and doubles the minimum interval
+    between request starts. Every successful response halves that interval again,
+    so the request rate converges to what the service tolerates.
+
+    :param min_interval: Initial and minimum interval between request starts in seconds.
+    :param max_interval: Upper limit for the interval between request starts in seconds.
+    :param backoff_interval: Interval in seconds used after the first 429 response,
+        and as pause if the server does not provide a "Retry-After" value.
+    """
+
+    def __init__(self,
+                 min_interval: float = 0.0,
+                 max_interval: float = 10.0,
+                 backoff_interval: float = 0.1):
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._backoff_interval = backoff_interval
+        self._interval = min_interval
+        self._next_time = 0.0
+        self._num_throttled = 0
+        self._lock = threading.Lock()
+
+    @property
+    def interval(self) -> float:
+        """The current minimum interval between request starts in seconds."""
+        return self._interval
+
+    @property
+    def num_throttled(self) -> int:
+        """The number of throttled responses reported so far."""
+        return self._num_throttled
+
+    def wait(self):
+        """Block until the next request may be started."""
+        with self._lock:
+            now = time.monotonic()
+            start_time = max(now, self._next_time)
+            self._next_time = start_time + self._interval
+        delay = start_time - now
+        if delay > 0:
+            time.sleep(delay)
+
+    def on_success(self):
+        with self._lock:
+            interval = self._interval / 2
+            self._interval = interval if interval > self._min_interval + 1e-3 else self._min_interval
+
+    def on_throttled(self, retry_after: Optional[float] = None):
+        with self._lock:
+            self._num_throttled += 1
+            self._interval = min(self._max_interval, max(2 * self._interval, self._backoff_interval))
+            pause = retry_after if retry_after is not None else self._interval
+            self._next_time = max(self._next_time, time.monotonic() + pause)
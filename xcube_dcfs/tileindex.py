@@ -0,0 +1,232 @@
+import collections
+import copy
+import json
+import math
+import threading
+from typing import Callable, Dict, Hashable, List, Optional, Tuple, Union
+
+import numpy as np
+
+from xcube_dcfs.cache import request_hash
+
+DEFAULT_MAX_INDEX_SIZE = 2 ** 29
+DEFAULT_CELL_SIZE = 256
+
+Arrays = Dict[str, np.ndarray]
+
+
+class TileIndex:
+    """
+    A spatial index of tiles held in memory, used to answer requests for
+    regions that have been fetched before without going to the service.
+
+    Tiles are grouped into layers of equal dataset, time range, bands, evalscript,
+    resolution, and pixel grid alignment, so tiles of a layer can be combined
+    pixel by pixel. Within a layer, tiles are found using a regular grid of cells
+    of *cell_size* pixels.
+
+    A request that is fully covered by tiles of its layer is answered by cropping
+    and mosaicking them. Of a partially covered request, only the smallest
+    rectangle enclosing the uncovered pixels is fetched. Once the total size of
+    all tiles exceeds *max_size*, the least recently used tiles are dropped.
+
+    :param max_size: Maximum total size of all held arrays in bytes.
+    :param cell_size: Width and height of the index cells in pixels.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_MAX_INDEX_SIZE, cell_size: int = DEFAULT_CELL_SIZE):
+        self._max_size = max_size
+        self._cell_size = cell_size
+        self._lock = threading.Lock()
+        # Least recently used tiles first
+        self._tiles: Dict[int, _Tile] = collections.OrderedDict()
+        self._cells: Dict[Tuple[Hashable, int, int], List[int]] = collections.defaultdict(list)
+        self._next_id = 0
+        self._size = 0
+        self._hits = 0
+        self._partial_hits = 0
+        self._misses = 0
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Numbers of requests answered locally, partially, and not at all, and the held tiles and bytes."""
+        with self._lock:
+            return dict(hits=self._hits,
+                        partial_hits=self._partial_hits,
+                        misses=self._misses,
+                        tiles=len(self._tiles),
+                        size=self._size)
+
+    def get_arrays(self, request: Union[Dict, bytes], fetch: Callable[[Dict], Arrays]) -> Arrays:
+        """
+        Get the arrays for *request*, using held tiles where possible.
+
+        :param request: A request as returned by :meth:`SentinelHub.new_data_request`, or its JSON encoding.
+        :param fetch: Function that gets the arrays of a request from the service.
+        :return: A mapping from output identifiers to arrays, as returned by :meth:`SentinelHub.get_arrays`.
+        """
+        if isinstance(request, bytes):
+            request = json.loads(request)
+        region = _Region.from_request(request)
+        if region is None:
+            return fetch(request)
+
+        outputs, covered = self._mosaic(region)
+        if outputs is not None and covered.all():
+            with self._lock:
+                self._hits += 1
+            return outputs
+
+        if outputs is None:
+            sub_region = region
+        else:
+            rows, cols = np.nonzero(~covered)
+            sub_region = region.crop(rows.min(), cols.min(), rows.max() + 1, cols.max() + 1)
+        arrays = fetch(sub_region.new_request(request))
+        self._add(sub_region, arrays)
+
+        if outputs is None:
+            with self._lock:
+                self._misses += 1
+            return arrays
+        with self._lock:
+            self._partial_hits += 1
+        for identifier, output in outputs.items():
+            row, col = sub_region.row - region.row, sub_region.col - region.col
+            output[..., row: row + sub_region.height, col: col + sub_region.width] = arrays[identifier]
+        return outputs
+
+    def clear(self):
+        with self._lock:
+            self._tiles.clear()
+            self._cells.clear()
+            self._size = 0
+
+    def _mosaic(self, region: '_Region') -> Tuple[Optional[Arrays], Optional[np.ndarray]]:
+        with self._lock:
+            tiles = [self._tiles[tile_id] for tile_id in self._find(region)]
+            for tile in tiles:
+                self._tiles.move_to_end(tile.id)
+        if not tiles:
+            return None, None
+        covered = np.zeros((region.height, region.width), dtype=bool)
+        outputs = {identifier: np.empty(array.shape[:-2] + (region.height, region.width), dtype=array.dtype)
+                   for identifier, array in tiles[0].arrays.items()}
+        for tile in tiles:
+            row1, col1 = max(region.row, tile.region.row), max(region.col, tile.region.col)
+            row2 = min(region.row + region.height, tile.region.row + tile.region.height)
+            col2 = min(region.col + region.width, tile.region.col + tile.region.width)
+            target = (slice(row1 - region.row, row2 - region.row), slice(col1 - region.col, col2 - region.col))
+            source = (slice(row1 - tile.region.row, row2 - tile.region.row),
+                      slice(col1 - tile.region.col, col2 - tile.region.col))
+            for identifier, output in outputs.items():
+                output[(Ellipsis,) + target] = tile.arrays[identifier][(Ellipsis,) + source]
+            covered[target] = True
+        return outputs, covered
+
+    def _find(self, region: '_Region') -> List[int]:
+        tile_ids = set()
+        for cell in self._cells_of(region):
+            for tile_id in self._cells.get(cell, ()):
+                if self._tiles[tile_id].region.intersects(region):
+                    tile_ids.add(tile_id)
+        return sorted(tile_ids)
+
+    def _add(self, region: '_Region', arrays: Arrays):
+        # Copy, so that callers may modify the returned arrays
+        arrays = {identifier: array.copy() for identifier, array in arrays.items()}
+        for array in arrays.values():
+            array.flags.writeable = False
+        with self._lock:
+            tile = _Tile(self._next_id, region, arrays)
+            self._next_id += 1
+            self._tiles[tile.id] = tile
+            for cell in self._cells_of(region):
+                self._cells[cell].append(tile.id)
+            self._size += tile.size
+            while self._size > self._max_size and len(self._tiles) > 1:
+                _, evicted = self._tiles.popitem(last=False)
+                for cell in self._cells_of(evicted.region):
+                    tile_ids = self._cells[cell]
+                    tile_ids.remove(evicted.id)
+                    if not tile_ids:
+                        del self._cells[cell]
+                self._size -= evicted.size
+
+    def _cells_of(self, region: '_Region'):
+        cell_size = self._cell_size
+        for cell_y in range(region.row // cell_size, (region.row + region.height - 1) // cell_size + 1):
+            for cell_x in range(region.col // cell_size, (region.col + region.width - 1) // cell_size + 1):
+                yield region.layer, cell_y, cell_x
+
+
+class _Tile:
+    def __init__(self, tile_id: int, region: '_Region', arrays: Arrays):
+        self.id = tile_id
+        self.region = region
+        self.arrays = arrays
+        self.size = sum(array.nbytes for array in arrays.values())
+
+
+class _Region:
+    """A rectangle of pixels of a layer. Rows count southwards from the equator, columns eastwards."""
+
+    def __init__(self, layer: Hashable, res: Tuple[float, float], row: int, col: int, width: int, height: int):
+        self.layer = layer
+        self.res = res
+        self.row = row
+        self.col = col
+        self.width = width
+        self.height = height
+
+    @classmethod
+    def from_request(cls, request: Dict) -> Optional['_Region']:
+        try:
+            x1, y1, x2, y2 = request['input']['bounds']['bbox']
+            width = int(request['output']['width'])
+            height = int(request['output']['height'])
+        except (KeyError, TypeError, ValueError):
+            return None
+        if width <= 0 or height <= 0 or x2 <= x1 or y2 <= y1:
+            return None
+        res_x = float(f'{(x2 - x1) / width:.12g}')
+        res_y = float(f'{(y2 - y1) / height:.12g}')
+        col_f = x1 / res_x
+        row_f = -y2 / res_y
+        # Sub-pixel offsets of the pixel grid, so that tiles of a layer are aligned with each other
+        phase_x = round(col_f - math.floor(col_f), 4) % 1.0
+        phase_y = round(row_f - math.floor(row_f), 4) % 1.0
+        col = round(col_f - phase_x)
+        row = round(row_f - phase_y)
+        layer = (_layer_key(request), res_x, res_y, phase_x, phase_y)
+        return _Region(layer, (res_x, res_y), row, col, width, height)
+
+    def intersects(self, other: '_Region') -> bool:
+        return (self.layer == other.layer
+                and self.col < other.col + other.width and other.col < self.col + self.width
+                and self.row < other.row + other.height and other.row < self.row + self.height)
+
+    def crop(self, row1: int, col1: int, row2: int, col2: int) -> '_Region':
+        """Get the sub-region of the given rows and columns relative to this region."""
+        return _Region(self.layer, self.res, self.row + row1, self.col + col1, col2 - col1, row2 - row1)
+
+    def new_request(self, request: Dict) -> Dict:
+        """Copy *request* for the bounding box and size of this region."""
+        _, _, _, phase_x, phase_y = self.layer
+        res_x, res_y = self.res
+        x1 = (self.col + phase_x) * res_x
+        y2 = -(self.row + phase_y) * res_y
+        request = copy.deepcopy(request)
+        request['input']['bounds']['bbox'] = [x1, y2 - self.height * res_y, x1 + self.width * res_x, y2]
+        request['output']['width'] = self.width
+        request['output']['height'] = self.height
+        return request
+
+
+def _layer_key(request: Dict) -> str:
+    # Everything but the bounding box and size
+    request = copy.deepcopy(request)
+    del request['input']['bounds']['bbox']
+    del request['output']['width']
+    del request['output']['height']
+    return request_hash(request)
@@ -0,0 +1,191 @@
+import math
+from typing import Iterator, NamedTuple, Sequence, Tuple, Union, Dict
+
+import numpy as np
+import xarray as xr
+
+from xcube_dcfs.sentinelhub import SentinelHub, SAMPLE_TYPE_TO_DTYPE, DEFAULT_MAX_WORKERS, SentinelHubError
+from xcube_dcfs.template import RequestTemplate
+
+# Maximum width and height of a single SentinelHub process request's output
+DEFAULT_MAX_TILE_SIZE = (2500, 2500)
+DEFAULT_CHUNK_SIZE = (512, 512)
+
+
+class Tile(NamedTuple):
+    """A tile of a :class:`TileGrid`. Pixel offsets *x* and *y* count from the upper left corner."""
+    tile_x: int
+    tile_y: int
+    x: int
+    y: int
+    width: int
+    height: int
+    bbox: Tuple[float, float, float, float]
+
+
+class TileGrid:
+    """
+    A regular grid of tiles covering a bounding box at a given spatial resolution.
+
+    Tiles are enumerated row by row, starting in the north-west. Tiles in the
+    last column and row may be smaller than *tile_size*.
+
+    :param bbox: Bounding box (x1, y1, x2, y2) in CRS84 coordinates.
+    :param spatial_res: Spatial resolution in degrees.
+    :param tile_size: Tile size (width, height) in pixels.
+    """
+
+    def __init__(self,
+                 bbox: Tuple[float, float, float, float],
+                 spatial_res: float,
+                 tile_size: Tuple[int, int]):
+        x1, y1, x2, y2 = bbox
+        width = int(round((x2 - x1) / spatial_res))
+        height = int(round((y2 - y1) / spatial_res))
+        if width <= 0 or height <= 0:
+            raise ValueError('bbox must have a positive extent')
+        tile_width, tile_height = tile_size
+        if tile_width <= 0 or tile_height <= 0:
+            raise ValueError('tile_size must be positive')
+        self._bbox = tuple(bbox)
+        self._spatial_res = spatial_res
+        self._size = width, height
+        self._tile_size = tile_width, tile_height
+        self._num_tiles = math.ceil(width / tile_width), math.ceil(height / tile_height)
+
+    @classmethod
+    def plan(cls,
+             bbox: Tuple[float, float, float, float],
+             spatial_res: float,
+             chunk_size: Tuple[int, int] = DEFAULT_CHUNK_SIZE,
+             max_tile_size: Tuple[int, int] = DEFAULT_MAX_TILE_SIZE) -> 'TileGrid':
+        """
+        Plan a tile grid whose tiles are as large as possible without exceeding
+        *max_tile_size*, and whose tile boundaries are aligned with chunks of *chunk_size*.
+        """
+        width = int(round((bbox[2] - bbox[0]) / spatial_res))
+        height = int(round((bbox[3] - bbox[1]) / spatial_res))
+        tile_size = tuple(_fit_tile_length(length, chunk_length, max_length)
+                          for length, chunk_length, max_length in zip((width, height), chunk_size, max_tile_size))
+        return TileGrid(bbox, spatial_res, tile_size)
+
+    @property
+    def bbox(self) -> Tuple[float, float, float, float]:
+        return self._bbox
+
+    @property
+    def spatial_res(self) -> float:
+        return self._spatial_res
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return self._size
+
+    @property
+    def tile_size(self) -> Tuple[int, int]:
+        return self._tile_size
+
+    @property
+    def num_tiles(self) -> Tuple[int, int]:
+        return self._num_tiles
+
+    def __len__(self) -> int:
+        return self._num_tiles[0] * self._num_tiles[1]
+
+    def __iter__(self) -> Iterator[Tile]:
+        num_tiles_x, num_tiles_y = self._num_tiles
+        for tile_y in range(num_tiles_y):
+            for tile_x in range(num_tiles_x):
+                yield self.tile(tile_x, tile_y)
+
+    def tile(self, tile_x: int, tile_y: int) -> Tile:
+        x1, y1, x2, y2 = self._bbox
+        width, height = self._size
+        tile_width, tile_height = self._tile_size
+        res = self._spatial_res
+        x = tile_x * tile_width
+        y = tile_y * tile_height
+        w = min(tile_width, width - x)
+        h = min(tile_height, height - y)
+        if w <= 0 or h <= 0 or x < 0 or y < 0:
+            raise IndexError(f'tile index ({tile_x}, {tile_y}) out of range')
+        return Tile(tile_x, tile_y, x, y, w, h, (x1 + x * res, y2 - (y + h) * res, x1 + (x + w) * res, y2 - y * res))
+
+    def lon_values(self) -> np.ndarray:
+        return self._bbox[0] + (np.arange(self._size[0], dtype=np.float64) + 0.5) * self._spatial_res
+
+    def lat_values(self) -> np.ndarray:
+        return self._bbox[3] - (np.arange(self._size[1], dtype=np.float64) + 0.5) * self._spatial_res
+
+
+def fetch_mosaic(sentinel_hub: SentinelHub,
+                 dataset_name: str,
+                 band_names: Sequence[str],
+                 bbox: Tuple[float, float, float, float],
+                 spatial_res: float,
+                 time_range: Tuple[str, str] = None,
+                 chunk_size: Tuple[int, int] = DEFAULT_CHUNK_SIZE,
+                 max_tile_size: Tuple[int, int] = DEFAULT_MAX_TILE_SIZE,
+                 band_units: Union[str, Sequence[str]] = 'reflectance',
+                 sample_types: Union[str, Sequence[str]] = 'FLOAT32',
+                 multi_band: bool = False,
+                 max_workers: int = DEFAULT_MAX_WORKERS) -> xr.Dataset:
+    """
+    Fetch an image of arbitrary size by splitting it into tile requests that
+    fit the service's limits, and mosaic the results.
+
+    Tiles are fetched concurrently and each decoded tile is written directly
+    into its window of the preallocated output arrays. If *multi_band* is set,
+    each tile is requested as a single multi-band TIFF instead of one TIFF per band.
+
+    :return: A dataset with a variable of dimensions ("lat", "lon") for each band.
+    """
+    if isinstance(sample_types, str):
+        sample_types = [sample_types] * len(band_names)
+
+    grid = TileGrid.plan(bbox, spatial_res, chunk_size=chunk_size, max_tile_size=max_tile_size)
+    tiles = list(grid)
+    template = RequestTemplate(dataset_name, band_names, band_units=band_units, sample_types=sample_types,
+                               multi_band=multi_band)
+    requests = [template.new_request((tile.width, tile.height), time_range=time_range, bbox=tile.bbox)
+                for tile in tiles]
+
+    width, height = grid.size
+    outputs = {band_name: np.empty((height, width), dtype=SAMPLE_TYPE_TO_DTYPE[sample_type])
+               for band_name, sample_type in zip(band_names, sample_types)}
+    for index, result in sentinel_hub.get_arrays_many(requests, max_workers=max_workers):
+        if isinstance(result, SentinelHubError):
+            raise result
+        tile = tiles[index]
+        result = template.split_bands(result)
+        for band_name, output in outputs.items():
+            output[tile.y: tile.y + tile.height, tile.x: tile.x + tile.width] = result[band_name]
+
+    return new_dataset(grid, outputs, title=f'{dataset_name} Mosaic')
+
+
+def new_dataset(grid: TileGrid, arrays: Dict[str, np.ndarray], title: str = None) -> xr.Dataset:
+    """Create a dataset from the 2D *arrays* covering the given *grid*."""
+    x1, y1, x2, y2 = grid.bbox
+    lon = xr.DataArray(grid.lon_values(), dims='lon', attrs=dict(units='degrees_east'))
+    lat = xr.DataArray(grid.lat_values(), dims='lat', attrs=dict(units='degrees_north'))
+    attrs = dict(Conventions='CF-1.7',
+                 geospatial_lon_min=x1,
+                 geospatial_lon_max=x2,
+                 geospatial_lon_units='degrees_east',
+                 geospatial_lat_min=y1,
+                 geospatial_lat_max=y2,
+                 geospatial_lat_units='degrees_north')
+    if title:
+        attrs['title'] = title
+    return xr.Dataset({name: (('lat', 'lon'), array) for name, array in arrays.items()},
+                      coords=dict(lon=lon, lat=lat),
+                      attrs=attrs)
+
+
+def _fit_tile_length(length: int, chunk_length: int, max_length: int) -> int:
+    if chunk_length > max_length:
+        raise ValueError(f'chunk size {chunk_length} exceeds maximum tile size {max_length}')
+    if length <= max_length:
+        return length
+    return (max_length // chunk_length) * chunk_length
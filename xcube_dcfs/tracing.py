@@ -0,0 +1,177 @@
+import collections
+import threading
+import time
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Sequence
+
+import zarr
+
+from xcube_dcfs.instrument import DEFAULT_TIME_BUCKETS, Histogram
+
+DEFAULT_MAX_EVENTS = 10000
+
+# Classes of accesses: metadata keys, chunk keys, and listings of keys
+KEY_CLASSES = ('metadata', 'chunk', 'listing')
+
+
+class AccessEvent(NamedTuple):
+    """A single access to a store."""
+    operation: str
+    key: Optional[str]
+    key_class: str
+    duration: float
+    size: int
+    found: bool
+
+
+class TracingStore(MutableMapping):
+    """
+    A Zarr store that passes all accesses to another *store* and records them.
+
+    For every class of keys, i.e. "metadata" keys such as ".zarray", "chunk"
+    keys, and "listing" operations without a key, the numbers of accesses per
+    operation, of misses, of distinct and repeatedly accessed keys, the number
+    of bytes read and written, and a histogram of the latencies are recorded,
+    see :attr:`stats` and :meth:`report`. The most recent accesses are kept
+    in order as :attr:`events`, which shows the access pattern of a workload,
+    e.g. the metadata probes of ``xr.open_zarr()`` before any chunk is read.
+
+    :param store: The wrapped store.
+    :param max_events: Maximum number of most recent accesses kept as events.
+    :param buckets: Upper bounds of the histogram buckets for latencies in seconds.
+    """
+
+    def __init__(self,
+                 store: MutableMapping,
+                 max_events: int = DEFAULT_MAX_EVENTS,
+                 buckets: Sequence[float] = DEFAULT_TIME_BUCKETS):
+        self._store = store
+        self._max_events = max_events
+        self._buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self.reset()
+
+    @property
+    def store(self) -> MutableMapping:
+        return self._store
+
+    @property
+    def events(self) -> List[AccessEvent]:
+        """The most recent accesses, oldest first."""
+        with self._lock:
+            return list(self._events)
+
+    @property
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Statistics of the accesses for each key class, as JSON-serializable dictionary."""
+        with self._lock:
+            return {key_class: dict(operations=dict(self._operations[key_class]),
+                                    accesses=self._latencies[key_class].count,
+                                    misses=self._misses[key_class],
+                                    keys=len(self._keys[key_class]),
+                                    repeated=self._repeated[key_class],
+                                    bytes=self._bytes[key_class],
+                                    time=self._latencies[key_class].sum,
+                                    latencies=self._latencies[key_class].to_dict())
+                    for key_class in KEY_CLASSES}
+
+    def report(self) -> str:
+        """Get a table of the numbers of accesses, misses, bytes, and times per key class and operation."""
+        lines = [f'{"class":<10} {"operation":<10} {"count":>8} {"misses":>8} {"MB":>10} {"total ms":>10}']
+        with self._lock:
+            totals = dict(self._totals)
+        for (key_class, operation), (count, misses, size, duration) in sorted(totals.items()):
+            lines.append(f'{key_class:<10} {operation:<10} {count:>8} {misses:>8}'
+                         f' {size / 2 ** 20:>10.3f} {1000 * duration:>10.1f}')
+        return '\n'.join(lines)
+
+    def reset(self):
+        """Forget all recorded accesses."""
+        with self._lock:
+            self._events = collections.deque(maxlen=self._max_events)
+            self._operations = {key_class: collections.Counter() for key_class in KEY_CLASSES}
+            self._misses = {key_class: 0 for key_class in KEY_CLASSES}
+            self._keys = {key_class: set() for key_class in KEY_CLASSES}
+            self._repeated = {key_class: 0 for key_class in KEY_CLASSES}
+            self._bytes = {key_class: 0 for key_class in KEY_CLASSES}
+            self._latencies = {key_class: Histogram(self._buckets) for key_class in KEY_CLASSES}
+            # (count, misses, bytes, time) by (key class, operation)
+            self._totals = collections.defaultdict(lambda: (0, 0, 0, 0.0))
+
+    def listdir(self, path: str = '') -> List[str]:
+        t0 = time.perf_counter()
+        entries = zarr.storage.listdir(self._store, path)
+        self._record('listdir', path, time.perf_counter() - t0, 0, True)
+        return entries
+
+    def __len__(self) -> int:
+        t0 = time.perf_counter()
+        length = len(self._store)
+        self._record('len', None, time.perf_counter() - t0, 0, True)
+        return length
+
+    def __iter__(self) -> Iterator[str]:
+        t0 = time.perf_counter()
+        keys = list(self._store)
+        self._record('iter', None, time.perf_counter() - t0, 0, True)
+        return iter(keys)
+
+    def __contains__(self, key) -> bool:
+        t0 = time.perf_counter()
+        found = key in self._store
+        self._record('contains', key, time.perf_counter() - t0, 0, found)
+        return found
+
+    def __getitem__(self, key: str) -> bytes:
+        t0 = time.perf_counter()
+        try:
+            value = self._store[key]
+        except KeyError:
+            self._record('getitem', key, time.perf_counter() - t0, 0, False)
+            raise
+        self._record('getitem', key, time.perf_counter() - t0, _size_of(value), True)
+        return value
+
+    def __setitem__(self, key: str, value: bytes) -> None:
+        t0 = time.perf_counter()
+        self._store[key] = value
+        self._record('setitem', key, time.perf_counter() - t0, _size_of(value), True)
+
+    def __delitem__(self, key: str) -> None:
+        t0 = time.perf_counter()
+        try:
+            del self._store[key]
+        except KeyError:
+            self._record('delitem', key, time.perf_counter() - t0, 0, False)
+            raise
+        self._record('delitem', key, time.perf_counter() - t0, 0, True)
+
+    def _record(self, operation: str, key: Optional[str], duration: float, size: int, found: bool):
+        key_class = get_key_class(key) if operation not in ('listdir', 'len', 'iter') else 'listing'
+        with self._lock:
+            self._events.append(AccessEvent(operation, key, key_class, duration, size, found))
+            self._operations[key_class][operation] += 1
+            if not found:
+                self._misses[key_class] += 1
+            keys = self._keys[key_class]
+            if key in keys:
+                self._repeated[key_class] += 1
+            else:
+                keys.add(key)
+            self._bytes[key_class] += size
+            self._latencies[key_class].observe(duration)
+            count, misses, total_size, total_duration = self._totals[key_class, operation]
+            self._totals[key_class, operation] = (count + 1, misses + (not found), total_size + size,
+                                                  total_duration + duration)
+
+
+def get_key_class(key: str) -> str:
+    """Get the class of a Zarr store *key*, "metadata" for keys such as ".zarray" or "B04/.zattrs", else "chunk"."""
+    return 'metadata' if str(key).rsplit('/', 1)[-1].startswith('.z') else 'chunk'
+
+
+def _size_of(value) -> int:
+    try:
+        return memoryview(value).nbytes
+    except TypeError:
+        return 0